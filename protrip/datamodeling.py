@@ -7,117 +7,647 @@ model of a given transit network
 """
 
 import numpy as np
+from scipy import sparse
+from collections.abc import Mapping
+from samplestore import MISSING
+
+
+def _lookup(matrix, rows, cols):
+    """
+    Values of a sparse matrix at the given positions, 0 where not stored
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sum_duplicates()
+    coo = matrix.tocoo()
+    keys = coo.row.astype(np.int64)*matrix.shape[1] + coo.col
+    query = rows.astype(np.int64)*matrix.shape[1] + cols
+
+    pos = np.searchsorted(keys, query)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == query[found]
+    values = np.zeros(len(query))
+    values[found] = coo.data[pos[found]]
+    return values
+
+
+def pairwise_cov(store, eids, mask=None, min_common=2):
+    """
+    Pairwise complete covariance between the edges eids of a SampleStore.
+    Builds the edge x trip sample matrix and its missing value mask and
+    gets the moments of all the pairs from three sparse products. Returns
+    for the pairs (i, j) with at least min_common common trips, in row major
+    order, the number of common trips, the means of both edges over the
+    common trips and the co-moment, the covariance being comoment/(n-1).
+    Pairs with less than two common trips have covariance 0. With mask, a boolean array
+    over the samples of the store, only the masked samples are used.
+    """
+    eids = np.asarray(eids)
+    counts = store.counts()[eids]
+    rows = np.repeat(np.arange(len(eids)), counts)
+    index = store.sample_index(eids)
+    if mask is not None:
+        keep = mask[index]
+        rows, index = rows[keep], index[keep]
+        counts = np.bincount(rows, minlength=len(eids))
+    trips, cols = np.unique(store.trips[index], return_inverse=True)
+
+    # Samples centered on the edge mean, covariance does not change
+    times = store.times[index].astype(float)
+    means = np.bincount(rows, weights=times, minlength=len(eids))/np.maximum(counts, 1)
+    times -= means[rows]
+
+    shape = (len(eids), len(trips))
+    X = sparse.csr_matrix((times, (rows, cols)), shape=shape)
+    M = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+
+    # Common trips, sum of x over common trips and sum of x*y
+    N = (M @ M.T).tocoo()
+    keep = N.data >= min_common
+    i, j, n = N.row[keep], N.col[keep], N.data[keep]
+    order = np.lexsort((j, i))
+    i, j, n = i[order].astype(np.int64), j[order].astype(np.int64), n[order]
+    Sx = X @ M.T
+    Sxy = _lookup(X @ X.T, i, j)
+    Sx_i = _lookup(Sx, i, j)
+    Sx_j = _lookup(Sx, j, i)
+
+    return i, j, n, means[i] + Sx_i/n, means[j] + Sx_j/n, Sxy - Sx_i*Sx_j/n
+
+
+def nearest_psd(matrix, eps=1e-9):
+    """
+    Nearest positive semidefinite matrix of a symmetric matrix, by clipping
+    its eigenvalues at eps times the largest one. Pairwise complete
+    covariances are not always positive semidefinite.
+    """
+    matrix = (matrix + matrix.T)/2
+    values, vectors = np.linalg.eigh(matrix)
+    floor = eps*max(values.max(), 1)
+    if values.min() >= floor:
+        return matrix
+    return (vectors*np.maximum(values, floor)) @ vectors.T
+
+
+def cholesky_factor(matrix, eps=1e-9):
+    """
+    Lower Cholesky factor of a covariance matrix, repaired to be positive
+    definite if needed
+    """
+    try:
+        return np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError:
+        pass
+    matrix = nearest_psd(matrix, eps)
+    jitter = eps*max(np.trace(matrix)/len(matrix), 1)
+    while True:
+        try:
+            return np.linalg.cholesky(matrix + jitter*np.eye(len(matrix)))
+        except np.linalg.LinAlgError:
+            jitter *= 10
+
+
+class TimeBins:
+    """
+    Time of day bins of the service day given by their start times in
+    seconds, a bin lasts until the start of the next one and the last bin
+    wraps around midnight. With weekend=True saturdays and sundays have
+    their own bins after the weekday bins, samples of unknown day count as
+    weekdays. Bins of any time are found in O(1) from a table of the bin of
+    every minute of the day.
+    """
+
+    def __init__(self, starts=None, weekend=False):
+        if starts is None:
+            starts = np.arange(0, 86400, 3600)
+        self.starts = np.unique(np.asarray(starts, dtype=np.int64) % 86400)
+        self.weekend = weekend
+        self.num_times = len(self.starts)
+        self.size = self.num_times*(2 if weekend else 1)
+        minute_bins = np.searchsorted(self.starts, np.arange(1440)*60, side='right') - 1
+        self._minute_bins = np.where(minute_bins < 0, self.num_times - 1, minute_bins)
+        self._minute_list = self._minute_bins.tolist()
+
+    def bin(self, t, day=None):
+        """
+        Bin of a time in seconds from the start of the service day, times
+        past 24:00:00 fall in the bins of the early morning
+        """
+        b = self._minute_list[int(t//60) % 1440]
+        if self.weekend and day is not None and day >= 5:
+            b += self.num_times
+        return b
+
+    def bins(self, times, days=None):
+        """
+        Bins of an array of times, with the days of the week of the times
+        """
+        b = self._minute_bins[(np.asarray(times, dtype=np.int64)//60) % 1440]
+        if self.weekend and days is not None:
+            b = b + self.num_times*(np.asarray(days) >= 5)
+        return b
+
+
+class EdgeDistributions:
+    """
+    Empirical distributions of the travel times of the edges eids of a
+    SampleStore as histograms of bins resolution seconds wide, held in one
+    contiguous CDF table. The bins of the edge at position p are the slice
+    offsets[p]:offsets[p+1] of table, the first one starting at time lo[p].
+    The table holds p + CDF so that it increases over all the edges and
+    drawing times of any number of edges is a single searchsorted.
+    """
+
+    def __init__(self, store, eids, resolution=1):
+        eids = np.asarray(eids)
+        counts = store.counts()[eids]
+        rows = np.repeat(np.arange(len(eids)), counts)
+        bins = np.floor(store.times[store.sample_index(eids)]/resolution).astype(np.int64)
+        lo = np.zeros(len(eids), dtype=np.int64)
+        hi = np.zeros(len(eids), dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[counts > 0]
+        lo[counts > 0] = np.minimum.reduceat(bins, starts) if len(bins) else 0
+        hi[counts > 0] = np.maximum.reduceat(bins, starts) if len(bins) else 0
+
+        self.resolution = resolution
+        self.widths = hi - lo + 1
+        self.offsets = np.concatenate(([0], np.cumsum(self.widths)))
+        self.counts = np.bincount(self.offsets[rows] + bins - lo[rows], minlength=self.offsets[-1])
+        cumulative = np.cumsum(self.counts)
+        before = np.concatenate(([0], cumulative[self.offsets[1:-1] - 1]))
+        edge = np.repeat(np.arange(len(eids)), self.widths)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.table = edge + (cumulative - before[edge])/counts[edge]
+        self.lo = lo*resolution
+
+    def inverse(self, positions, u, side='right'):
+        """
+        Times at probabilities u of the edges at positions, the last axis of
+        u runs over positions. Times are the start of their bins, the first
+        bin with a CDF over u, or at least u with side='left'.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        k = np.searchsorted(self.table, positions + u, side=side) - self.offsets[positions]
+        return self.lo[positions] + np.clip(k, 0, self.widths[positions] - 1)*self.resolution
+
+    def sample(self, positions, size=None, rng=np.random):
+        """
+        Draw travel times of the edges at positions independently from their
+        histograms. Returns an array of shape size + (len(positions),).
+        """
+        size = () if size is None else (size,) if np.isscalar(size) else tuple(size)
+        return self.inverse(positions, rng.random_sample(size + (len(positions),)))
+
+    def cdf(self, position, t):
+        """
+        Probability of the travel time of the edge at position being at most t
+        """
+        k = int(np.floor(t/self.resolution)) - int(round(self.lo[position]/self.resolution))
+        if k < 0:
+            return 0.0
+        if k >= self.widths[position]:
+            return 1.0
+        return self.table[self.offsets[position] + k] - position
+
+    def histogram(self, position):
+        """
+        Index of the first bin, time over resolution, and probabilities of
+        the bins of the edge at position
+        """
+        s = slice(self.offsets[position], self.offsets[position+1])
+        counts = self.counts[s]
+        return int(round(self.lo[position]/self.resolution)), counts/counts.sum()
+
+    def pmf(self, position):
+        """
+        Travel times of the non-empty bins of the edge at position and their
+        probabilities, as a list of (time, probability) pairs
+        """
+        s = slice(self.offsets[position], self.offsets[position+1])
+        counts = self.counts[s]
+        times = self.lo[position] + np.arange(len(counts))*self.resolution
+        nonzero = counts > 0
+        return list(zip(times[nonzero].tolist(), (counts[nonzero]/counts.sum()).tolist()))
+
+
+class EdgeValues(Mapping):
+    """
+    Values of the unique edges of a model, indexed by node pairs. Both
+    directions of an edge used by the routes map to the same value.
+    """
+
+    def __init__(self, index, values):
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, pair):
+        return self.values[self.index[pair]]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class SparseCov:
+    """
+    Pairwise complete covariance between the unique edges of a model,
+    indexed by pairs of edges given as node pairs. The running moments of
+    the pairs with a common trip are kept in row major arrays: weight, means
+    of both edges over the common trips and co-moment. Pairs with a weight
+    under 2 have covariance 0. Pairs first observed together in an update
+    are kept in a dict next to the arrays.
+    """
+
+    def __init__(self, index, size, i, j, n, mean_i, mean_j, comoment):
+        self.index = index
+        self.size = size
+        self.rows = i
+        self.cols = j
+        self.keys = i*size + j
+        self.weight = n.astype(float)
+        self.mean_i = mean_i
+        self.mean_j = mean_j
+        self.comoment = comoment
+        self.extra = dict()
+        self._matrix = None
+
+    def _slots(self, rows, cols):
+        """
+        Positions of the pairs in the arrays, -1 for pairs not stored
+        """
+        query = np.asarray(rows, dtype=np.int64)*self.size + np.asarray(cols)
+        slots = np.searchsorted(self.keys, query)
+        found = slots < len(self.keys)
+        found[found] = self.keys[slots[found]] == query[found]
+        return np.where(found, slots, -1)
+
+    def __getitem__(self, key):
+        pair1, pair2 = key
+        row, col = self.index[pair1], self.index[pair2]
+        slot = self._slots([row], [col])[0]
+        if slot >= 0:
+            weight, comoment = self.weight[slot], self.comoment[slot]
+        else:
+            weight, _, _, comoment = self.extra.get((row, col), (0, 0, 0, 0))
+        return comoment/(weight - 1) if weight >= 2 else 0
+
+    def __contains__(self, key):
+        pair1, pair2 = key
+        return pair1 in self.index and pair2 in self.index
+
+    def __len__(self):
+        return len(self.keys) + len(self.extra)
+
+    @property
+    def matrix(self):
+        """
+        Covariances as a sparse matrix over the unique edges
+        """
+        if self._matrix is None:
+            extra = [(row, col, w, c) for (row, col), (w, _, _, c) in self.extra.items()]
+            rows = np.concatenate((self.rows, [e[0] for e in extra])).astype(np.int64)
+            cols = np.concatenate((self.cols, [e[1] for e in extra])).astype(np.int64)
+            weight = np.concatenate((self.weight, [e[2] for e in extra]))
+            comoment = np.concatenate((self.comoment, [e[3] for e in extra]))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.where(weight >= 2, comoment/(weight - 1), 0)
+            self._matrix = sparse.csr_matrix((values, (rows, cols)), shape=(self.size, self.size))
+            self._matrix.eliminate_zeros()
+        return self._matrix
+
+    def submatrix(self, positions):
+        """
+        Dense covariance matrix between the edges at the given positions
+        """
+        return self.matrix[positions][:, positions].toarray()
+
+    def update(self, positions, times, forgetting=1.0):
+        """
+        Add one trip observed on the edges at the given positions to the
+        running moments of every pair of these edges. Older moments of a
+        pair are weighted by forgetting.
+        """
+        k = len(positions)
+        rows, cols = np.repeat(positions, k), np.tile(positions, k)
+        x, y = np.repeat(times, k), np.tile(times, k)
+        slots = self._slots(rows, cols)
+
+        stored = slots >= 0
+        s = slots[stored]
+        weight = forgetting*self.weight[s] + 1
+        dx = x[stored] - self.mean_i[s]
+        self.mean_i[s] += dx/weight
+        self.mean_j[s] += (y[stored] - self.mean_j[s])/weight
+        self.comoment[s] = forgetting*self.comoment[s] + dx*(y[stored] - self.mean_j[s])
+        self.weight[s] = weight
+
+        for row, col, xi, yi in zip(rows[~stored], cols[~stored], x[~stored], y[~stored]):
+            w, mx, my, c = self.extra.get((row, col), (0, 0, 0, 0))
+            w = forgetting*w + 1
+            dx = xi - mx
+            mx += dx/w
+            my += (yi - my)/w
+            self.extra[(row, col)] = (w, mx, my, forgetting*c + dx*(yi - my))
+        self._matrix = None
+
 
 class Model:
+    """
+    Probabilistic travel time model of the edges used by a set of routes.
+    Statistics are computed once for every unique edge, edges shared by
+    several routes or traversed in both directions are not repeated. Each
+    route is a view given by the positions of its edges. With time_bins, a
+    TimeBins, means and covariances are also kept for every bin from the
+    samples departing in it, in dense bin x edge and bin x edge pair arrays.
+    Bins with less than min_bin_samples samples of an edge or pair use the
+    statistics of the whole day. The empirical distributions of the edges
+    are kept in self.dist, an EdgeDistributions of bins resolution seconds
+    wide built from the samples at construction.
+    """
 
-    def __init__(self, G, routes_dict):
+    def __init__(self, G, routes_dict, forgetting=1.0, time_bins=None, min_bin_samples=5,
+                 resolution=1):
+        self.forgetting = forgetting
+        self.factors = dict() # Cholesky factors of the route covariances
+        self.time_bins = time_bins
+        self.min_bin_samples = min_bin_samples
+        self._loadedges(G, routes_dict)
         self.mean = self._calcmean(G, routes_dict)
         self.cov = self._calccov(G, routes_dict)
         self.numsamples = self._calcnumsamples(G, routes_dict)
+        self.dist = EdgeDistributions(G.graph['samples'], self.eids, resolution)
+        if time_bins is not None:
+            self._calcbins(G)
 
-    def _calcmean(self, G, routes_dict):
+    def _loadedges(self, G, routes_dict):
         """
-        Evaluate mean time on edges in the road network using travel time
-        samples.
+        Index the unique edges of all the routes. self.eids holds the
+        SampleStore id of every unique edge, self.index maps the node pairs
+        of the routes to positions in self.eids and self.routes the route
+        names to the positions of their edges.
         """
-        mean = dict()
+        store = G.graph['samples']
+        self.index = dict()
+        self.routes = dict()
+        self.edgeroutes = []
+        position = dict()
+        eids = []
         for route_name, route_nodes in routes_dict.items():
+            route_edges = []
             for pair in zip(route_nodes[:-1], route_nodes[1:]):
+                if pair not in self.index:
+                    if not G.has_edge(pair[0], pair[1]):
+                        raise Exception('Non existent edge in the route.')
+                    eid = store.edge_id(pair[0], pair[1])
+                    if eid not in position:
+                        position[eid] = len(eids)
+                        eids.append(eid)
+                        self.edgeroutes.append(set())
+                    self.index[pair] = position[eid]
+                route_edges.append(self.index[pair])
+                self.edgeroutes[self.index[pair]].add(route_name)
+            self.routes[route_name] = np.array(route_edges, dtype=np.int64)
+        self.eids = np.array(eids, dtype=np.int64)
 
-                if G.has_edge(pair[0], pair[1]):
-                    time_data = list(G[pair[0]][pair[1]]['time_data'].values())
-
-                    if len(time_data) == 0:
-                        raise Exception('No data samples on the given edge')
-                    else:
-                        mean[pair] = np.mean(time_data)
-                else:
-                    raise Exception('Non existent edge in the route.')
-        return mean
+    def _calcmean(self, G, routes_dict):
+        """
+        Evaluate mean time on edges in the road network using travel time
+        samples.
+        """
+        store = G.graph['samples']
+        self.counts = store.counts()[self.eids]
+        self.weights = self.counts.astype(float)
+        if np.any(self.counts == 0):
+            raise Exception('No data samples on the given edge')
 
+        return EdgeValues(self.index, store.means()[self.eids])
 
     def _calcnumsamples(self, G, routes_dict):
         """
         Calculate the number of samples on each valid route in the graph.
         """
         numsamples = dict()
-        for route_name, route_nodes in routes_dict.items():
-            num_samples = np.Inf
-            for pair in zip(route_nodes[:-1], route_nodes[1:]):
-                if G.has_edge(pair[0], pair[1]):
-                    time_data = list(G[pair[0]][pair[1]]['time_data'].values())
-                    n = len(time_data)
-                    if n == 0:
-                        raise Exception('No data samples on the given edge')
-                    elif n < num_samples:
-                        num_samples = n
-                else:
-                    raise Exception('Non existent edge in the route.')
-
-            if num_samples == 0:
-                raise Exception('An edge on the route has no samples')
-            elif num_samples == np.Inf:
+        for route_name, positions in self.routes.items():
+            if len(positions) == 0:
                 raise Exception('No edge has valid number of samples')
-            else:
-                numsamples[route_name] = num_samples
+            numsamples[route_name] = int(self.counts[positions].min())
         return numsamples
 
     def _calccov(self, G, routes_dict):
         """
-        Calculate the covariance between different edges of a given route.
-        """
-        cov = dict()
-        for route_name1, route_nodes1 in routes_dict.items():
-            for pair1 in zip(route_nodes1[:-1], route_nodes1[1:]):
-                for route_name2, route_nodes2 in routes_dict.items():
-                    for pair2 in zip(route_nodes2[:-1], route_nodes2[1:]):
-
-                        if G.has_edge(pair1[0], pair1[1]) and G.has_edge(pair2[0], pair2[1]):
-                            dict_edge1 = G[pair1[0]][pair1[1]]['time_data']
-                            dict_edge2 = G[pair2[0]][pair2[1]]['time_data']
-                            common_trips = dict_edge1.keys() & dict_edge2.keys()
-
-                            if len(common_trips) in [0, 1]:
-                                cov[(pair1, pair2)] = 0
-                            else:
-                                timedata_edge1 = [dict_edge1.get(key) for key in common_trips]
-                                timedata_edge2 = [dict_edge2.get(key) for key in common_trips]
-                                cov[(pair1, pair2)] = np.cov(timedata_edge1,timedata_edge2)[0][1]
-                        else:
-                            raise Exception('Requested edges do not exist in the graph')
-        return cov
+        Calculate the covariance between every pair of edges of the routes,
+        over the trips common to both edges. Pairs with a single common trip
+        are kept for the updates.
+        """
+        return SparseCov(self.index, len(self.eids), *pairwise_cov(G.graph['samples'], self.eids,
+                                                                   min_common=1))
+
+    def _calcbins(self, G):
+        """
+        Sample counts, means and covariances of the edges in every time bin.
+        Covariances are kept for the pairs stored in self.cov, a pair with
+        two common trips in a bin has them over the whole day too.
+        """
+        store = G.graph['samples']
+        bins = self.time_bins
+        num_edges = len(self.eids)
+        index = store.sample_index(self.eids)
+        positions = np.repeat(np.arange(num_edges), store.counts()[self.eids])
+        departs = store.departs[index]
+        known = departs != MISSING
+        sample_bins = np.full(len(store.times), -1)
+        sample_bins[index[known]] = bins.bins(departs[known], store.days[index[known]])
+
+        keys = sample_bins[index[known]]*num_edges + positions[known]
+        counts = np.bincount(keys, minlength=bins.size*num_edges)
+        sums = np.bincount(keys, weights=store.times[index[known]], minlength=bins.size*num_edges)
+        self.bin_counts = counts.reshape(bins.size, num_edges)
+        self.bin_weights = self.bin_counts.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.bin_mean = (sums/counts).reshape(bins.size, num_edges)
+
+        cov = self.cov
+        self.bin_cov = np.zeros((bins.size, len(cov.keys)))
+        self.bin_covcounts = np.zeros((bins.size, len(cov.keys)), dtype=np.int64)
+        for b in range(bins.size):
+            i, j, n, _, _, comoment = pairwise_cov(store, self.eids, mask=sample_bins == b)
+            slots = cov._slots(i, j)
+            self.bin_cov[b, slots] = comoment/(n - 1)
+            self.bin_covcounts[b, slots] = n
+
+    def _bin(self, t, day):
+        return self.time_bins.bin(t, day) if self.time_bins is not None and t is not None else None
+
+    def edge_mean(self, pair, t=None, day=None):
+        """
+        Mean travel time on the edge of a node pair, of the time bin of t
+        when given
+        """
+        position = self.index[pair]
+        b = self._bin(t, day)
+        if b is None or self.bin_counts[b, position] < self.min_bin_samples:
+            return self.mean.values[position]
+        return self.bin_mean[b, position]
+
+    def edge_cov(self, pair1, pair2, t=None, day=None):
+        """
+        Covariance between the edges of two node pairs, of the time bin of t
+        when given
+        """
+        b = self._bin(t, day)
+        if b is not None:
+            slot = self.cov._slots([self.index[pair1]], [self.index[pair2]])[0]
+            if slot >= 0 and self.bin_covcounts[b, slot] >= self.min_bin_samples:
+                return self.bin_cov[b, slot]
+        return self.cov[pair1, pair2]
+
+    def route_meanvector(self, route_name, t=None, day=None):
+        """
+        Mean travel times on the edges of a route, of the time bin of t when
+        given
+        """
+        positions = self.routes[route_name]
+        b = self._bin(t, day)
+        if b is None:
+            return self.mean.values[positions]
+        return np.where(self.bin_counts[b, positions] >= self.min_bin_samples,
+                        self.bin_mean[b, positions], self.mean.values[positions])
+
+    def route_covmatrix(self, route_name, t=None, day=None):
+        """
+        Covariance matrix between the edges of a route, of the time bin of t
+        when given
+        """
+        positions = self.routes[route_name]
+        matrix = self.cov.submatrix(positions)
+        b = self._bin(t, day)
+        if b is not None:
+            k = len(positions)
+            slots = self.cov._slots(np.repeat(positions, k), np.tile(positions, k)).reshape(k, k)
+            binned = np.zeros((k, k), dtype=bool)
+            binned[slots >= 0] = self.bin_covcounts[b, slots[slots >= 0]] >= self.min_bin_samples
+            matrix[binned] = self.bin_cov[b, slots[binned]]
+        return matrix
+
+    def route_factor(self, route_name):
+        """
+        Lower Cholesky factor of the covariance matrix of a route, computed
+        once and kept until the route is updated
+        """
+        if route_name not in self.factors:
+            self.factors[route_name] = cholesky_factor(self.route_covmatrix(route_name))
+        return self.factors[route_name]
+
+    def sample_route(self, route_name, size=None, rng=np.random):
+        """
+        Draw travel times on all the edges of a route jointly from the
+        normal distribution with the route mean and covariance, truncated at
+        zero. Returns an array of shape size + (edges,).
+        """
+        size = () if size is None else (size,) if np.isscalar(size) else tuple(size)
+        factor = self.route_factor(route_name)
+        normal = rng.standard_normal(size + (len(factor),))
+        return np.maximum(self.route_meanvector(route_name) + normal @ factor.T, 0)
+
+    def edge_distribution(self, pair):
+        """
+        Empirical distribution of the travel time on the edge of a node pair
+        as a list of (time, probability) pairs
+        """
+        return self.dist.pmf(self.index[pair])
+
+    def edge_quantile(self, pair, q):
+        """
+        Quantile q of the travel time on the edge of a node pair, the least
+        time with a CDF of at least q
+        """
+        return self.dist.inverse([self.index[pair]], np.asarray(q, dtype=float)[..., None],
+                                 side='left')[..., 0]
+
+    def path_positions(self, path):
+        """
+        Positions of the edges of a path, given as a series of nodes, in the
+        arrays of the model
+        """
+        positions = []
+        for pair in zip(path[:-1], path[1:]):
+            if pair not in self.index:
+                raise Exception('Edge {} is not in the model.'.format(pair))
+            positions.append(self.index[pair])
+        return np.array(positions, dtype=np.int64)
 
     def calc_routemean(self, route):
         """
-        Calculate the expected value of travel time on a given route object
+        Calculate the expected value of travel time on the edges of a given
+        route object
         """
-        nodelist = route.nodes
-        meanlist = []
-        for pair in zip(nodelist[:-1], nodelist[1:]):
-            mean = self.mean[pair]
-            meanlist.append[mean]
-        return meanlist
+        if route.name in self.routes:
+            return self.route_meanvector(route.name)
+        return self.calc_pathmean(route.nodes)
 
     def calc_pathmean(self, path):
         """
-        Calculate the expected travel time of a given path expressed as a series
-        of nodes that denotes the path in the transit graph
+        Calculate the expected travel time on the edges of a given path
+        expressed as a series of nodes that denotes the path in the transit
+        graph
         """
-        nodelist = path
-        meanlist = []
-        for pair in zip(nodelist[:-1], nodelist[1:]):
-            mean = self.mean[pair]
-            meanlist.append[mean]
-        return meanlist
+        return self.mean.values[self.path_positions(path)]
+
+    def calc_pathcov(self, path):
+        """
+        Covariance matrix between the edges of a given path
+        """
+        return self.cov.submatrix(self.path_positions(path))
 
     def updatemodel(self, trip):
         """
-        Update the travel time model based on the latest recorded sample
+        Update the travel time model based on the latest recorded sample.
+        trip.history maps the node pairs traversed by the trip to their
+        travel times. Means, sample counts and covariances of the edges
+        touched are updated with running (Welford) moments, older samples of
+        an edge are weighted by self.forgetting at every new sample. Edges
+        not in the model are ignored. With time bins and trip.departs mapping
+        the node pairs to their departure times, and trip.day, the means of
+        the bins are updated too. Returns the number of edges updated.
         """
-        pass
+        observed = dict()
+        for pair, time in trip.history.items():
+            if pair in self.index:
+                observed[self.index[pair]] = float(time)
+        if len(observed) == 0:
+            return 0
+
+        positions = np.array(list(observed.keys()), dtype=np.int64)
+        times = np.array(list(observed.values()))
+
+        # Edge means and sample counts
+        weights = self.forgetting*self.weights[positions] + 1
+        self.mean.values[positions] += (times - self.mean.values[positions])/weights
+        self.weights[positions] = weights
+        self.counts[positions] += 1
+
+        # Covariances between all the pairs of edges touched
+        self.cov.update(positions, times, self.forgetting)
+
+        # Means of the time bins of the departures
+        departs = getattr(trip, 'departs', None)
+        if self.time_bins is not None and departs:
+            day = getattr(trip, 'day', None)
+            for pair, depart in departs.items():
+                if pair in self.index and pair in trip.history:
+                    b, position = self.time_bins.bin(depart, day), self.index[pair]
+                    mean = self.bin_mean[b, position] if self.bin_counts[b, position] else 0.0
+                    weight = self.forgetting*self.bin_weights[b, position] + 1
+                    self.bin_mean[b, position] = mean + (trip.history[pair] - mean)/weight
+                    self.bin_weights[b, position] = weight
+                    self.bin_counts[b, position] += 1
+
+        for route_name in set().union(*(self.edgeroutes[p] for p in positions)):
+            self.numsamples[route_name] = int(self.counts[self.routes[route_name]].min())
+            self.factors.pop(route_name, None)
 
-        time_sample = trip.history
-        num_samples = trip.route.numsamples
+        return len(positions)
 
 
 
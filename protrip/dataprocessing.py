@@ -7,30 +7,30 @@ and historic travel time data from CUMTD
 """
 
 import os
+import re
+import hashlib
+import datetime
+import numpy as np
 import pandas as pd
 import networkx as nx
 from tqdm import tqdm
-import warnings
 import folium
+from samplestore import SampleStore, MISSING
+from stopindex import StopIndex
+from diagnostics import Diagnostics
+import gtfs
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
+# Row types and columns used from the schedule adherence sheets
+_TRIP_TYPES = ['Additional trip', 'Trip']
+_NODE_TYPES = ['Stop', 'Drive through']
+_SKIP_TYPES = ['Stop without doors', 'Stop with doors', 'Dead run out']
+_SHEET_COLUMNS = ['Type', 'Stop', 'Actual dep', 'Sched. total distance', 'Graphic']
+MILES_TO_METERS = 1609.34
 
-def _add_timedata(G, node1, node2, count_trips, time, distance, trip_shape):
-    """
-    Create edges based on the trips in the graph along with route shapes
-    """
-    # Edge already exists
-    if G.has_edge(node1, node2):
-
-        if abs(G[node1][node2]['length'] - distance) > 50:
-            print(abs(G[node1][node2]['length'] - distance))
-            warnings.warn('Distances over multiple samples not matching')
-        else:
-            G[node1][node2]['time_data'][count_trips] = time
-            G[node1][node2]['trip_shapes'].add(trip_shape)
-
-    else:
-        G.add_edge(node1, node2, time_data = {count_trips:time}, length = distance,
-                   trip_shapes = set([trip_shape]))
+# Version of the parsed sample tables stored in the ingestion cache
+_CACHE_VERSION = 5
 
 
 def _get_sec(time_str):
@@ -41,102 +41,420 @@ def _get_sec(time_str):
     return int(h)*3600+int(m)*60+int(s)
 
 
-def extract_data(ROOT_PATH, gtfs_foldername):
+def _get_secs(time_col):
     """
-    Extract stops, routes, and travel time data and compile them into a graph
+    Convert a column of HH:MM:SS strings to seconds, NaN where missing or
+    malformed. Hours may exceed 24. Works on the fixed width bytes of the
+    column instead of splitting every string.
     """
-    # Generate graph with stops as nodes
-    gtfs_path = os.path.join(ROOT_PATH, gtfs_foldername)
-    G = nx.Graph()
-    df_stops = pd.read_csv(gtfs_path+'\stops.txt')
-    stops = zip(df_stops.stop_id, df_stops.stop_name, df_stops.stop_lat,
-                df_stops.stop_lon)
+    raw = np.asarray(time_col.fillna(''), dtype='S10')
+    chars = raw.view(np.uint8).reshape(len(raw), raw.itemsize).astype(np.int64)
+    length = (chars != 0).sum(axis=1)
+    digits = chars - ord('0')
+    rows = np.arange(len(raw))
+
+    # Minutes and seconds are the last five characters, hours the rest
+    def _digit(pos):
+        return digits[rows, np.clip(pos, 0, raw.itemsize-1)]
+
+    positions = np.arange(raw.itemsize)
+    colon = (positions == (length-3)[:, None]) | (positions == (length-6)[:, None])
+    padding = positions >= length[:, None]
+    valid = ((length >= 7) & (_digit(length-3) == ord(':') - ord('0'))
+             & (_digit(length-6) == ord(':') - ord('0'))
+             & ((digits >= 0) & (digits <= 9) | colon | padding).all(axis=1))
+
+    hours = np.zeros(len(raw), dtype=np.int64)
+    for pos in range(raw.itemsize-6):
+        hours = np.where(pos < length-6, hours*10 + digits[:, pos], hours)
+    minutes = _digit(length-5)*10 + _digit(length-4)
+    seconds = _digit(length-2)*10 + _digit(length-1)
+
+    return np.where(valid, hours*3600 + minutes*60 + seconds, np.nan)
+
+
+def _sheet_day(file_path):
+    """
+    Day of the week of a sheet from the M-D-YYYY date in its file name, 0
+    for monday, MISSING if the name holds no date
+    """
+    match = re.search(r'(\d{1,2})-(\d{1,2})-(\d{4})', os.path.basename(str(file_path)))
+    if match is None:
+        return MISSING
+    month, day, year = map(int, match.groups())
+    try:
+        return datetime.date(year, month, day).weekday()
+    except ValueError:
+        return MISSING
+
+
+def _read_datasheets(file_paths, nodes):
+    """
+    Parse schedule adherence sheets into compact tables of consecutive stop
+    pair samples, one (samples, trip_shapes, diagnostics) tuple per file. Stops
+    are stored as their codes in nodes, a StopIndex, and trips are numbered from 1
+    within each file. Samples keep the departure time at their first stop.
+    All the files are processed in one vectorized pass. The stop pairs
+    rejected are counted in the Diagnostics of their file. Nothing taken from
+    the file name is kept, neither the day of the week of the samples nor the
+    file in the examples, as the same entry of the ingestion cache serves
+    all the files with the same contents.
+    """
+    frames = [pd.read_csv(file_path, header=1, usecols=_SHEET_COLUMNS,
+                          dtype={'Type': str, 'Stop': str, 'Actual dep': str,
+                                 'Graphic': str})
+              for file_path in file_paths]
+    file_id = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+    df = pd.concat(frames, ignore_index=True)
+
+    # Delete columns with two values in Type and reindex
+    keep = ~df.Type.isin(_SKIP_TYPES).to_numpy()
+    df = df[keep].reset_index(drop=True)
+    file_id = file_id[keep]
+
+    # Segment trips with a cumulative id. The rows after the last trip
+    # header of a file do not belong to a complete trip.
+    is_trip = df.Type.isin(_TRIP_TYPES).to_numpy()
+    segment = np.cumsum(is_trip)
+    trip_files = file_id[is_trip]
+    complete = np.append(trip_files[:-1] == trip_files[1:], False)[:len(trip_files)]
+    trip_number = np.cumsum(complete)
+    trip_shapes = df.Graphic[is_trip].str[9:].to_numpy()[complete].tolist()
+
+    # Consecutive stop pairs inside the same complete trip
+    is_node = df.Type.isin(_NODE_TYPES).to_numpy()
+    complete_rows = np.append(False, complete)[segment]
+    index = np.flatnonzero(is_node[:-1] & is_node[1:] & complete_rows[:-1]
+                           & (segment[:-1] == segment[1:]))
+    stop_names = df.Stop.astype(str)
+    stops = nodes.codes(stop_names)
+    times = _get_secs(df['Actual dep'])
+    dists = df['Sched. total distance'].to_numpy(dtype=float)*MILES_TO_METERS
+
+    samples = pd.DataFrame({
+        'trip': trip_number[segment[index]-1].astype(np.int32),
+        'node1': stops[index],
+        'node2': stops[index+1],
+        'time': times[index+1] - times[index],
+        'distance': dists[index+1] - dists[index],
+        'depart': times[index]})
+
+    # Stops missing in the graph, missing or negative times and out of
+    # bound distances
+    sample_files = file_id[index]
+    known = ((samples.node1 >= 0) & (samples.node2 >= 0)).to_numpy()
+    timed = samples.time.notna().to_numpy()
+    positive = (samples.time >= 0).to_numpy()
+    bounded = ((samples.distance >= 0) & (samples.distance < 2000)).to_numpy()
+    checks = [('missing_stops', ~known), ('missing_time', known & ~timed),
+              ('negative_time', known & timed & ~positive),
+              ('out_of_bounds', known & positive & ~bounded)]
+    diagnostics = [Diagnostics() for _ in frames]
+    limit = Diagnostics().max_examples
+    for condition, mask in checks:
+        # Examples are the first rows of every file, built in one table
+        rows = np.flatnonzero(mask)
+        bounds = np.searchsorted(sample_files[rows], np.arange(len(frames)+1))
+        picked = rows[np.arange(len(rows)) - bounds[sample_files[rows]] < limit]
+        examples = pd.DataFrame({'stop1': stop_names.to_numpy()[index[picked]],
+                                 'stop2': stop_names.to_numpy()[index[picked]+1],
+                                 'time': samples.time.to_numpy()[picked],
+                                 'distance': samples.distance.to_numpy()[picked].round(1)}
+                                ).to_dict('records')
+        picked_bounds = np.searchsorted(sample_files[picked], np.arange(len(frames)+1))
+        for i in range(len(frames)):
+            diagnostics[i].record(condition, bounds[i+1] - bounds[i],
+                                  examples[picked_bounds[i]:picked_bounds[i+1]])
+    samples = samples[known & positive & bounded].astype({'time': np.int32, 'depart': np.int32})
+    sample_files = sample_files[known & positive & bounded]
+
+    # Split into tables of the individual files
+    trip_offsets = np.concatenate(([0], np.cumsum(np.bincount(trip_files[complete],
+                                                              minlength=len(frames)))))
+    samples['trip'] -= trip_offsets[sample_files].astype(np.int32)
+    sample_bounds = np.searchsorted(sample_files, np.arange(len(frames)+1))
+    results = []
+    for i in range(len(frames)):
+        results.append((samples.iloc[sample_bounds[i]:sample_bounds[i+1]].reset_index(drop=True),
+                        trip_shapes[trip_offsets[i]:trip_offsets[i+1]], diagnostics[i]))
+
+    return results
+
+
+def _merge_samples(results, filenames):
+    """
+    Concatenate the tables parsed from the individual files, number their
+    trips globally in file order and merge their diagnostics. The samples
+    get the day of the week of their file and the examples are named by it.
+    """
+    frames, list_shapes = [], []
+    diagnostics = Diagnostics()
+    for (samples, trip_shapes, file_diagnostics), filename in zip(results, filenames):
+        samples['trip'] += len(list_shapes)
+        samples['day'] = np.int8(_sheet_day(filename))
+        frames.append(samples)
+        list_shapes.extend(trip_shapes)
+        for condition, count in file_diagnostics.counts.items():
+            diagnostics.record(condition, count, [dict(file=filename, **example) for example in
+                                                  file_diagnostics.examples.get(condition, [])])
+
+    return pd.concat(frames, ignore_index=True), list_shapes, diagnostics
+
+
+def _parse_files(file_paths, nodes, workers=None):
+    """
+    Parse the files in a single process, or in a pool of worker processes
+    each handling consecutive groups of files. The per-file tables are the
+    same either way.
+    """
+    if workers is None or workers <= 1 or len(file_paths) <= 1:
+        return _read_datasheets(tqdm(file_paths), nodes)
+
+    num_chunks = min(len(file_paths), 4*workers)
+    bounds = np.linspace(0, len(file_paths), num_chunks+1).astype(int)
+    chunks = [file_paths[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results in tqdm(executor.map(_read_datasheets, chunks, repeat(nodes)),
+                                  total=len(chunks)):
+            results.extend(chunk_results)
 
-    for stop_id, stop_name, stop_lat, stop_lon in stops:
-        node_name = stop_name+',' + stop_id[-1]
+    return results
 
-#        exceptions = []
-#        if stop_name in exceptions:
-#            print(stop_name)
-#            raise Exception('Current stop is an exception')
 
-        if node_name not in G.nodes:
-            G.add_node(node_name, stop_lat = stop_lat,
-                       stop_lon = stop_lon)
+def _file_hash(file_path):
+    """
+    SHA-1 digest of the contents of a file
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_cached(file_paths, nodes, workers, cache_dir, stops_hash, scope):
+    """
+    Parse only the files without an entry in the ingestion cache. Entries are
+    keyed by the content hash of the sheet and of stops.txt, so edited sheets
+    or stops are parsed again. Entries are prefixed by scope, a hash of the
+    datasheet folder, and the entries of scope not used anymore are removed,
+    so folders sharing a cache_dir keep their own entries.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = 'sheet_{}_'.format(scope)
+    keys = ['{}{}_{}.v{}.pkl'.format(prefix, _file_hash(file_path), stops_hash[:16], _CACHE_VERSION)
+            for file_path in file_paths]
+
+    results = [None]*len(file_paths)
+    missing = []
+    for i, key in enumerate(keys):
+        cache_path = os.path.join(cache_dir, key)
+        if os.path.exists(cache_path):
+            results[i] = pd.read_pickle(cache_path)
         else:
-            if G.nodes[node_name]['stop_lat'] == stop_lat and G.nodes[node_name]['stop_lon'] == stop_lon:
-                pass
-            else:
-                print(node_name)
-                warnings.warn('Stops repeating in stops.txt with different \
-                                data, check stops.txt file again.')
+            missing.append(i)
 
+    # Parse the new or modified files and store them
+    parsed = _parse_files([file_paths[i] for i in missing], nodes, workers) if missing else []
+    for i, result in zip(missing, parsed):
+        pd.to_pickle(result, os.path.join(cache_dir, keys[i]))
+        results[i] = result
 
-    # Extract travel time data from time-table adherence files
-    count_files = 0
-    count_trips = 0
-    list_tripshapes = set() # list of shape names of all trips analyzed
-    csv_path = os.path.join(ROOT_PATH, 'cumtd_datasheets')
+    stale = [name for name in os.listdir(cache_dir)
+             if name.startswith(prefix) and name.endswith('.pkl') and name not in keys]
+    for name in stale:
+        os.remove(os.path.join(cache_dir, name))
 
-    # Iterate over files in the directory
-    for filename in tqdm(os.listdir(csv_path)):
+    return results
 
-       file_path = os.path.join(csv_path, filename)
-       df = pd.read_csv(file_path, header=1)
-       count_files += 1
 
-       # Delete columns with two values in Type and reindex
-       index_toremove = df.loc[df.Type.isin(['Stop without doors','Stop with doors','Dead run out', ])].index
-       df = df.drop(index_toremove)
-       index_trips = df.loc[df.Type.isin(['Additional trip','Trip'])].index
+class MADFilter:
+    """
+    Sample filter of the ingestion rejecting travel times more than k scaled
+    median absolute deviations away from the median of their edge. The
+    scale is at least min_scale seconds, so that edges with mostly equal
+    times keep the times close to them.
+    """
 
-       # Iterate over trips in the file
-       for item in zip(index_trips[0:-1], index_trips[1:]):
+    name = 'mad'
 
-           index_start, index_end = item
-           trip_shape = df.Graphic[index_start][9:]
-           list_tripshapes.add(trip_shape)
-           count_trips += 1
+    def __init__(self, k=3.5, min_scale=1.0):
+        self.k = k
+        self.min_scale = min_scale
 
-           # list of stop pairs between index_start and index_end
-           stop_pairs = zip(df.index[index_start+1:index_end-1],
-                            df.index[index_start+2:index_end])
+    def __call__(self, codes, times):
+        """
+        Mask of the samples kept, codes holds the edge of every sample
+        """
+        times = pd.Series(times, dtype=float)
+        deviations = (times - times.groupby(codes).transform('median')).abs()
+        scale = np.maximum(1.4826*deviations.groupby(codes).transform('median').to_numpy(),
+                           self.min_scale)
+        return deviations.to_numpy() <= self.k*scale
 
-           for pair in stop_pairs:
 
-               index_1, index_2 = pair
+class IQRFilter:
+    """
+    Sample filter of the ingestion rejecting travel times outside the Tukey
+    fences of their edge, k interquartile ranges beyond the quartiles
+    """
 
-               types_ofnodes = ['Stop', 'Drive through']
-               if str(df['Type'][index_1]) not in types_ofnodes or str(df['Type'][index_2]) not in types_ofnodes:
-                   continue
+    name = 'iqr'
 
-               node1 = str(df['Stop'][index_1])
-               node2 = str(df['Stop'][index_2])
+    def __init__(self, k=1.5):
+        self.k = k
 
-               if G.has_node(node1) and G.has_node(node2):
+    def __call__(self, codes, times):
+        """
+        Mask of the samples kept, codes holds the edge of every sample
+        """
+        times = pd.Series(times, dtype=float)
+        grouped = times.groupby(codes)
+        q1 = grouped.transform('quantile', 0.25).to_numpy()
+        q3 = grouped.transform('quantile', 0.75).to_numpy()
+        values = times.to_numpy()
+        return (values >= q1 - self.k*(q3 - q1)) & (values <= q3 + self.k*(q3 - q1))
 
-                   time_node1 = _get_sec(df['Actual dep'][index_1])
-                   time_node2 = _get_sec(df['Actual dep'][index_2])
-                   dist_node1 = df['Sched. total distance'][index_1]*1609.34
-                   dist_node2 = df['Sched. total distance'][index_2]*1609.34
-                   time = time_node2 - time_node1
-                   distance = dist_node2 - dist_node1
 
-                   if time < 0 or distance < 0 or distance >= 2000:
-                       print(node1); print(node2)
-                       print("Time: {} and Distance:  {}".format(time, distance))
-                       warnings.warn('Time and distance should be positive and bounded')
-                   else:
-                       _add_timedata(G, node1, node2, count_trips, time, distance, trip_shape)
-               else:
-                   print(node1); print(node2)
-                   warnings.warn('Stops from data do not exist in graph')
+def _edge_examples(G, node1, node2, **columns):
+    """
+    Table of example samples for the diagnostics, with the node names of
+    their stops when G has a StopIndex
+    """
+    stops = G.graph.get('stops')
+    if stops is not None:
+        node1, node2 = stops.resolve(node1), stops.resolve(node2)
+    return pd.DataFrame(dict(node1=node1, node2=node2, **columns))
 
-    remove_list = []
-    for u,v,data in G.edges(data=True):
-        if len(data['time_data']) <= 10:
-            remove_list.append((u,v))
-    G.remove_edges_from(remove_list)
+
+def _add_samples(G, samples, trip_shapes, min_samples=10, filters=(), diagnostics=None):
+    """
+    Create edges from a table of stop pair samples in a single pass and
+    store their samples in a SampleStore kept in G.graph['samples']. The
+    length of an edge is set by its first sample and later samples with a
+    length more than 50 m apart are dropped, a trip traversing an edge twice
+    keeps its last sample, the samples of every edge go through filters,
+    callables returning the mask of samples kept from the edge codes and
+    times of all the samples, and edges left with min_samples or fewer
+    samples are dropped. The samples rejected at every step and the edges
+    dropped are recorded in diagnostics, which is returned.
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    limit = diagnostics.max_examples
+    node1 = samples.node1.to_numpy()
+    node2 = samples.node2.to_numpy()
+    codes = pd.DataFrame({'u': np.minimum(node1, node2), 'v': np.maximum(node1, node2)}
+                         ).groupby(['u', 'v'], sort=False).ngroup().to_numpy()
+
+    # Length of an edge is fixed by its first sample
+    lengths = samples.distance.groupby(codes).transform('first').to_numpy()
+    matching = np.abs(samples.distance.to_numpy() - lengths) <= 50
+    rows = np.flatnonzero(~matching)
+    diagnostics.record('length_mismatch', len(rows), _edge_examples(
+        G, node1[rows[:limit]], node2[rows[:limit]], trip=samples.trip.to_numpy()[rows[:limit]],
+        distance=samples.distance.to_numpy()[rows[:limit]].round(1),
+        length=lengths[rows[:limit]].round(1)))
+
+    # Group the samples by edge, the first sample sets the orientation and
+    # length of the edge
+    order = np.flatnonzero(matching)
+    order = order[np.argsort(codes[order], kind='stable')]
+    first = order[np.append(True, np.diff(codes[order]) != 0)]
+
+    # One sample per trip on every edge and enough samples on every edge
+    trips = samples.trip.to_numpy()
+    repeated = pd.DataFrame({'code': codes[order], 'trip': trips[order]}).duplicated(keep='last')
+    repeated = repeated.to_numpy()
+    diagnostics.record('repeated_trip', repeated.sum(), _edge_examples(
+        G, node1[order[repeated][:limit]], node2[order[repeated][:limit]],
+        trip=trips[order[repeated][:limit]]))
+    order = order[~repeated]
+
+    # Robust filters on the samples of every edge, then edges with too few
+    # samples left
+    times = samples.time.to_numpy()
+    for sample_filter in filters:
+        keep = sample_filter(codes[order], times[order])
+        rows = order[~keep][:limit]
+        diagnostics.record(sample_filter.name, (~keep).sum(), _edge_examples(
+            G, node1[rows], node2[rows], trip=trips[rows], time=times[rows]))
+        order = order[keep]
+    counts = np.bincount(codes[order], minlength=codes.max(initial=-1)+1)[codes[first]]
+    keep = counts > min_samples
+    rows = first[~keep][:limit]
+    diagnostics.record('few_samples', counts[~keep].sum())
+    diagnostics.record('edges_dropped', (~keep).sum(), _edge_examples(
+        G, node1[rows], node2[rows], samples=counts[~keep][:limit]))
+    order = order[np.repeat(keep, counts)]
+    first, counts = first[keep], counts[keep]
+
+    edges = list(zip(node1[first].tolist(), node2[first].tolist()))
+    shape_names, shape_codes = np.unique(np.array(trip_shapes, dtype=str), return_inverse=True)
+    store = SampleStore(edges, np.concatenate(([0], np.cumsum(counts))), trips[order],
+                        times[order], shape_codes[trips[order]-1],
+                        shape_names.tolist(), departs=samples.depart.to_numpy()[order],
+                        days=samples.day.to_numpy()[order])
+    G.add_edges_from((u, v, {'eid': eid, 'length': length})
+                     for eid, ((u, v), length) in enumerate(zip(edges, lengths[first].tolist())))
+    G.graph['samples'] = store
+
+    return diagnostics
+
+
+def extract_data(ROOT_PATH, gtfs_foldername, datasheets_foldername='cumtd_datasheets',
+                 workers=None, cache_dir=None, feed=None, filters=(), min_samples=10,
+                 report_path=None):
+    """
+    Extract stops, routes, and travel time data and compile them into a graph.
+    With workers > 1 the data files are parsed in a pool of processes, the
+    resulting graph is the same as with a single process. With a cache_dir
+    the parsed samples of every data file are stored on disk and only new or
+    modified files are parsed in later runs, a cache_dir can be shared by
+    several datasheet folders. Stops are taken from feed, a
+    gtfs.Feed with the stops table, when already loaded. The samples of every
+    edge go through filters, such as MADFilter or IQRFilter, and edges left
+    with min_samples or fewer samples are dropped. Stops repeated with other
+    coordinates and the samples rejected at every step are recorded in a
+    Diagnostics kept in G.graph['diagnostics'], printed at the end and
+    written as json to report_path when given.
+    Nodes are the integer codes of the stops in a StopIndex kept in
+    G.graph['stops'], with their node name in the attribute name.
+    """
+    # Generate graph with stops as nodes
+    gtfs_path = os.path.join(ROOT_PATH, gtfs_foldername)
+    G = nx.Graph()
+    if feed is None:
+        feed = gtfs.load_feed(ROOT_PATH, gtfs_foldername, tables=['stops'])
+    diagnostics = Diagnostics()
+    nodes = StopIndex.from_feed(feed, diagnostics)
+    G.add_nodes_from((code, {'name': name, 'stop_lat': stop_lat, 'stop_lon': stop_lon})
+                     for code, (name, stop_lat, stop_lon) in
+                     enumerate(zip(nodes.names.tolist(), nodes.lat.tolist(), nodes.lon.tolist())))
+    G.graph['stops'] = nodes
+
+    # Extract travel time data from time-table adherence files
+    list_tripshapes = set() # list of shape names of all trips analyzed
+    csv_path = os.path.join(ROOT_PATH, datasheets_foldername)
+
+    # Parse all the files in the directory, trips are numbered in file order
+    filenames = sorted(os.listdir(csv_path))
+    file_paths = [os.path.join(csv_path, filename) for filename in filenames]
+    if cache_dir is None:
+        results = _parse_files(file_paths, nodes, workers)
+    else:
+        stops_hash = _file_hash(os.path.join(gtfs_path, 'stops.txt'))
+        scope = hashlib.sha1(os.path.abspath(csv_path).encode()).hexdigest()[:16]
+        results = _parse_cached(file_paths, nodes, workers, cache_dir, stops_hash, scope)
+    samples, trip_shapes, parse_diagnostics = _merge_samples(results, filenames)
+    diagnostics.merge(parse_diagnostics)
+    count_files = len(filenames)
+    count_trips = len(trip_shapes)
+    list_tripshapes.update(trip_shapes)
+    _add_samples(G, samples, trip_shapes, min_samples, filters, diagnostics)
+    G.graph['diagnostics'] = diagnostics
 
     # Checks and printing stats
     print("\nNo.of csv data files parsed: {}\n".format(count_files))
@@ -146,37 +464,47 @@ def extract_data(ROOT_PATH, gtfs_foldername):
     total_edges = G.number_of_edges()
     inactive_nodes = list(nx.isolates(G))
     num_activenodes = total_nodes - len(inactive_nodes)
-    num_samples = 0
-    for edge in list(G.edges.data()):
-        num_samples += len(edge[2]['time_data'])
+    num_samples = len(G.graph['samples'].times)
     avg_samplecount = num_samples/(total_edges)
 
     print("Total no.of stops (nodes): {}\n".format(total_nodes))
     print("Total no.of edges (road segements with data): {}\n".format(total_edges))
     print("No.of stops (nodes) with data: {}\n".format(num_activenodes))
     print("Average no.of samples on each road segment: {}\n".format(avg_samplecount))
+    print("Data quality diagnostics:\n{}\n".format(diagnostics))
+    if report_path is not None:
+        diagnostics.to_json(report_path)
 
     return G, list_tripshapes
 
 
-def service_times(ROOT_PATH, gtfs_foldername):
+def service_times(ROOT_PATH, gtfs_foldername, feed=None, date=None):
     """
-    Finds the service start and service end times of the transit agency from GTFS file
+    Finds the service start and service end times of the transit agency from GTFS file,
+    or from feed, a gtfs.Feed with the stop_times table, when already loaded. With
+    a date, as YYYYMMDD or datetime.date, only the trips running that day count.
     """
-    gtfs_path = os.path.join(ROOT_PATH, gtfs_foldername)
-    df_stoptimes = pd.read_csv(gtfs_path+'\stop_times.txt')
-    depart_times = df_stoptimes['departure_time'].str.split(':').apply(lambda x: int(x[0])*3600 + int(x[1])*60 + int(x[2]))
-
-    t_begin = min(depart_times)
-    t_end = max(depart_times)
+    if feed is None:
+        tables = ['stop_times'] if date is None else ['trips', 'calendar', 'calendar_dates', 'stop_times']
+        feed = gtfs.load_feed(ROOT_PATH, gtfs_foldername, tables=tables)
+    if date is not None:
+        window = gtfs.ServiceCalendar(feed).service_window(date)
+        if window is None:
+            raise Exception('No trips run on {}.'.format(date))
+        return window
+    depart_times = feed.stop_times.departure_time.values
+    depart_times = depart_times[depart_times != gtfs.MISSING_TIME]
+
+    t_begin = int(depart_times.min())
+    t_end = int(depart_times.max())
 
     return (t_begin, t_end)
 
 
-def import_routes(ROOT_PATH, filename):
+def import_routes(ROOT_PATH, filename, stops=None):
     """
     Import route names and their constituent nodes stored in 'filename.csv'
-    at ROOT_PATH
+    at ROOT_PATH. With stops, a StopIndex, nodes are given as their codes.
     """
     file_path = os.path.join(ROOT_PATH, filename+'.csv')
     df = pd.read_csv(file_path, index_col=0)
@@ -186,6 +514,8 @@ def import_routes(ROOT_PATH, filename):
     for key, value in routes.items():
         value = [v for v in value if str(v) != 'nan']
         routes[key] = tuple(value)
+    if stops is not None:
+        routes = stops.intern_routes(routes)
 
     return routes
 
@@ -200,7 +530,7 @@ def visualization(G):
     lat_data = nx.get_node_attributes(G, 'stop_lat')
     lon_data = nx.get_node_attributes(G, 'stop_lon')
     for node in G.nodes.data():
-        name = str(node[0])
+        name = str(node[1].get('name', node[0]))
         point = [float(node[1]['stop_lat']), float(node[1]['stop_lon'])]
         stops_all[name] = point
 
@@ -215,9 +545,10 @@ def visualization(G):
     edges_list = []
     max_samples = 0
     min_samples = 1e20
+    store = G.graph['samples']
     for n1, n2, data in list(G.edges(data=True)):
         points = [(lat_data[n1], lon_data[n1]),(lat_data[n2], lon_data[n2])]
-        num_samples = len(data['time_data'])
+        num_samples = store.numsamples(n1, n2)
         if num_samples > max_samples:
             max_samples = num_samples
         if num_samples < min_samples:
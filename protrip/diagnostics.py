@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Data quality diagnostics of the ingestion. Rejected samples and
+inconsistent inputs are counted per condition with a few examples, instead
+of printing or warning for every offending row, and reported once at the
+end of the ingestion.
+"""
+
+import json
+import pandas as pd
+
+
+# Conditions recorded by the ingestion and the route checks
+CONDITIONS = {
+    'repeated_stops': 'stops repeating a node with different coordinates',
+    'missing_stops': 'stop pairs with a stop missing in the graph',
+    'missing_time': 'stop pairs without a valid departure time',
+    'negative_time': 'stop pairs with a negative travel time',
+    'out_of_bounds': 'stop pairs with a negative distance or of 2000 m or more',
+    'length_mismatch': 'samples more than 50 m longer or shorter than the first sample of their edge',
+    'repeated_trip': 'samples of a trip traversing an edge again, the last one is kept',
+    'mad': 'samples more than k scaled median absolute deviations from the median of their edge',
+    'iqr': 'samples more than k interquartile ranges beyond the quartiles of their edge',
+    'few_samples': 'samples of edges with too few samples',
+    'edges_dropped': 'edges with too few samples',
+    'malformed_rows': 'rows of a feed that could not be parsed',
+    'missing_nodes': 'route nodes missing in the graph',
+    'missing_edges': 'route edges missing in the graph',
+}
+
+
+class Diagnostics:
+    """
+    Counts of the occurrences of every condition, with the first
+    max_examples examples of each
+    """
+
+    def __init__(self, max_examples=5):
+        self.max_examples = max_examples
+        self.counts = dict()
+        self.examples = dict()
+
+    def __getitem__(self, condition):
+        return self.counts.get(condition, 0)
+
+    def __contains__(self, condition):
+        return self.counts.get(condition, 0) > 0
+
+    def record(self, condition, count=1, examples=()):
+        """
+        Add count occurrences of condition. examples is a list of dicts or a
+        DataFrame of offending rows, only the ones needed to fill up the
+        examples of condition are kept.
+        """
+        self.counts[condition] = self.counts.get(condition, 0) + int(count)
+        kept = self.examples.setdefault(condition, [])
+        room = self.max_examples - len(kept)
+        if room <= 0:
+            return
+        if isinstance(examples, pd.DataFrame):
+            examples = examples.head(room).to_dict('records')
+        kept.extend(list(examples)[:room])
+
+    def merge(self, other):
+        """
+        Add the counts and examples of other, in this order
+        """
+        for condition, count in other.counts.items():
+            self.record(condition, count, other.examples.get(condition, ()))
+        return self
+
+    def report(self):
+        """
+        Counts, descriptions and examples of every condition recorded
+        """
+        return {condition: {'count': count, 'description': CONDITIONS.get(condition, ''),
+                            'examples': self.examples.get(condition, [])}
+                for condition, count in self.counts.items()}
+
+    def to_json(self, file_path):
+        """
+        Write the report to a json file
+        """
+        with open(file_path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+    def __str__(self):
+        lines = ['{}: {} {}'.format(condition, count, CONDITIONS.get(condition, '')).rstrip()
+                 for condition, count in self.counts.items()]
+        return '\n'.join(lines)
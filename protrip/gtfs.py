@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Loading the tables of a GTFS feed once with explicit column
+types. Ids are integer codes into the id lists of the feed, times are
+seconds since the start of the service day. A columnar snapshot of the
+loaded tables can be cached on disk and is memory-mapped in later runs.
+"""
+
+import os
+import shutil
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+import dataprocessing as dp
+import persistence as ps
+
+
+# Version of the layout of the cached snapshots
+FEED_VERSION = 1
+MISSING_TIME = -1
+
+# Columns read from every table with their types, ids are read as categories
+_DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+_TABLES = {
+    'stops': {'stop_id': 'category', 'stop_name': str, 'stop_lat': np.float64,
+              'stop_lon': np.float64},
+    'routes': {'route_id': 'category', 'route_short_name': str, 'route_long_name': str,
+               'route_type': np.int16},
+    'trips': {'route_id': 'category', 'service_id': 'category', 'trip_id': 'category',
+              'shape_id': 'category'},
+    'calendar': dict({'service_id': 'category', 'start_date': np.int32, 'end_date': np.int32},
+                     **{day: np.int8 for day in _DAYS}),
+    'calendar_dates': {'service_id': 'category', 'date': np.int32, 'exception_type': np.int8},
+    'stop_times': {'trip_id': 'category', 'arrival_time': 'category',
+                   'departure_time': 'category', 'stop_id': 'category', 'stop_sequence': np.int32},
+}
+# Id column -> kind of id, the ids of a kind being listed by the table defining them
+_ID_KINDS = {'stop_id': 'stop', 'route_id': 'route', 'trip_id': 'trip', 'service_id': 'service',
+             'shape_id': 'shape'}
+_ID_TABLES = [('stops', 'stop_id'), ('routes', 'route_id'), ('trips', 'trip_id')]
+_TIME_COLUMNS = ['arrival_time', 'departure_time']
+_STRING_COLUMNS = ['stop_name', 'route_short_name', 'route_long_name']
+
+
+class Feed:
+    """
+    Tables of a GTFS feed as DataFrames. Id columns hold int32 codes into the
+    id lists of the feed (stop_ids, route_ids, trip_ids, service_ids,
+    shape_ids), -1 for ids not listed. Times of stop_times are int32 seconds,
+    MISSING_TIME where empty.
+    """
+
+    def __init__(self, tables, ids):
+        self.tables = tables
+        self.ids = ids
+        for name, table in tables.items():
+            setattr(self, name, table)
+        for kind, values in ids.items():
+            setattr(self, kind + '_ids', values)
+
+    def node_names(self):
+        """
+        Node name of every stop code, as the nodes of dp.extract_data
+        """
+        stop_ids = self.stop_ids[self.stops.stop_id.values]
+        return np.array([name + ',' + stop_id[-1] for name, stop_id in
+                         zip(self.stops.stop_name.tolist(), stop_ids)], dtype=object)
+
+
+def _read_table(gtfs_path, name):
+    """
+    Read the columns of a table with their types, None if the file is missing
+    """
+    file_path = os.path.join(gtfs_path, name + '.txt')
+    if not os.path.exists(file_path):
+        return None
+    dtypes = _TABLES[name]
+    # Categories are built once for the whole file instead of per chunk
+    return pd.read_csv(file_path, usecols=lambda column: column in dtypes, dtype=dtypes,
+                       low_memory=False)
+
+
+def _parse(gtfs_path, tables):
+    """
+    Read the tables and code their ids and times
+    """
+    raw = {name: _read_table(gtfs_path, name) for name in tables}
+    raw = {name: table for name, table in raw.items() if table is not None}
+
+    # Ids of every kind in order of the table defining them, then of first use
+    ids = dict()
+    for name, column in _ID_TABLES:
+        if name in raw:
+            ids[_ID_KINDS[column]] = pd.Index(raw[name][column].astype(str).values)
+            if not ids[_ID_KINDS[column]].is_unique:
+                raise Exception('Repeated {} in {}.txt'.format(column, name))
+    for name, table in raw.items():
+        for column in table.columns:
+            kind = _ID_KINDS.get(column)
+            if kind is None:
+                continue
+            categories = table[column].cat.categories.astype(str)
+            if kind not in ids:
+                ids[kind] = pd.Index(categories)
+            elif kind in ('service', 'shape'):
+                ids[kind] = ids[kind].append(categories.difference(ids[kind]))
+
+    coded = dict()
+    for name, table in raw.items():
+        columns = dict()
+        for column in table.columns:
+            values = table[column]
+            if column in _ID_KINDS:
+                lookup = ids[_ID_KINDS[column]].get_indexer(values.cat.categories.astype(str))
+                lookup = np.append(lookup, -1).astype(np.int32)
+                columns[column] = lookup[values.cat.codes.values]
+            elif column in _TIME_COLUMNS:
+                # Times repeat a lot, parse every distinct time once
+                secs = dp._get_secs(pd.Series(values.cat.categories.astype(str)))
+                secs = np.append(np.where(np.isnan(secs), MISSING_TIME, secs), MISSING_TIME)
+                columns[column] = secs.astype(np.int32)[values.cat.codes.values]
+            elif column in _STRING_COLUMNS:
+                columns[column] = np.asarray(values.fillna('').astype(str), dtype=object)
+            else:
+                columns[column] = values.values
+        coded[name] = pd.DataFrame(columns)
+    return coded, ids
+
+
+def _snapshot(tables, ids):
+    """
+    Arrays and metadata of a snapshot, strings being kept in the metadata
+    """
+    arrays, strings = dict(), dict()
+    for name, table in tables.items():
+        for column in table.columns:
+            key = '{}.{}'.format(name, column)
+            if column in _STRING_COLUMNS:
+                strings[key] = table[column].tolist()
+            else:
+                arrays[key] = table[column].values
+    meta = {'tables': list(tables), 'columns': {name: list(table.columns) for name, table in tables.items()},
+            'ids': {kind: values.tolist() for kind, values in ids.items()}, 'strings': strings}
+    return arrays, meta
+
+
+def _from_snapshot(arrays, meta):
+    tables = dict()
+    for name in meta['tables']:
+        columns = dict()
+        for column in meta['columns'][name]:
+            key = '{}.{}'.format(name, column)
+            columns[column] = meta['strings'][key] if key in meta['strings'] else arrays[key]
+        tables[name] = pd.DataFrame(columns)
+    ids = {kind: pd.Index(values, dtype=object) for kind, values in meta['ids'].items()}
+    return tables, ids
+
+
+def load_feed(ROOT_PATH, gtfs_foldername, tables=None, cache_dir=None):
+    """
+    Load the given tables of a GTFS feed, all by default. With a cache_dir
+    the loaded tables are stored as a snapshot keyed by the contents of the
+    table files and read from there while the files are unchanged.
+    """
+    gtfs_path = os.path.join(ROOT_PATH, gtfs_foldername)
+    tables = list(_TABLES) if tables is None else list(tables)
+    unknown = set(tables) - set(_TABLES)
+    if unknown:
+        raise Exception('Unknown GTFS tables {}'.format(sorted(unknown)))
+    if cache_dir is None:
+        return Feed(*_parse(gtfs_path, tables))
+
+    hashes = [dp._file_hash(os.path.join(gtfs_path, name + '.txt')) for name in tables
+              if os.path.exists(os.path.join(gtfs_path, name + '.txt'))]
+    tag = '-'.join(tables)
+    digest = hashlib.sha1(''.join(hashes).encode()).hexdigest()
+    key = 'gtfs_{}_{}.v{}'.format(tag, digest[:16], FEED_VERSION)
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(path):
+        return Feed(*_from_snapshot(*ps._read(path, 'gtfs', 'r')))
+
+    loaded, ids = _parse(gtfs_path, tables)
+    os.makedirs(cache_dir, exist_ok=True)
+    ps._write(path, 'gtfs', *_snapshot(loaded, ids))
+    for name in os.listdir(cache_dir):
+        if name.startswith('gtfs_{}_'.format(tag)) and name != key and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(cache_dir, name))
+    return Feed(loaded, ids)
+
+
+def _ordinal(date):
+    """
+    Day number of a date given as a datetime.date or as YYYYMMDD
+    """
+    if isinstance(date, datetime.date):
+        return date.toordinal()
+    date = int(date)
+    return datetime.date(date // 10000, date // 100 % 100, date % 100).toordinal()
+
+
+def _ordinals(dates):
+    """
+    Day numbers of an array of YYYYMMDD dates
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    days = np.array([datetime.date(y, m, 1).toordinal() for y, m in
+                     zip((dates // 10000).tolist(), (dates // 100 % 100).tolist())], dtype=np.int64)
+    return days + dates % 100 - 1
+
+
+class ServiceCalendar:
+    """
+    Days of operation of every service of a feed with the calendar and
+    calendar_dates tables, kept as a bitset per service over the days
+    covered by the feed. Resolves the services, trips and service window of
+    any date.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        num_services = len(feed.service_ids)
+        calendar = feed.tables.get('calendar')
+        dates = feed.tables.get('calendar_dates')
+        bounds = []
+        if calendar is not None and len(calendar):
+            bounds += [_ordinals(calendar.start_date.values).min(), _ordinals(calendar.end_date.values).max()]
+        if dates is not None and len(dates):
+            date_days = _ordinals(dates.date.values)
+            bounds += [date_days.min(), date_days.max()]
+        self.first_day = min(bounds) if bounds else 0
+        self.num_days = max(bounds) - self.first_day + 1 if bounds else 0
+
+        # Weekly pattern within the date range of every calendar row
+        active = np.zeros((num_services, self.num_days), dtype=bool)
+        days = self.first_day + np.arange(self.num_days)
+        weekdays = (days - 1) % 7 # ordinal 1 is a monday
+        if calendar is not None and len(calendar):
+            starts = _ordinals(calendar.start_date.values)
+            ends = _ordinals(calendar.end_date.values)
+            week = calendar[_DAYS].values.astype(bool)
+            for service, start, end, runs in zip(calendar.service_id.values, starts, ends, week):
+                if service >= 0:
+                    active[service] |= (days >= start) & (days <= end) & runs[weekdays]
+
+        # Exceptions, 1 adds the date to the service and 2 removes it
+        if dates is not None and len(dates):
+            keep = dates.service_id.values >= 0
+            services, offsets = dates.service_id.values[keep], date_days[keep] - self.first_day
+            exceptions = dates.exception_type.values[keep]
+            active[services[exceptions == 1], offsets[exceptions == 1]] = True
+            active[services[exceptions == 2], offsets[exceptions == 2]] = False
+
+        self.bits = np.packbits(active, axis=1)
+
+    def _offset(self, date):
+        offset = _ordinal(date) - self.first_day
+        if not 0 <= offset < self.num_days:
+            return None
+        return offset
+
+    def active(self, date):
+        """
+        Whether every service runs on date
+        """
+        offset = self._offset(date)
+        if offset is None:
+            return np.zeros(len(self.bits), dtype=bool)
+        return (self.bits[:, offset >> 3] >> (7 - (offset & 7))) & 1 == 1
+
+    def active_matrix(self, dates):
+        """
+        Whether every service runs on every date, dates x services
+        """
+        offsets = np.array([_ordinal(date) - self.first_day for date in dates], dtype=np.int64)
+        valid = (offsets >= 0) & (offsets < self.num_days)
+        clipped = np.clip(offsets, 0, max(self.num_days - 1, 0))
+        runs = (self.bits[:, clipped >> 3] >> (7 - (clipped & 7))) & 1 == 1
+        return runs.T & valid[:, None]
+
+    def service_ids(self, date):
+        """
+        Ids of the services running on date
+        """
+        return self.feed.service_ids[self.active(date)].tolist()
+
+    def trips(self, date):
+        """
+        Codes of the trips running on date
+        """
+        trips = self.feed.trips
+        service = trips.service_id.values
+        runs = np.append(self.active(date), False)[np.where(service >= 0, service, -1)]
+        return trips.trip_id.values[runs]
+
+    def stop_times(self, date):
+        """
+        Rows of stop_times of the trips running on date
+        """
+        stop_times = self.feed.stop_times
+        running = np.zeros(len(self.feed.trip_ids) + 1, dtype=bool)
+        running[self.trips(date)] = True
+        return stop_times[running[stop_times.trip_id.values]]
+
+    def service_window(self, date):
+        """
+        First and last departure of the trips running on date, None if no
+        trip runs
+        """
+        departures = self.stop_times(date).departure_time.values
+        departures = departures[departures != MISSING_TIME]
+        if len(departures) == 0:
+            return None
+        return int(departures.min()), int(departures.max())
@@ -6,8 +6,8 @@ Author: Pranay Thangeda
 Email: contact@prny.me
 """
 
-import warnings
 import dataprocessing as dp
+from diagnostics import Diagnostics
 import pandas as pd
 import os
 
@@ -37,36 +37,36 @@ def import_routes(ROOT_PATH, filename):
 
     return routes
 
-def routes_validation(G, routes_list):
+def routes_validation(G, routes_list, diagnostics=None):
     """
     Check if the routes in routes_list exist in transit network G with
-    sufficient number of samples.
+    sufficient number of samples. Missing nodes and edges are recorded
+    in diagnostics, a new Diagnostics printed at the end if not given.
     """
-    num_routes = len(routes_list)
-    num_missingnodes = 0
-    num_missingedges = 0
+    report = diagnostics is None
+    if report:
+        diagnostics = Diagnostics()
     num_minsamples = 10e10
+    store = G.graph['samples']
 
-    for route in routes_list:
+    for index, route in enumerate(routes_list):
 
-        for node in route:
-            if not G.has_node(node):
-                warnings.warn('Node from route doesnot exist in the graph')
-                print(node)
-                num_missingnodes += 1
+        missing = [node for node in route if not G.has_node(node)]
+        diagnostics.record('missing_nodes', len(missing),
+                           [{'route': index, 'node': node} for node in missing])
 
         edges = zip(route[0:-1], route[1:])
         for edge in edges:
             if G.has_edge(edge[0], edge[1]):
-                num_samples = len(G[edge[0]][edge[1]]['time_data'])
+                num_samples = store.numsamples(edge[0], edge[1])
                 if num_samples < num_minsamples:
                     num_minsamples = num_samples
             else:
-                warnings.warn('Edge required for route does not exist')
-                print(edge)
-                num_missingedges += 1
+                diagnostics.record('missing_edges', 1, [{'route': index, 'edge': edge}])
 
-    return num_missingnodes, num_missingedges, num_minsamples
+    if report:
+        print(diagnostics)
+    return diagnostics['missing_nodes'], diagnostics['missing_edges'], num_minsamples
 
 ROOT_PATH = 'D:\\Repos\\riskaware-planning'
 #☺G, list_tripshapes = dp.extract_data(ROOT_PATH, 'cumtd_gtfs')
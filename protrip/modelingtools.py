@@ -6,19 +6,80 @@ Author: Pranay Thangeda
 Email: contact@prny.me
 """
 
-def extract_transferpoints(routes_list):
+
+class TransferIndex:
     """
-    Given a list of route objects, create potential transfer points for
-    every route in the list. In case of multiple consecutive TP between the
-    same two routes, the last TP is considered as the TP and the rest are ignored.
+    Inverted index of the stops of a set of routes, routes_dict mapping route
+    names to their nodes. Gives the routes serving every stop and the stops
+    where a traveler on a route transfers to another route. In case of
+    multiple consecutive stops shared by the same two routes, the last one is
+    the transfer stop and the rest are ignored.
     """
 
-    for route in routes_list:
-        route_nodes = route.nodes
-        for node in route_nodes:
+    def __init__(self, routes_dict):
+        self.routes = dict(routes_dict)
+        self.stop_routes = dict()
+        for route_name, route_nodes in self.routes.items():
+            for node in dict.fromkeys(route_nodes):
+                self.stop_routes.setdefault(node, []).append(route_name)
+        self._transfers = dict()
+
+    def routes_at(self, stop):
+        """
+        Names of the routes serving a stop
+        """
+        return tuple(self.stop_routes.get(stop, ()))
+
+    def route_transfers(self, route_name, nodes=None):
+        """
+        Transfer stops of a route to every other route, in the order of the
+        route, from the nodes of the route in the index or the given nodes.
+        The position of a node repeated in the route is its first one.
+        """
+        if nodes is None and route_name in self._transfers:
+            return self._transfers[route_name]
+        route_nodes = self.routes[route_name] if nodes is None else nodes
 
+        first = dict()
+        for position, node in enumerate(route_nodes):
+            first.setdefault(node, position)
+        shared = [set(self.stop_routes.get(node, ())) - {route_name} if first[node] == position
+                  else set() for position, node in enumerate(route_nodes)]
+        shared.append(set())
 
+        transfers = dict()
+        for position, node in enumerate(route_nodes):
+            for other in shared[position] - shared[position+1]:
+                transfers.setdefault(other, []).append(node)
+        transfers = {other: tuple(stops) for other, stops in transfers.items()}
+        if nodes is None:
+            self._transfers[route_name] = transfers
+        return transfers
 
+    def transferstops(self, route_name, nodes=None):
+        """
+        Stops of a route where a traveler transfers to any other route
+        """
+        transfers = self.route_transfers(route_name, nodes)
+        stops = set(stop for route_stops in transfers.values() for stop in route_stops)
+        route_nodes = self.routes[route_name] if nodes is None else nodes
+        return tuple(node for node in dict.fromkeys(route_nodes) if node in stops)
 
-    # Should this be route object instead of route list? Maybe it should be.
+    def transfers(self, route_name1, route_name2):
+        """
+        Stops where a traveler on route_name1 transfers to route_name2
+        """
+        return self.route_transfers(route_name1).get(route_name2, ())
 
+
+def extract_transferpoints(routes_list):
+    """
+    Given a list of route objects, create potential transfer points for
+    every route in the list. In case of multiple consecutive TP between the
+    same two routes, the last TP is considered as the TP and the rest are ignored.
+    Returns the TransferIndex of the routes.
+    """
+    index = TransferIndex({route.name: route.nodes for route in routes_list})
+    for route in routes_list:
+        route.transferstops = index.transferstops(route.name)
+    return index
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Saving and loading the transit graph with its travel time
+samples and the probabilistic travel time model. Each is a folder with a
+manifest and one .npy file per array, arrays are memory-mapped on loading
+so that processes loading the same folder share a single copy in memory.
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+import networkx as nx
+import datamodeling as dm
+from samplestore import SampleStore
+from stopindex import StopIndex
+
+
+FORMAT_VERSION = 2
+_MANIFEST = 'manifest.json'
+
+
+def _write(path, kind, arrays, meta):
+    """
+    Write the arrays and the manifest of an object of the given kind in a
+    temporary folder and move it to path once complete
+    """
+    path = os.path.abspath(path)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    files = dict()
+    for name, array in arrays.items():
+        files[name] = name + '.npy'
+        np.save(os.path.join(tmp_path, files[name]), np.ascontiguousarray(array))
+    manifest = {'kind': kind, 'version': FORMAT_VERSION, 'arrays': files, 'meta': meta}
+    with open(os.path.join(tmp_path, _MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def _read(path, kind, mmap_mode):
+    """
+    Read the manifest of a saved object and memory-map its arrays
+    """
+    with open(os.path.join(path, _MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('kind') != kind:
+        raise Exception('{} does not hold a saved {}'.format(path, kind))
+    if manifest.get('version') != FORMAT_VERSION:
+        raise Exception('Unsupported format version {} of {}, expected {}'.format(
+            manifest.get('version'), path, FORMAT_VERSION))
+
+    arrays = {name: np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+              for name, filename in manifest['arrays'].items()}
+    return arrays, manifest['meta']
+
+
+def save_graph(G, path):
+    """
+    Save the stops, edges and travel time samples of a graph built by
+    dp.extract_data or streaming.FeedIngestor
+    """
+    store = G.graph['samples']
+    nodes = list(G.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edges = [(u, v, data) for u, v, data in G.edges(data=True)]
+
+    arrays = {
+        'stop_lat': np.array([G.nodes[node].get('stop_lat', np.nan) for node in nodes], dtype=float),
+        'stop_lon': np.array([G.nodes[node].get('stop_lon', np.nan) for node in nodes], dtype=float),
+        'edge_eid': np.array([data['eid'] for _, _, data in edges], dtype=np.int64),
+        'edge_length': np.array([data['length'] for _, _, data in edges], dtype=float),
+        'store_edges': np.array([(node_index[u], node_index[v]) for u, v in store.edges],
+                                dtype=np.int32).reshape(-1, 2),
+        'offsets': store.offsets,
+        'edge_ids': store.edge_ids,
+        'trips': store.trips,
+        'times': store.times,
+        'shapes': store.shapes,
+        'departs': store.departs,
+        'days': store.days}
+    meta = {'nodes': nodes, 'shape_names': store.shape_names}
+    if 'stops' in G.graph:
+        meta['stop_names'] = G.graph['stops'].names.tolist()
+    _write(path, 'graph', arrays, meta)
+
+
+def load_graph(path, mmap_mode='r'):
+    """
+    Load a graph saved with save_graph. The sample arrays are memory-mapped,
+    read-only with mmap_mode='r' and copy on write with mmap_mode='c'.
+    Returns the graph and the set of trip shapes, as dp.extract_data.
+    """
+    arrays, meta = _read(path, 'graph', mmap_mode)
+    nodes = meta['nodes']
+
+    G = nx.Graph()
+    G.add_nodes_from((node, {'stop_lat': lat, 'stop_lon': lon}) for node, lat, lon in
+                     zip(nodes, arrays['stop_lat'].tolist(), arrays['stop_lon'].tolist()))
+    if 'stop_names' in meta:
+        stops = StopIndex(meta['stop_names'])
+        stops.lat[nodes], stops.lon[nodes] = arrays['stop_lat'], arrays['stop_lon']
+        nx.set_node_attributes(G, {node: stops.name(node) for node in nodes}, 'name')
+        G.graph['stops'] = stops
+    store_edges = [(nodes[u], nodes[v]) for u, v in arrays['store_edges'].tolist()]
+    G.add_edges_from((store_edges[eid][0], store_edges[eid][1], {'eid': eid, 'length': length})
+                     for eid, length in zip(arrays['edge_eid'].tolist(),
+                                            arrays['edge_length'].tolist()))
+    G.graph['samples'] = SampleStore(store_edges, arrays['offsets'], arrays['trips'],
+                                     arrays['times'], arrays['shapes'], meta['shape_names'],
+                                     edge_ids=arrays['edge_ids'], departs=arrays.get('departs'),
+                                     days=arrays.get('days'))
+
+    return G, set(meta['shape_names'])
+
+
+def save_model(model, path):
+    """
+    Save the means, covariances and sample counts of a datamodeling.Model,
+    with the statistics of its time bins when it has any
+    """
+    cov = model.cov
+    pairs = list(model.index)
+    nodes = sorted(set(node for pair in pairs for node in pair))
+    node_index = {node: i for i, node in enumerate(nodes)}
+    route_names = list(model.routes)
+    route_positions = [model.routes[name] for name in route_names]
+
+    arrays = {
+        'index_pairs': np.array([(node_index[u], node_index[v]) for u, v in pairs],
+                                dtype=np.int32).reshape(-1, 2),
+        'index_positions': np.array([model.index[pair] for pair in pairs], dtype=np.int64),
+        'route_offsets': np.cumsum([0] + [len(p) for p in route_positions]),
+        'route_positions': np.concatenate(route_positions + [np.zeros(0, dtype=np.int64)]),
+        'eids': model.eids,
+        'mean': model.mean.values,
+        'counts': model.counts,
+        'weights': model.weights,
+        'cov_rows': cov.rows,
+        'cov_cols': cov.cols,
+        'cov_keys': cov.keys,
+        'cov_weight': cov.weight,
+        'cov_mean_i': cov.mean_i,
+        'cov_mean_j': cov.mean_j,
+        'cov_comoment': cov.comoment,
+        'dist_table': model.dist.table,
+        'dist_counts': model.dist.counts,
+        'dist_offsets': model.dist.offsets,
+        'dist_lo': model.dist.lo}
+    meta = {'nodes': nodes,
+            'resolution': model.dist.resolution,
+            'routes': route_names,
+            'numsamples': [model.numsamples[name] for name in route_names],
+            'forgetting': model.forgetting,
+            'min_bin_samples': model.min_bin_samples,
+            'weekend': None,
+            'cov_extra': [[int(row), int(col)] + [float(v) for v in values]
+                          for (row, col), values in cov.extra.items()]}
+    if model.time_bins is not None:
+        meta['weekend'] = model.time_bins.weekend
+        arrays.update({'bin_starts': model.time_bins.starts,
+                       'bin_counts': model.bin_counts,
+                       'bin_weights': model.bin_weights,
+                       'bin_mean': model.bin_mean,
+                       'bin_cov': model.bin_cov,
+                       'bin_covcounts': model.bin_covcounts})
+    _write(path, 'model', arrays, meta)
+
+
+def load_model(path, mmap_mode='r'):
+    """
+    Load a model saved with save_model. Arrays are memory-mapped read-only
+    with mmap_mode='r', use mmap_mode='c' for a private copy on write of the
+    arrays in a model updated with updatemodel.
+    """
+    arrays, meta = _read(path, 'model', mmap_mode)
+    nodes = meta['nodes']
+
+    model = dm.Model.__new__(dm.Model)
+    model.forgetting = meta['forgetting']
+    model.factors = dict()
+    model.time_bins = None
+    model.min_bin_samples = meta['min_bin_samples']
+    model.index = {(nodes[u], nodes[v]): position for (u, v), position in
+                   zip(arrays['index_pairs'].tolist(), arrays['index_positions'].tolist())}
+    offsets = arrays['route_offsets'].tolist()
+    model.routes = {name: arrays['route_positions'][start:end] for name, start, end in
+                    zip(meta['routes'], offsets[:-1], offsets[1:])}
+    model.edgeroutes = [set() for _ in range(len(arrays['eids']))]
+    for name, positions in model.routes.items():
+        for position in positions.tolist():
+            model.edgeroutes[position].add(name)
+    model.eids = arrays['eids']
+    model.counts = arrays['counts']
+    model.weights = arrays['weights']
+    model.mean = dm.EdgeValues(model.index, arrays['mean'])
+    model.numsamples = dict(zip(meta['routes'], meta['numsamples']))
+
+    cov = dm.SparseCov.__new__(dm.SparseCov)
+    cov.index = model.index
+    cov.size = len(model.eids)
+    cov.rows = arrays['cov_rows']
+    cov.cols = arrays['cov_cols']
+    cov.keys = arrays['cov_keys']
+    cov.weight = arrays['cov_weight']
+    cov.mean_i = arrays['cov_mean_i']
+    cov.mean_j = arrays['cov_mean_j']
+    cov.comoment = arrays['cov_comoment']
+    cov.extra = {(row, col): tuple(values) for row, col, *values in meta['cov_extra']}
+    cov._matrix = None
+    model.cov = cov
+
+    dist = dm.EdgeDistributions.__new__(dm.EdgeDistributions)
+    dist.resolution = meta['resolution']
+    dist.table = arrays['dist_table']
+    dist.counts = arrays['dist_counts']
+    dist.offsets = arrays['dist_offsets']
+    dist.widths = np.diff(dist.offsets)
+    dist.lo = arrays['dist_lo']
+    model.dist = dist
+
+    if meta['weekend'] is not None:
+        model.time_bins = dm.TimeBins(arrays['bin_starts'], meta['weekend'])
+        model.bin_counts = arrays['bin_counts']
+        model.bin_weights = arrays['bin_weights']
+        model.bin_mean = arrays['bin_mean']
+        model.bin_cov = arrays['bin_cov']
+        model.bin_covcounts = arrays['bin_covcounts']
+
+    return model
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Planner answering traveler queries from a graph, model and
+routes loaded once and shared by all the queries. Journeys ride one trip
+or transfer once between two trips, and are chosen with the alpha weighted
+cost of simulation.optimal_choice. A thread pool front end answers batches
+of queries concurrently, PlannerPool answers them on worker processes for
+throughput, and a local HTTP server stands in for the service in load tests.
+"""
+
+import json
+import math
+import bisect
+import numbers
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import reliability as rl
+import modelingtools as mt
+import persistence as ps
+from simulation import optimal_choice
+
+
+# Trip ridden from node board to node alight, with the expected times there
+Leg = namedtuple('Leg', ['trip_name', 'route', 'board', 'alight', 'board_time', 'alight_time'])
+# Chosen journey of a query, on_time is the probability of arriving within the budget
+Plan = namedtuple('Plan', ['legs', 'expected_arrival', 'expected_time', 'on_time', 'cost'])
+
+
+class Planner:
+    """
+    Journeys between stops over the trips of routes_list, a list of Route
+    objects with their start times loaded. On-time probabilities come from
+    engine, a reliability.ReliabilityEngine of the model by default, and
+    transfer stops from transfers, the modelingtools.TransferIndex of the
+    routes by default. The first num_trips trips of every route reaching
+    the origin after the departure are considered.
+    """
+
+    def __init__(self, G, model, routes_list, engine=None, num_trips=2, transfers=None):
+        self.G = G
+        self.stops = G.graph.get('stops')
+        self.model = model
+        self.engine = engine if engine is not None else rl.ReliabilityEngine(model)
+        self.num_trips = num_trips
+        self.routes = {route.name: route for route in routes_list}
+        self.stats = {route.name: self.engine.route(route) for route in routes_list}
+        self.starts = {route.name: sorted(route.list_starttimes) for route in routes_list}
+        if transfers is None:
+            transfers = mt.TransferIndex({route.name: route.nodes for route in routes_list})
+        self.transfers = transfers
+        self.routes_at = transfers.stop_routes
+        self.shared = dict() # (route, route) -> transfer (position, position) pairs
+
+    def _transfers(self, name1, name2):
+        """
+        Positions on both routes of the stops where a traveler can transfer
+        from route name1 to route name2
+        """
+        key = (name1, name2)
+        if key not in self.shared:
+            route1, route2 = self.routes[name1], self.routes[name2]
+            self.shared[key] = [(position1, route2.positions[node][0])
+                                for node in self.transfers.transfers(name1, name2)
+                                for position1 in route1.positions[node]]
+        return self.shared[key]
+
+    def _next_trips(self, name, position, time, count):
+        """
+        Start times of the first count trips of a route expected at position
+        at or after time
+        """
+        starts = self.starts[name]
+        first = bisect.bisect_left(starts, time - self.stats[name].mean(0, position))
+        return starts[first:first+count]
+
+    def plan(self, origin, destination, depart_time, budget, alpha):
+        """
+        Best journey from any of the origin stops to any of the destination
+        stops for a traveler at the origin at depart_time with a time budget
+        in seconds and delay tolerance alpha. The on-time probability of a
+        transfer is the probability of making the connection times that of
+        the second trip arriving within the budget. Returns a Plan, None if
+        no journey reaches the destination.
+        """
+        if isinstance(origin, (str, numbers.Integral)):
+            origin = [origin]
+        if isinstance(destination, (str, numbers.Integral)):
+            destination = [destination]
+        deadline = depart_time + budget
+        destinations = set(destination)
+
+        # First destination position after every position of the routes there
+        dest_positions = dict()
+        for node in destinations:
+            for name in self.routes_at.get(node, ()):
+                dest_positions.setdefault(name, []).extend(self.routes[name].positions[node])
+        for positions in dest_positions.values():
+            positions.sort()
+
+        def alight_after(name, position):
+            positions = dest_positions.get(name)
+            if positions is None:
+                return None
+            index = bisect.bisect_right(positions, position)
+            return positions[index] if index < len(positions) else None
+
+        options = []
+        for node in set(origin):
+            for name in self.routes_at.get(node, ()):
+                route, stats = self.routes[name], self.stats[name]
+                for board in route.positions[node]:
+                    starts = self._next_trips(name, board, depart_time, self.num_trips)
+                    alight = alight_after(name, board)
+                    for start in starts:
+                        if alight is None:
+                            break
+                        leg = Leg('{} {}'.format(name, start), name, node, route.nodes[alight],
+                                  start + stats.mean(0, board), start + stats.mean(0, alight))
+                        reli = self.engine.probability(route, 0, alight, deadline - start)
+                        options.append(((leg,), leg.alight_time, reli))
+
+                    # Transfer to a route reaching the destination
+                    for name2 in dest_positions:
+                        if name2 == name:
+                            continue
+                        route2, stats2 = self.routes[name2], self.stats[name2]
+                        for position, position2 in self._transfers(name, name2):
+                            alight2 = alight_after(name2, position2)
+                            if position <= board or alight2 is None:
+                                continue
+                            if route.nodes[position] in destinations:
+                                continue
+                            for start in starts:
+                                at_transfer = start + stats.mean(0, position)
+                                starts2 = self._next_trips(name2, position2, at_transfer, 1)
+                                if not starts2:
+                                    break
+                                start2 = starts2[0]
+                                leg1 = Leg('{} {}'.format(name, start), name, node,
+                                           route.nodes[position], start + stats.mean(0, board),
+                                           at_transfer)
+                                leg2 = Leg('{} {}'.format(name2, start2), name2, route.nodes[position],
+                                           route2.nodes[alight2], start2 + stats2.mean(0, position2),
+                                           start2 + stats2.mean(0, alight2))
+                                var = stats.var(0, position) + stats2.var(0, position2)
+                                if var > 0:
+                                    connect = 0.5*(1 + math.erf((leg2.board_time - at_transfer)
+                                                                / math.sqrt(2*var)))
+                                else:
+                                    connect = 1.0
+                                reli = connect*self.engine.probability(route2, 0, alight2,
+                                                                       deadline - start2)
+                                options.append(((leg1, leg2), leg2.alight_time, reli))
+
+        if not options:
+            return None
+        legs = optimal_choice(options, depart_time, alpha)
+        max_let = max(arrival - depart_time for _, arrival, _ in options) or 1
+        arrival, reli = next((arrival, reli) for option, arrival, reli in options if option is legs)
+        cost = alpha*(arrival - depart_time)/max_let - (1 - alpha)*reli
+        return Plan(list(legs), arrival, arrival - depart_time, reli, cost)
+
+    def plan_many(self, queries, max_workers=4):
+        """
+        Answer (origin, destination, depart_time, budget, alpha) queries on a
+        pool of threads sharing the planner, results in the order of queries.
+        Queries run in Python and hold the GIL, so the pool serves concurrent
+        callers without adding throughput over a loop, use PlannerPool for
+        throughput.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda query: self.plan(*query), queries))
+
+
+_worker_planner = None
+
+
+def _init_worker(graph_path, model_path, routes_list, num_trips):
+    global _worker_planner
+    G, _ = ps.load_graph(graph_path)
+    model = ps.load_model(model_path)
+    _worker_planner = Planner(G, model, routes_list, num_trips=num_trips)
+
+
+def _plan_query(query):
+    return _worker_planner.plan(*query)
+
+
+class PlannerPool:
+    """
+    Planners on worker processes. Every worker loads the graph and model
+    saved with persistence.save_graph and persistence.save_model at
+    graph_path and model_path, memory-mapped so the pages of their arrays
+    are shared, and builds its own Planner over routes_list.
+    """
+
+    def __init__(self, graph_path, model_path, routes_list, processes=None, num_trips=2, chunksize=64):
+        self.chunksize = chunksize
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                            initargs=(graph_path, model_path, list(routes_list), num_trips))
+
+    def plan_many(self, queries):
+        """
+        Answer (origin, destination, depart_time, budget, alpha) queries in
+        chunks of chunksize on the workers, results in the order of queries
+        """
+        return list(self.executor.map(_plan_query, queries, chunksize=self.chunksize))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def plan_json(plan, stops=None):
+    """
+    JSON serializable form of a Plan, None if there is no plan. With stops,
+    a StopIndex, stops of the legs are given by their node names.
+    """
+    if plan is None:
+        return None
+    if stops is not None:
+        plan = plan._replace(legs=[leg._replace(board=stops.name(leg.board), alight=stops.name(leg.alight))
+                                   for leg in plan.legs])
+    return {'legs': [{key: (float(value) if key.endswith('_time') else value)
+                      for key, value in leg._asdict().items()} for leg in plan.legs],
+            'expected_arrival': float(plan.expected_arrival),
+            'expected_time': float(plan.expected_time),
+            'on_time': float(plan.on_time),
+            'cost': float(plan.cost)}
+
+
+class _PlanHandler(BaseHTTPRequestHandler):
+    """
+    GET /plan?origin=..&destination=..&depart=..&budget=..&alpha=.., origin
+    and destination may be repeated for several stops. Stops are node names
+    when the graph of the planner has a StopIndex.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/plan':
+            self._reply(404, {'error': 'unknown path {}'.format(url.path)})
+            return
+        query = parse_qs(url.query)
+        planner = self.server.planner
+        try:
+            origin, destination = query['origin'], query['destination']
+            if planner.stops is not None:
+                origin = [planner.stops.get(name, -1) for name in origin]
+                destination = [planner.stops.get(name, -1) for name in destination]
+            plan = planner.plan(origin, destination, float(query['depart'][0]),
+                                float(query['budget'][0]), float(query.get('alpha', [0.5])[0]))
+        except (KeyError, ValueError) as e:
+            self._reply(400, {'error': 'bad query: {}'.format(e)})
+            return
+        self._reply(200, plan_json(plan, planner.stops))
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(planner, host='127.0.0.1', port=8000):
+    """
+    Local HTTP server answering plan queries with a thread per request, run
+    it with serve_forever and stop it with shutdown
+    """
+    server = ThreadingHTTPServer((host, port), _PlanHandler)
+    server.daemon_threads = True
+    server.planner = planner
+    return server
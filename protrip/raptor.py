@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Round based multi-criteria search (McRAPTOR) over a timetable
+held in flat arrays. Round k scans the stop sequences (patterns) serving the
+stops improved in round k-1, so journeys found in round k ride k trips. The
+result is the Pareto front of expected arrival, on-time probability and
+number of transfers.
+"""
+
+import math
+import bisect
+import numbers
+import numpy as np
+from collections import namedtuple
+import gtfs
+from stopindex import StopIndex
+from planner import Leg
+
+
+# Journey of the Pareto front, on_time is the probability of arriving within the budget
+Journey = namedtuple('Journey', ['legs', 'expected_arrival', 'on_time', 'transfers'])
+
+
+def _path_var0(model, nodes):
+    """
+    Variance of the travel time from the first node of a path to every node,
+    from the covariance of the edges of the path in the model, edges not in
+    the model adding no variance
+    """
+    positions = np.array([model.index.get(pair, -1) for pair in zip(nodes[:-1], nodes[1:])],
+                         dtype=np.int64)
+    present = positions >= 0
+    cov = np.zeros((len(positions), len(positions)))
+    if present.any():
+        cov[np.ix_(present, present)] = model.cov.submatrix(positions[present])
+    return np.concatenate(([0], cov.cumsum(0).cumsum(1).diagonal()))
+
+
+def _fill_times(times):
+    """
+    Times of the stops of a trip without a time in stop_times.txt, interpolated
+    between the timed stops
+    """
+    missing = np.isnan(times)
+    if missing.any() and not missing.all():
+        positions = np.arange(len(times))
+        times = times.copy()
+        times[missing] = np.interp(positions[missing], positions[~missing], times[~missing])
+    return times
+
+
+def _on_time(tau, c, v, deadline):
+    """
+    Probability of arriving before deadline at a label with expected arrival
+    tau, connection probability c and variance v
+    """
+    if v > 0:
+        return c*0.5*(1 + math.erf((deadline - tau)/math.sqrt(2*v)))
+    return c*float(tau <= deadline)
+
+
+def _dominated(bag, tau, c, v):
+    for label in bag:
+        if label[0] <= tau and label[1] >= c and label[2] <= v:
+            return True
+    return False
+
+
+def _merge(bag, label):
+    """
+    Add label to a bag of (expected arrival, connection probability, variance,
+    parent, round) labels, dropping the labels it dominates. Labels of
+    earlier rounds took fewer trips and are only dominated by labels of their
+    round or earlier. Returns False if label is dominated.
+    """
+    tau, c, v, k = label[0], label[1], label[2], label[4]
+    if _dominated(bag, tau, c, v):
+        return False
+    bag[:] = [other for other in bag
+              if not (tau <= other[0] and c >= other[1] and v <= other[2] and k <= other[4])]
+    bag.append(label)
+    return True
+
+
+class Timetable:
+    """
+    Trips grouped in patterns, trips of a pattern serving the same stops in
+    the same order without overtaking each other. Built from a list of
+    (pattern name, stop names, trip names, departures, arrivals, variances)
+    with departures and arrivals of shape trips x stops and the variance of
+    the travel time from the first stop to every stop. Travelers transfer
+    at the stops of transferstops, at every stop if None.
+
+    Arrays, flat over the patterns:
+        pattern_offsets, pattern_stops, var0: stops of every pattern
+        trip_offsets, trip_names: trips of every pattern, by departure
+        time_offsets, dep, arr: times of the trips of every pattern, stop major
+        stop_offsets, stop_patterns, stop_positions: patterns at every stop
+    """
+
+    def __init__(self, patterns, transferstops=None):
+        self.stop_names = []
+        self.stop_index = dict()
+        self.pattern_names = []
+        self.trip_names = []
+        pattern_stops, var0, dep, arr = [], [], [], []
+        pattern_offsets, trip_offsets, time_offsets = [0], [0], [0]
+
+        for name, stops, trip_names, departures, arrivals, variances in patterns:
+            departures = np.asarray(departures, dtype=float).reshape(len(trip_names), len(stops))
+            arrivals = np.asarray(arrivals, dtype=float).reshape(len(trip_names), len(stops))
+            order = np.argsort(departures[:, 0], kind='stable')
+            for s in stops:
+                if s not in self.stop_index:
+                    self.stop_index[s] = len(self.stop_names)
+                    self.stop_names.append(s)
+
+            # Trips overtaking an earlier trip of the pattern go to another pattern
+            groups = []
+            for t in order.tolist():
+                for group in groups:
+                    last = group[-1]
+                    if (departures[t] >= departures[last]).all() and (arrivals[t] >= arrivals[last]).all():
+                        group.append(t)
+                        break
+                else:
+                    groups.append([t])
+
+            for group in groups:
+                self.pattern_names.append(name)
+                pattern_stops.extend(self.stop_index[s] for s in stops)
+                var0.extend(np.asarray(variances, dtype=float).tolist())
+                self.trip_names.extend(trip_names[t] for t in group)
+                dep.append(departures[group].T.ravel())
+                arr.append(arrivals[group].T.ravel())
+                pattern_offsets.append(len(pattern_stops))
+                trip_offsets.append(len(self.trip_names))
+                time_offsets.append(time_offsets[-1] + len(group)*len(stops))
+
+        self.pattern_offsets = np.array(pattern_offsets, dtype=np.int64)
+        self.pattern_stops = np.array(pattern_stops, dtype=np.int32)
+        self.var0 = np.array(var0)
+        self.trip_offsets = np.array(trip_offsets, dtype=np.int64)
+        self.time_offsets = np.array(time_offsets, dtype=np.int64)
+        self.dep = np.concatenate(dep + [np.zeros(0)])
+        self.arr = np.concatenate(arr + [np.zeros(0)])
+
+        # Patterns at every stop, inverted from the pattern stops
+        num_stops = len(self.stop_names)
+        pattern_of = np.repeat(np.arange(len(self.pattern_names)), np.diff(self.pattern_offsets))
+        position_of = np.arange(len(self.pattern_stops)) - self.pattern_offsets[pattern_of]
+        order = np.argsort(self.pattern_stops, kind='stable')
+        self.stop_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.pattern_stops,
+                                                                        minlength=num_stops))))
+        self.stop_patterns = pattern_of[order]
+        self.stop_positions = position_of[order]
+
+        self.transfer = np.ones(num_stops, dtype=bool)
+        if transferstops is not None:
+            self.transfer[:] = False
+            self.transfer[[self.stop_index[s] for s in transferstops if s in self.stop_index]] = True
+
+        # Lists of the arrays for the scans of the search
+        self._lists = None
+
+    @classmethod
+    def from_routes(cls, routes_list, model):
+        """
+        Timetable of Route objects, trips leaving at the start times of the
+        route and reaching every stop at the expected times of the model. The
+        transfer stops of the routes are used when loaded.
+        """
+        patterns = []
+        transferstops = set()
+        for route in routes_list:
+            if route.cummean is None:
+                route.load_meantimes(model)
+            starts = np.array(sorted(route.list_starttimes), dtype=float)
+            times = starts[:, None] + route.cummean[None, :]
+            variances = [route.remaining_var(0, i) for i in range(len(route.nodes))]
+            patterns.append((route.name, route.nodes, ['{} {}'.format(route.name, int(s)) for s in starts],
+                             times, times, variances))
+            if route.transferstops is None:
+                transferstops = None
+            elif transferstops is not None:
+                transferstops.update(route.transferstops)
+        return cls(patterns, transferstops)
+
+    @classmethod
+    def from_gtfs(cls, ROOT_PATH, gtfs_foldername, service_ids=None, model=None,
+                  transferstops=None, cache_dir=None, date=None):
+        """
+        Timetable of the trips in trips.txt and stop_times.txt of a GTFS
+        feed loaded with gtfs.load_feed, see from_feed
+        """
+        tables = ['stops', 'trips', 'stop_times']
+        if date is not None:
+            tables += ['calendar', 'calendar_dates']
+        feed = gtfs.load_feed(ROOT_PATH, gtfs_foldername, tables=tables, cache_dir=cache_dir)
+        return cls.from_feed(feed, service_ids, model, transferstops, date)
+
+    @classmethod
+    def from_feed(cls, feed, service_ids=None, model=None, transferstops=None, date=None):
+        """
+        Timetable of the trips of a gtfs.Feed, of the given service ids or
+        all, and of the services running on date when given. Stops are the
+        node codes of dp.extract_data, from a StopIndex of the feed. Variances
+        come from the model when given, and are zero otherwise.
+        """
+        trips = feed.trips
+        if date is not None:
+            running = gtfs.ServiceCalendar(feed).service_ids(date)
+            service_ids = running if service_ids is None else set(service_ids).intersection(running)
+        if service_ids is not None:
+            codes = feed.service_ids.get_indexer(list(service_ids))
+            trips = trips[np.isin(trips.service_id.values, codes[codes >= 0])]
+        route_of = np.full(len(feed.trip_ids), -1)
+        route_of[trips.trip_id.values] = trips.route_id.values
+
+        stop_times = feed.stop_times
+        stop_times = stop_times[np.isin(stop_times.trip_id.values, trips.trip_id.values)]
+        order = np.lexsort((stop_times.stop_sequence.values, stop_times.trip_id.values))
+        trip_codes = stop_times.trip_id.values[order]
+        stop_nodes = np.append(StopIndex.from_feed(feed).stop_nodes, -1)
+        stop_codes = stop_nodes[stop_times.stop_id.values[order]].tolist()
+        times = dict()
+        for column in ('arrival_time', 'departure_time'):
+            times[column] = stop_times[column].values[order].astype(float)
+            times[column][times[column] == gtfs.MISSING_TIME] = np.nan
+        bounds = np.flatnonzero(np.append(True, trip_codes[1:] != trip_codes[:-1]))
+        bounds = np.append(bounds, len(trip_codes)).tolist()
+
+        # Trips with the same route and stops share a pattern
+        groups = dict()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            key = (route_of[trip_codes[start]], tuple(stop_codes[start:end]))
+            groups.setdefault(key, []).append((start, end))
+        patterns = []
+        for (route, stops), spans in groups.items():
+            names = [feed.trip_ids[trip_codes[start]] for start, _ in spans]
+            dep = np.array([_fill_times(times['departure_time'][start:end]) for start, end in spans])
+            arr = np.array([_fill_times(times['arrival_time'][start:end]) for start, end in spans])
+            variances = _path_var0(model, stops) if model is not None else np.zeros(len(stops))
+            patterns.append((feed.route_ids[route], stops, names, dep, arr, variances))
+        return cls(patterns, transferstops)
+
+    def _scan_lists(self):
+        if self._lists is None:
+            self._lists = (self.pattern_offsets.tolist(), self.pattern_stops.tolist(),
+                           self.var0.tolist(), (self.trip_offsets[1:] - self.trip_offsets[:-1]).tolist(),
+                           self.time_offsets.tolist(), self.dep.tolist(), self.arr.tolist(),
+                           self.stop_offsets.tolist(), self.stop_patterns.tolist(),
+                           self.stop_positions.tolist(), self.transfer.tolist())
+        return self._lists
+
+    def search(self, origin, destination, depart_time, budget, max_rounds=3, num_trips=2):
+        """
+        Pareto front of the journeys from any of the origin stops to any of
+        the destination stops for a traveler at the origin at depart_time with
+        a time budget, riding at most max_rounds trips. At every stop the
+        first num_trips trips departing after the expected arrival are
+        boarded. Labels carry the expected arrival, the probability of having
+        made the connections so far and the variance of the arrival, the
+        on-time probability of a journey being the product of its connection
+        probabilities and of its last trip arriving within the budget.
+        Returns the Journeys by expected arrival.
+        """
+        (pattern_offsets, pattern_stops, var0, num_trips_of, time_offsets, dep, arr,
+         stop_offsets, stop_patterns, stop_positions, transfer) = self._scan_lists()
+        if isinstance(origin, (str, numbers.Integral)):
+            origin = [origin]
+        if isinstance(destination, (str, numbers.Integral)):
+            destination = [destination]
+        deadline = depart_time + budget
+        targets = set(self.stop_index[s] for s in destination if s in self.stop_index)
+
+        previous = {self.stop_index[s]: [(depart_time, 1.0, 0.0, None, 0)]
+                    for s in origin if s in self.stop_index}
+        best = {s: list(bag) for s, bag in previous.items()}
+        arrived = [] # labels at the destination, with their round
+        bounds = [] # (expected arrival, on-time probability) of the labels at the destination
+        marked = set(previous)
+
+        for k in range(1, max_rounds + 1):
+            # Earliest marked position of every pattern serving the marked stops
+            queue = dict()
+            for s in marked:
+                if k > 1 and not transfer[s]:
+                    continue
+                for index in range(stop_offsets[s], stop_offsets[s+1]):
+                    p, i = stop_patterns[index], stop_positions[index]
+                    if i < queue.get(p, math.inf):
+                        queue[p] = i
+
+            current = dict()
+            for p, first in queue.items():
+                n = num_trips_of[p]
+                base, offset = time_offsets[p], pattern_offsets[p]
+                length = pattern_offsets[p+1] - offset
+                route_bag = [] # (connection probability, trip, label, boarding position)
+                for i in range(first, length):
+                    s = pattern_stops[offset + i]
+
+                    # Alight the trips of the route bag
+                    for c, t, label, board in route_bag:
+                        tau, v = arr[base + i*n + t], var0[offset + i]
+                        # Journeys through the label arrive after tau with at most c on time
+                        if bounds and any(tau_d <= tau and p_d >= c for tau_d, p_d in bounds):
+                            continue
+                        if _dominated(best.get(s, ()), tau, c, v):
+                            continue
+                        new = (tau, c, v, (label, p, t, board, i), k)
+                        _merge(best.setdefault(s, []), new)
+                        if s in targets:
+                            if _merge(arrived, new):
+                                bounds.append((tau, _on_time(tau, c, v, deadline)))
+                        else:
+                            current.setdefault(s, []).append(new)
+
+                    # Board the first trips departing after the labels of the last round
+                    if s not in previous or i == length - 1 or (k > 1 and not transfer[s]):
+                        continue
+                    lo = base + i*n
+                    for label in previous[s]:
+                        tau, c, v = label[0], label[1], label[2]
+                        first_trip = bisect.bisect_left(dep, tau, lo, lo + n) - lo
+                        for t in range(first_trip, min(first_trip + num_trips, n)):
+                            if k > 1:
+                                var = v + var0[offset + i]
+                                if var > 0:
+                                    c_t = c*0.5*(1 + math.erf((dep[lo + t] - tau)/math.sqrt(2*var)))
+                                else:
+                                    c_t = c
+                            else:
+                                c_t = c
+                            if any(t2 <= t and c2 >= c_t for c2, t2, _, _ in route_bag):
+                                continue
+                            route_bag[:] = [entry for entry in route_bag
+                                            if not (t <= entry[1] and c_t >= entry[0])]
+                            route_bag.append((c_t, t, label, i))
+
+            # Labels of the round not dominated by later labels of the round
+            for s, labels in current.items():
+                alive = set(map(id, best[s]))
+                current[s] = [label for label in labels if id(label) in alive]
+            previous = current
+            marked = set(current)
+            if not marked:
+                break
+
+        return self._front(arrived, deadline)
+
+    def _front(self, arrived, deadline):
+        """
+        Journeys of the destination labels not dominated in expected
+        arrival, on-time probability and transfers
+        """
+        journeys = []
+        for tau, c, v, parent, k in arrived:
+            journeys.append((tau, _on_time(tau, c, v, deadline), k - 1, parent))
+        front = [(tau, on_time, transfers, parent) for tau, on_time, transfers, parent in journeys
+                 if not any(o[0] <= tau and o[1] >= on_time and o[2] <= transfers
+                            and (o[0], o[1], o[2]) != (tau, on_time, transfers) for o in journeys)]
+        front.sort(key=lambda journey: (journey[0], journey[2]))
+        return [Journey(self._legs(parent), tau, on_time, transfers)
+                for tau, on_time, transfers, parent in front]
+
+    def _legs(self, parent):
+        """
+        Legs of a journey from the parent chain of its destination label
+        """
+        legs = []
+        while parent is not None:
+            label, p, t, board, alight = parent
+            n = self.trip_offsets[p+1] - self.trip_offsets[p]
+            base, offset = self.time_offsets[p], self.pattern_offsets[p]
+            legs.append(Leg(self.trip_names[self.trip_offsets[p] + t], self.pattern_names[p],
+                            self.stop_names[self.pattern_stops[offset + board]],
+                            self.stop_names[self.pattern_stops[offset + alight]],
+                            float(self.dep[base + board*n + t]), float(self.arr[base + alight*n + t])))
+            parent = label[3]
+        return legs[::-1]
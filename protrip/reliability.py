@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: On-time probability of trips for the traveler decisions. The
+travel time between any two nodes of a route is summarized by prefix sums
+precomputed once per route, so that the probability of covering it within
+a time budget costs O(1) per candidate trip at every decision. The full
+distribution of the travel time to any end position is convolved with FFTs
+once and kept for the on-time probability and percentile queries.
+"""
+
+import math
+import numpy as np
+from scipy import fft
+from scipy.special import ndtri
+
+
+class RouteReliability:
+    """
+    Travel time statistics between any two positions of a route. The mean and
+    variance come from the prefix sums of the route loaded from the model with
+    Route.load_meantimes. The distribution of the travel time to an end
+    position is built by convolving the histograms of the edges, assuming
+    independent edges, from the samples of store at resolution seconds when
+    given and from the histograms of the model otherwise.
+    """
+
+    def __init__(self, route, model, store=None, resolution=1):
+        route.load_meantimes(model)
+        nodes = route.nodes
+        self.name = route.name
+        self.route = route
+        self.cummean = route.cummean
+        self.cumcov = route.cumcov
+
+        self.pmfs = []
+        self.cdfs = dict() # end position -> (first bin, cdf) of every start position
+        if store is not None:
+            self.resolution = resolution
+            for u, v in zip(nodes[:-1], nodes[1:]):
+                bins = np.floor(np.asarray(store.edge_times(u, v))/resolution).astype(np.int64)
+                lo = bins.min()
+                self.pmfs.append((lo, np.bincount(bins - lo)/len(bins)))
+        else:
+            self.resolution = model.dist.resolution
+            positions = (model.routes[route.name] if route.name in model.routes
+                         else model.path_positions(nodes))
+            self.pmfs = [model.dist.histogram(p) for p in positions.tolist()]
+
+    def position(self, node, after):
+        return self.route.position(node, after)
+
+    def mean(self, start, end):
+        return self.route.remaining_mean(start, end)
+
+    def var(self, start, end):
+        return self.route.remaining_var(start, end)
+
+    def normal(self, start, end, slack):
+        """
+        Probability of travelling from position start to end within slack
+        seconds under a normal approximation
+        """
+        mean, var = self.mean(start, end), self.var(start, end)
+        if var > 0:
+            return 0.5*(1 + math.erf((slack - mean)/math.sqrt(2*var)))
+        return float(mean <= slack)
+
+    def normal_percentile(self, start, end, q):
+        """
+        Travel time from position start to end not exceeded with probability
+        q under a normal approximation
+        """
+        return self.mean(start, end) + math.sqrt(max(self.var(start, end), 0))*ndtri(q)
+
+    def convolution(self, start, end, slack):
+        """
+        Probability of travelling from position start to end within slack
+        seconds from the convolution of the edge histograms
+        """
+        if end not in self.cdfs:
+            self._suffix_cdfs(end)
+        lo, cdf = self.cdfs[end][start]
+        index = int(math.floor(slack/self.resolution)) - lo
+        if index < 0:
+            return 0.0
+        if index >= len(cdf):
+            return 1.0
+        return cdf[index]
+
+    def convolution_percentile(self, start, end, q):
+        """
+        Least travel time from position start to end, at the resolution,
+        whose probability of not being exceeded is at least q
+        """
+        if end not in self.cdfs:
+            self._suffix_cdfs(end)
+        lo, cdf = self.cdfs[end][start]
+        index = min(int(np.searchsorted(cdf, q - 1e-12)), len(cdf) - 1)
+        return (lo + index)*self.resolution
+
+    def _suffix_cdfs(self, end):
+        """
+        Distributions of the travel time to end from every earlier position.
+        The edge histograms are transformed with one batched FFT long enough
+        for the whole suffix, the transforms of all the suffixes are their
+        cumulative products from end and one batched inverse FFT gives all
+        the suffix distributions. Round-off is clipped and tails below 1e-15
+        are cut.
+        """
+        cdfs = [None]*(end+1)
+        cdfs[end] = (0, np.ones(1))
+        if end > 0:
+            los = [lo for lo, _ in self.pmfs[:end]]
+            widths = [len(pmf) for _, pmf in self.pmfs[:end]]
+            size = fft.next_fast_len(sum(widths) - end + 1, real=True)
+            padded = np.zeros((end, size))
+            for position, (_, pmf) in enumerate(self.pmfs[:end]):
+                padded[position, :len(pmf)] = pmf
+            spectra = fft.rfft(padded, axis=1)
+            suffixes = fft.irfft(np.cumprod(spectra[::-1], axis=0)[::-1], size, axis=1)
+            lo = np.cumsum(los[::-1])[::-1]
+            for position in range(end):
+                pmf = np.maximum(suffixes[position], 0)
+                nonzero = np.flatnonzero(pmf > 1e-15)
+                pmf = pmf[nonzero[0]:nonzero[-1]+1]
+                cdfs[position] = (int(lo[position]) + int(nonzero[0]),
+                                  np.minimum(np.cumsum(pmf)/pmf.sum(), 1.0))
+        self.cdfs[end] = cdfs
+
+
+class ReliabilityEngine:
+    """
+    RouteReliability of every route, built on first use. method is 'normal'
+    for the normal approximation from the model or 'convolution' for the
+    distribution of the edge samples, from the samples of G at resolution
+    seconds when given and from the edge histograms of the model otherwise.
+    """
+
+    def __init__(self, model, G=None, method='normal', resolution=1):
+        if method not in ('normal', 'convolution'):
+            raise Exception('Unknown reliability method {}'.format(method))
+        self.model = model
+        self.store = G.graph['samples'] if method == 'convolution' and G is not None else None
+        self.method = method
+        self.resolution = resolution
+        self.routes = dict()
+
+    def route(self, route):
+        """
+        Statistics of a Route object
+        """
+        if route.name not in self.routes:
+            self.routes[route.name] = RouteReliability(route, self.model, self.store,
+                                                       self.resolution)
+        return self.routes[route.name]
+
+    def probability(self, route, start, end, slack):
+        """
+        Probability of a trip of route travelling from position start to end
+        within slack seconds
+        """
+        route_stats = self.route(route)
+        if self.method == 'normal':
+            return route_stats.normal(start, end, slack)
+        return route_stats.convolution(start, end, slack)
+
+    def percentile(self, route, start, end, q):
+        """
+        Travel time of a trip of route from position start to end not
+        exceeded with probability q
+        """
+        route_stats = self.route(route)
+        if self.method == 'normal':
+            return route_stats.normal_percentile(start, end, q)
+        return route_stats.convolution_percentile(start, end, q)
+
+    def invalidate(self, route_names=None):
+        """
+        Drop the statistics of the given routes, all by default, after an
+        update of the model or of the samples
+        """
+        if route_names is None:
+            self.routes.clear()
+        for name in route_names or ():
+            self.routes.pop(name, None)
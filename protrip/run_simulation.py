@@ -6,29 +6,37 @@ Author: Pranay Thangeda
 Email: contact@prny.me
 """
 
+import os
 import dataprocessing as dp
 import datamodeling as dm
+import modelingtools as mt
 from simulation import *
+from planner import Planner, plan_json
 
 
 ROOT_PATH = # Path to your folder here
 
-# Extract data
-if 'G' in locals():
-    pass
-else:
-    G, list_tripshapes = dp.extract_data(ROOT_PATH, 'cumtd_gtfs')
-
-# Import routes and build probablistic model
-routes_dict = dp.import_routes(ROOT_PATH, 'sample_routes')
-TTM = dm.Model(G, routes_dict)
-
-# Build route objects
+# Extract data, only new or modified data files are parsed after the first run,
+# travel times far from the median of their edge are rejected
+G, list_tripshapes = dp.extract_data(ROOT_PATH, 'cumtd_gtfs',
+                                     cache_dir=os.path.join(ROOT_PATH, 'cache'),
+                                     filters=[dp.MADFilter()])
+
+# Import routes and build probablistic model, stops are the integer codes of G
+stops = G.graph['stops']
+routes_dict = dp.import_routes(ROOT_PATH, 'sample_routes', stops)
+TTM = dm.Model(G, routes_dict, time_bins=dm.TimeBins(weekend=True))
+
+# Build route objects, trips leave every headway seconds over the service day
+service_date = 20190114
+t_begin, t_end = dp.service_times(ROOT_PATH, 'cumtd_gtfs', date=service_date)
+headway = 900
+transfers = mt.TransferIndex(routes_dict)
 routeobjects = []
 for route_name, route_nodes in routes_dict.items():
-    ro = Route(route_name, route_nodes, [])
+    ro = Route(route_name, route_nodes, list(range(t_begin, t_end, headway)))
     ro.load_nodelocations(G)
-    ro.load_transferstops(routes_dict)
+    ro.load_transferstops(routes_dict, transfers)
     ro.load_meantimes(TTM)
     routeobjects.append(ro)
 
@@ -39,13 +47,15 @@ t_budget = 600 # tim budget in seconds
 t_departure = 64800 # departure time in seconds (since start of the day)
 alpha = 0.4 # user delay tolerance
 
-traveler = Trav(origin, destination, t_budget,alpha, t_departure)
+traveler = Trav(stops.intern(origin), stops.intern(destination), t_budget, alpha, t_departure)
 
 # Run simulation
-ROOT_PATH = 'D:\\Repos\\riskaware-planning'
-t_begin, t_end = dp.service_times(ROOT_PATH, 'cumtd_gtfs')
-t_step = 1
-policy = simulate(t_begin, t_end, t_step, traveler, routes_dict)
+policy, trips = simulate(G, TTM, routeobjects, traveler, t_begin, t_end)
+
+# Plan the same query with the planner, shared by any number of queries
+planner = Planner(G, TTM, routeobjects)
+plan = planner.plan(stops.intern(origin), stops.intern(destination), t_departure, t_budget, alpha)
+print(plan_json(plan, stops))
 
 
 
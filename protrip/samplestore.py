@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Columnar store of the travel time samples on the edges of the
+transit graph
+"""
+
+import numpy as np
+
+
+# Departure time or day of a sample not known
+MISSING = -1
+
+
+class SampleStore:
+    """
+    Travel time samples of all the edges held as typed arrays grouped by
+    edge (CSR layout). The samples of edge i are the slice
+    offsets[i]:offsets[i+1] of edge_ids, trips, times, shapes, departs and
+    days, sorted by trip. departs holds the departure time of the sample in
+    seconds from the start of the service day and days its day of the week,
+    0 for monday, MISSING where not known. Each sample takes 21 bytes.
+    Samples appended one at a time are buffered and merged into the arrays
+    on the next read.
+    """
+
+    def __init__(self, edges, offsets, trips, times, shapes, shape_names, edge_ids=None,
+                 departs=None, days=None):
+        self.edges = list(edges)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        if edge_ids is None:
+            edge_ids = np.repeat(np.arange(len(self.edges), dtype=np.int32), np.diff(self._offsets))
+        self._edge_ids = np.asarray(edge_ids, dtype=np.int32)
+        self._trips = np.asarray(trips, dtype=np.int32)
+        self._times = np.asarray(times, dtype=np.int32)
+        self._shapes = np.asarray(shapes, dtype=np.int32)
+        if departs is None:
+            departs = np.full(len(self._times), MISSING)
+        if days is None:
+            days = np.full(len(self._times), MISSING)
+        self._departs = np.asarray(departs, dtype=np.int32)
+        self._days = np.asarray(days, dtype=np.int8)
+        self.shape_names = list(shape_names)
+        self._shape_codes = {name: code for code, name in enumerate(self.shape_names)}
+        self._pending = []
+
+        # Both directions of an edge share the same samples
+        self.index = dict()
+        for eid, (u, v) in enumerate(self.edges):
+            self.index[(u, v)] = eid
+            self.index[(v, u)] = eid
+
+    @property
+    def offsets(self):
+        self.compact()
+        return self._offsets
+
+    @property
+    def edge_ids(self):
+        self.compact()
+        return self._edge_ids
+
+    @property
+    def trips(self):
+        self.compact()
+        return self._trips
+
+    @property
+    def times(self):
+        self.compact()
+        return self._times
+
+    @property
+    def shapes(self):
+        self.compact()
+        return self._shapes
+
+    @property
+    def departs(self):
+        self.compact()
+        return self._departs
+
+    @property
+    def days(self):
+        self.compact()
+        return self._days
+
+    def add_edge(self, u, v):
+        """
+        Add an edge without samples between nodes u and v, returns its index
+        """
+        eid = len(self.edges)
+        self.edges.append((u, v))
+        self.index[(u, v)] = eid
+        self.index[(v, u)] = eid
+        self._pending.append((eid, None, None, None, None, None))
+        return eid
+
+    def shape_id(self, shape_name):
+        """
+        Code of a trip shape, new shapes are added to shape_names
+        """
+        if shape_name not in self._shape_codes:
+            self._shape_codes[shape_name] = len(self.shape_names)
+            self.shape_names.append(shape_name)
+        return self._shape_codes[shape_name]
+
+    def append(self, eid, trip, time, shape, depart=MISSING, day=MISSING):
+        """
+        Append a sample of edge eid, a trip keeps a single sample per edge
+        and the latest sample of a trip replaces the earlier ones
+        """
+        self._pending.append((eid, trip, time, shape, depart, day))
+
+    def compact(self):
+        """
+        Merge the appended samples into the arrays
+        """
+        if not self._pending:
+            return
+        samples = [sample for sample in self._pending if sample[1] is not None]
+        self._pending = []
+        eids, trips, times, shapes, departs, days = np.array(samples, dtype=np.int32).reshape(-1, 6).T
+
+        edge_ids = np.concatenate((self._edge_ids, eids))
+        trips = np.concatenate((self._trips, trips))
+        order = np.lexsort((trips, edge_ids))
+        last = np.append((np.diff(edge_ids[order]) != 0) | (np.diff(trips[order]) != 0), True)
+        order = order[last]
+
+        self._edge_ids = edge_ids[order]
+        self._trips = trips[order]
+        self._times = np.concatenate((self._times, times))[order]
+        self._shapes = np.concatenate((self._shapes, shapes))[order]
+        self._departs = np.concatenate((self._departs, departs))[order]
+        self._days = np.concatenate((self._days, days.astype(np.int8)))[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(self._edge_ids,
+                                                                   minlength=len(self.edges)))))
+
+    def __len__(self):
+        return len(self.edges)
+
+    @property
+    def nbytes(self):
+        return (self.edge_ids.nbytes + self.trips.nbytes + self.times.nbytes
+                + self.shapes.nbytes + self.departs.nbytes + self.days.nbytes + self.offsets.nbytes)
+
+    def edge_id(self, u, v):
+        """
+        Index of the edge between nodes u and v
+        """
+        return self.index[(u, v)]
+
+    def has_edge(self, u, v):
+        return (u, v) in self.index
+
+    def _slice(self, u, v):
+        eid = self.index[(u, v)]
+        return slice(self.offsets[eid], self.offsets[eid+1])
+
+    def numsamples(self, u, v):
+        """
+        Number of samples on the edge between nodes u and v
+        """
+        eid = self.index[(u, v)]
+        return int(self.offsets[eid+1] - self.offsets[eid])
+
+    def edge_times(self, u, v):
+        """
+        Travel time samples on the edge between nodes u and v
+        """
+        return self.times[self._slice(u, v)]
+
+    def edge_trips(self, u, v):
+        """
+        Trip ids of the samples on the edge between nodes u and v
+        """
+        return self.trips[self._slice(u, v)]
+
+    def edge_shapes(self, u, v):
+        """
+        Set of trip shapes that traversed the edge between nodes u and v
+        """
+        return set(self.shape_names[i] for i in np.unique(self.shapes[self._slice(u, v)]))
+
+    def timedata(self, u, v):
+        """
+        Samples on the edge between nodes u and v as a dict of trip to time
+        """
+        s = self._slice(u, v)
+        return dict(zip(self.trips[s].tolist(), self.times[s].tolist()))
+
+    def sample_index(self, eids):
+        """
+        Positions of the samples of the edges eids, edge after edge
+        """
+        eids = np.asarray(eids, dtype=np.int64)
+        counts = self.counts()[eids]
+        starts = self.offsets[eids] - (np.cumsum(counts) - counts)
+        return np.arange(counts.sum()) + np.repeat(starts, counts)
+
+    def counts(self):
+        """
+        Number of samples on every edge
+        """
+        return np.diff(self.offsets)
+
+    def means(self):
+        """
+        Mean travel time on every edge
+        """
+        counts = self.counts()
+        sums = np.bincount(self.edge_ids, weights=self.times, minlength=len(self.edges))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums/counts
@@ -4,8 +4,12 @@ Author: Pranay Thangeda
 Email: contact@prny.me
 """
 
-import uuid
-import dataprocessing as dp
+import heapq
+import numpy as np
+from scipy.special import erf
+from collections import namedtuple
+import modelingtools as mt
+import reliability as rl
 
 
 # Route class
@@ -20,17 +24,55 @@ class Route:
         self.node_terminal = nodelist[-1]
         self.transferstops = None
         self.meantimes = None
+        self.cummean = None
+        self.cumcov = None
+        self.positions = dict()
+        for position, node in enumerate(nodelist):
+            self.positions.setdefault(node, []).append(position)
 
 
     def load_meantimes(self, model):
         """
         Load the expected value of travel times on all the edges in the
-        route
+        route, with prefix sums of the means and of the covariance matrix of
+        the edges for the travel time between any two positions
         """
-        meantimes = []
-        for pair in zip(self.nodes[:-1], self.nodes[1:]):
-            meantimes.append(model.mean[(pair[0],pair[1])])
-        self.meantimes = meantimes
+        self.meantimes = model.calc_routemean(self)
+        if self.name in model.routes:
+            cov = model.route_covmatrix(self.name)
+        else:
+            cov = model.calc_pathcov(self.nodes)
+        self.cummean = np.concatenate(([0], np.cumsum(self.meantimes)))
+        self.cumcov = np.zeros((len(self.nodes), len(self.nodes)))
+        self.cumcov[1:, 1:] = cov.cumsum(0).cumsum(1)
+
+
+    def position(self, node, after=-1):
+        """
+        First position of node in the route after position after, None if
+        the route does not serve node after it
+        """
+        for position in self.positions.get(node, ()):
+            if position > after:
+                return position
+        return None
+
+
+    def remaining_mean(self, start, end):
+        """
+        Expected travel time from position start to position end, after
+        load_meantimes
+        """
+        return self.cummean[end] - self.cummean[start]
+
+
+    def remaining_var(self, start, end):
+        """
+        Variance of the travel time from position start to position end,
+        after load_meantimes
+        """
+        S = self.cumcov
+        return S[end, end] - S[start, end] - S[end, start] + S[start, start]
 
 
     def load_nodelocations(self, G):
@@ -42,23 +84,15 @@ class Route:
             loclist.append((G.node[node]['stop_lat'], G.node[node]['stop_lon']))
         self.nodesloc = tuple(loclist)
 
-    def load_transferstops(self, routes_dict):
+    def load_transferstops(self, routes_dict, index=None):
         """
         Takes a route object and dictionary of all routes as inputs and generates
-        all transfer states of the route
+        all transfer states of the route. Pass the modelingtools.TransferIndex
+        of routes_dict as index when loading many routes to build it once.
         """
-        transferstops = set()
-        nodelist1 = self.nodes
-        for routename, nodelist2 in routes_dict.items():
-            if routename != self.name:
-                commonnodes = set(nodelist1).intersection(nodelist2)
-                indices_common = sorted([nodelist1.index(x) for x in commonnodes])
-                indices_transferstops = []
-                if len(indices_common) != 0:
-                    indices_transferstops = [x  for x, y in zip(indices_common[:-1], indices_common[1:]) if x + 1 < y]
-                    indices_transferstops.append(indices_common[-1])
-                    transferstops.update([nodelist1[x] for x in indices_transferstops])
-        self.transferstops = tuple(transferstops)
+        if index is None:
+            index = mt.TransferIndex(routes_dict)
+        self.transferstops = index.transferstops(self.name, self.nodes)
 
 
     def initialize(self, route_dict):
@@ -71,9 +105,12 @@ class Trip:
     def __init__(self, start_time, route):
         self.start_time = start_time
         self.route = route
-        self.history = None
+        self.name = '{} {}'.format(route.name, start_time)
+        self.history = dict() # observed travel time on every edge traversed
         self.lastnode = self.route.node_initial
         self.elapsedtime = 0
+        self.position = 0 # index of lastnode in the route
+        self.lasttime = start_time # time of arrival at lastnode
 
 # Traveler class
 class Trav:
@@ -85,193 +122,422 @@ class Trav:
         self.t_budget = time_budget
         self.alpha = alpha
         self.node_current = self.node_origin
-
-# Extract service day details for running simulation
-
-
-
-def simulate(t_begin, t_end, t_step, travelers_list, routes_list):
-"""
-Function that simulates the trip routing and optimal planning in the transit network
-"""
-    t = t_begin
-
-    while t <= t_end:
-
-       # Calculate the least expected time from a given node to dest
-    def optimal_choice(G, traveler, routes_list, alpha, t_budget):
-        """Finds the optimal path from start node to
-        end node based on the both the objectives
+        self.trip = None # trip the traveler is riding
+        self.route = [] # (node, next node, travel time, trip name) of every edge traveled
+        self.t_arrival = None
+
+
+def sample_edgetime(G, trip, rng=np.random):
+    """
+    Sample the travel time of a trip on the edge after its last node from
+    the travel time samples of the edge. Returns the time and the next node.
+    """
+    try:
+        next_node = trip.route.nodes[trip.position+1]
+    except IndexError:
+        raise Exception('There is no next node. Check sample_edgetime')
+
+    traveltimes = G.graph['samples'].edge_times(trip.lastnode, next_node)
+    return int(traveltimes[rng.randint(len(traveltimes))]), next_node
+
+
+def sample_routetimes(G, route, size, rng=np.random, model=None):
+    """
+    Sample travel times on every edge of a route for size trips at once by
+    inverse transform of the empirical distribution of the edge samples,
+    from the CDF table of the model when given. Returns an array of shape
+    size + (edges,).
+    """
+    size = (size,) if np.isscalar(size) else tuple(size)
+    if model is not None:
+        positions = (model.routes[route.name] if route.name in model.routes
+                     else model.path_positions(route.nodes))
+        u = np.empty(size + (len(positions),))
+        for k in range(len(positions)):
+            u[..., k] = rng.random_sample(size)
+        return model.dist.inverse(positions, u)
+    store = G.graph['samples']
+    traveltimes = np.empty(size + (len(route.nodes)-1,), dtype=np.int64)
+    for k, pair in enumerate(zip(route.nodes[:-1], route.nodes[1:])):
+        samples = np.sort(store.edge_times(pair[0], pair[1]))
+        # Samples have equal weights, the inverse of the empirical CDF at u
+        # is the sample of rank floor(u*n)
+        ranks = (rng.random_sample(size)*len(samples)).astype(np.int64)
+        traveltimes[..., k] = samples[np.minimum(ranks, len(samples)-1)]
+    return traveltimes
+
+
+def sample_routetimes_normal(model, route, size, rng=np.random):
+    """
+    Sample travel times on every edge of a route for size trips at once
+    jointly from the mean and covariance of the route in the model.
+    Returns an array of shape size + (edges,).
+    """
+    return model.sample_route(route.name, size, rng)
+
+
+def _dest_after(route, destinations):
+    """
+    Position of the first destination node after every position of a route
+    """
+    dest_after = [None]*len(route.nodes)
+    next_dest = None
+    for position in range(len(route.nodes)-1, -1, -1):
+        dest_after[position] = next_dest
+        if route.nodes[position] in destinations:
+            next_dest = position
+    return dest_after
+
+
+def optimal_choice(options, now, alpha):
+    """
+    Choose among (trip, expected arrival, on-time probability) options at a
+    stop the one minimizing alpha times the expected travel time normalized
+    by the largest one, minus 1 - alpha times the probability of arriving
+    before the deadline
+    """
+    max_let = max(arrival - now for _, arrival, _ in options) or 1
+    best, best_cost = None, None
+    for trip, arrival, reli in options:
+        cost = alpha*(arrival - now)/max_let - (1 - alpha)*reli
+        if best_cost is None or cost < best_cost:
+            best, best_cost = trip, cost
+    return best
+
+
+def simulate(G, model, routes_list, traveler, t_begin, t_end, seed=None, engine=None):
+    """
+    Discrete event simulation of the trips of all the routes started in
+    [t_begin, t_end] and of the traveler using them. Bus arrival events
+    are kept in a priority queue, the travel times of the trips of a route
+    on all its edges are sampled at once with sample_routetimes. The traveler
+    decides at the origin and at transfer stops, when a trip whose route
+    reaches the destination arrives, between boarding or staying on it and
+    waiting for another trip yet to arrive. On-time probabilities come from
+    engine, a reliability.ReliabilityEngine of the model by default. Returns
+    the route records of the traveler and the simulated trips.
+    """
+    rng = np.random.RandomState(seed)
+    destinations = set(traveler.node_dest)
+    if engine is None:
+        engine = rl.ReliabilityEngine(model)
+    stats = {route.name: engine.route(route) for route in routes_list}
+    dest_after = {route.name: _dest_after(route, destinations) for route in routes_list}
+    deadline = traveler.t_start + traveler.t_budget
+
+    # Trips of every route in order of start, routes serving every node
+    trips = dict()
+    for route in routes_list:
+        trips[route.name] = [Trip(start_time, route) for start_time in sorted(route.list_starttimes)
+                             if t_begin <= start_time <= t_end]
+    traveltimes = dict()
+    for route in routes_list:
+        route_times = sample_routetimes(G, route, len(trips[route.name]), rng, model).tolist()
+        traveltimes.update(zip(trips[route.name], route_times))
+    routes_at = dict()
+    for route in routes_list:
+        for node in set(route.nodes):
+            routes_at.setdefault(node, []).append(route)
+    next_start = {name: 0 for name in trips}
+    active = {name: dict() for name in trips} # started trips, in order of start
+
+    # The traveler reaches the origin before trips arriving at the same time
+    events = [(traveler.t_start, 0, None)]
+    count = 1
+    for route_trips in trips.values():
+        for trip in route_trips:
+            heapq.heappush(events, (trip.start_time, count, trip))
+            count += 1
+
+    def options_at(node, now, arriving):
         """
-
-        # LET Cost
-        costs = dict()
-        for trip in trip_yta:
-            index = trip['route'].index(trip['current_node'])
-            nodelist = trip['route'][index:]
-
-            cost = 0
-            path = list(zip(nodelist[:-1], nodelist[1:]))
-            for pair in path:
-                dist = G[pair[0]][pair[1]][0]['traveltime']
-                for option in dist:
-                    cost += option[0]*option[1]
-
-            costs.update({trip['name']: {'let': cost}})
-
-        # Reliability - Prob of ontime arrival
-        for trip in trip_yta:
-
-            # identify trip location
-            for i in range(len(time_values)-1):
-                if time_budget < time_values[0]:
-                    reli = 0
-                elif time_budget > time_values[3]:
-                     print('Time budget high. All paths are highly reliable')
-                     reli = 1
+        Expected arrival at the destination and on-time probability of the
+        trips that can take the traveler there from node: the arriving trip
+        and the trips yet to arrive at node
+        """
+        options = []
+        for route in routes_at.get(node, ()):
+            route_stats = stats[route.name]
+            candidates = list(active[route.name])
+            if next_start[route.name] < len(trips[route.name]):
+                candidates.append(trips[route.name][next_start[route.name]])
+            for trip in candidates:
+                if trip is arriving:
+                    position = trip.position
                 else:
-                    if time_values[i] <= time_budget < time_values[i+1]:
-                        index = i
-                        break
-
-            # Store data
-            costs[trip['name']]['reli'] = reli
-
-        # Balance reliability and least expected travel time
-        max_let = 0
-        for route in routes_list:
-            if costs[route]['let'] > max_let:
-                max_let = costs[route]['let']
-
-        for trip in active_trips:
-           combined_cost = alpha*costs[trip]['let']/max_let - (1 - alpha)*costs[trip]['reli'])
-           costs[trip]['total_cost']  = combined_cost
-
-        # Selecting trip with max total_cost
-        key_max = max(costs.keys(), key=(lambda k: costs[k]['total_cost']))
-        for trips in trip_yta:
-            if trip['name'] == key_max:
-                out_trip = trip
-
-        return out_trip
-
-    # Sample edge travel time from the given ditribution
-    def sample_edgetime(G, trip):
-        current_node = trip['current_node']
-
-        try:
-            next_node = trip['route'][trip['route'].index(current_node)+1]
-        except IndexError:
-            raise Exception('There is no next node. Check sample_edgetime')
-
-        traveltime_dist = G[current_node][next_node][0]['traveltime']
-
-        # random selection
-        flip = random.random()
-        prob = 0
-        for pair in traveltime_dist:
-            prob += pair[1]
-            if flip <= prob:
-                tt_sample = pair[0]
-                break
-
-        return (tt_sample, next_node)
-
-    # Initialize for trip route simulation
-    agent_route = []
-    agent_cnode = start
-    agent_pnode = start
-    sim_time = 0
-    run_status = True
-
-    while True:
-
-        # ------------- tripes running simulation segment -------------------
-
-        for trip in active_trips:
-
-            # First time step travel time
-            if sim_time == 0:
-                (time_nextedge, next_node) = sample_edgetime(G, trip)
-                trip['next_node'] = next_node
-                trip['arrival_time'].update({next_node: trip['arrival_time'][trip['current_node']] + time_nextedge})
-
-            # loop for every time step till all tripes reach dest
-            if trip['arrival_time'][trip['next_node']] == sim_time:
-
-                # Update time on previous edge and current node
-                G[trip['current_node']][trip['next_node']][0]['traveltime'] = [(trip['arrival_time'][trip['next_node']] - trip['arrival_time'][trip['current_node']], 1)]
-                trip['current_node'] = trip['next_node']
-
-                # Sample time for edge next_node -> node after that, if exists
-                if trip['current_node'] != dest:
-                    (time_nextedge, nextnext_node) = sample_edgetime(G, trip)
-
-                    # Update next node
-                    trip['next_node'] = nextnext_node
-                    trip['arrival_time'].update({trip['next_node']: trip['arrival_time'][trip['current_node']] + time_nextedge})
-
-        # Break condition
-        for trip in trips_list:
-            if trip['current_node']:
-                print('All tripes reached the destination.')
-                break
-
-        # ------------ Agent Decision Making and Routing Segment -------------
-
-        # Decision step - new decision if start or exchange node
-        if G.node[agent_cnode]['code'] in {3, 4}:
-
-            # Possible options at current exchange point
-            trip_yta = []  # list of tripes yta at agent_cnode
-            for trip in [red, blue]:
-                if agent_cnode in trip['route']:
-                    if trip['route'].index(trip['current_node']) <= trip['route'].index(agent_cnode):
-                        trip_yta.append(trip)
-
-            # If all other tripes already left
-            if len(trip_yta) == 1:
-                agent_trip = trip_yta[0]
-
-            # If more than one possible tripes
-            else:
-                agent_trip = optimal_choice(G, trip_yta, agent_cnode,
-                                          agent_route, alpha, time_budget)
-
-                if agent_cnode not in agent_trip['route']:
-                    raise Exception('Optimal route does not go through current node of agent. Check optimal_choice again.')
-
-            if agent_trip['current_node'] == agent_cnode:
-                # Storing route data once action is taken
-                agent_pnode = agent_cnode
-                agent_cnode = agent_trip['next_node']
-                agent_route.append((agent_pnode, agent_cnode, agent_trip['arrival_time'][agent_trip['next_node']] - agent_trip['arrival_time'][agent_trip['current_node']], agent_trip['name']))
-
-        # If destination reached
-        elif G.node[agent_cnode]['code'] == 2:
-            if run_status:
-                print('Agent reached destination.')
-                run_status = False
-
-        # Non exchange points - Following predecided optimal routes
+                    after = trip.position if trip in active[route.name] else -1
+                    position = route_stats.position(node, after)
+                    if position is None:
+                        continue
+                dest = dest_after[route.name][position]
+                if dest is None:
+                    continue
+                # A late trip reaches node no earlier than now
+                start, t_start = trip.position, trip.lasttime
+                if t_start + route_stats.mean(start, dest) < now + route_stats.mean(position, dest):
+                    start, t_start = position, now
+                arrival = t_start + route_stats.mean(start, dest)
+                reli = engine.probability(route, start, dest, deadline - t_start)
+                options.append((trip, arrival, reli))
+        return options
+
+    def decide(node, now, trip):
+        """
+        Traveler at node when trip arrives, returns whether to ride trip
+        """
+        options = options_at(node, now, trip)
+        if not any(option[0] is trip for option in options):
+            return False
+        return optimal_choice(options, now, traveler.alpha) is trip
+
+    stops = set() # stops the traveler is waiting at
+    while events:
+        now, _, trip = heapq.heappop(events)
+
+        # Traveler arrives at the origin
+        if trip is None:
+            stops = set(traveler.node_origin)
+            continue
+
+        route = trip.route
+        if trip not in active[route.name]:
+            # Trip starts at its first node
+            active[route.name][trip] = None
+            next_start[route.name] += 1
         else:
-
-            # Route and time saving step
-            if agent_trip['current_node'] == agent_cnode:
-
-                # Store data then update current and next states
-                agent_pnode = agent_cnode
-                agent_cnode = agent_trip['next_node']
-                agent_route.append((agent_pnode, agent_cnode, agent_trip['arrival_time'][agent_trip['next_node']] - agent_trip['arrival_time'][agent_trip['current_node']], agent_trip['name']))
-
-        # Update while loop simualtion time
-        sim_time += 1
-
-    return G, red, blue, agent_route
-
-    t += t_step
-
-
-
-
-
+            # Trip arrives at its next node
+            previous = trip.lastnode
+            traveltime = now - trip.lasttime
+            trip.position += 1
+            trip.lastnode = route.nodes[trip.position]
+            trip.history[(previous, trip.lastnode)] = traveltime
+            trip.elapsedtime = now - trip.start_time
+            trip.lasttime = now
+            if traveler.trip is trip:
+                traveler.route.append((previous, trip.lastnode, traveltime, trip.name))
+        node = trip.lastnode
+
+        # Traveler decisions at the origin, transfer stops and destination
+        if traveler.trip is trip:
+            traveler.node_current = node
+            if node in destinations:
+                traveler.trip = None
+                traveler.t_arrival = now
+            elif route.transferstops and node in route.transferstops and not decide(node, now, trip):
+                traveler.trip = None
+                stops = {node}
+        elif node in stops and decide(node, now, trip):
+            traveler.trip = trip
+            traveler.node_current = node
+            stops = set()
+
+        # Schedule the arrival at the next node
+        if trip.position + 1 < len(route.nodes):
+            heapq.heappush(events, (now + traveltimes[trip][trip.position], count, trip))
+            count += 1
+        else:
+            del active[route.name][trip]
+
+    return traveler.route, trips
+
+
+# Traveler outcomes of Monte Carlo replications, trip indexes trip_names
+BatchOutcome = namedtuple('BatchOutcome', ['arrival', 'trip', 'trip_names', 'on_time'])
+
+
+def _batch_candidates(G, model, routes_list, traveler, t_begin, t_end, horizon):
+    """
+    Trips of every route that can reach an origin stop within horizon
+    seconds of the traveler start, with the next trip of the route. Returns
+    the routes with the start times of their trips, and for every (trip,
+    stop) candidate its route, trip, stop, position at the stop and at the
+    next destination and the route statistics.
+    """
+    destinations = set(traveler.node_dest)
+    store = G.graph['samples']
+    engine = rl.ReliabilityEngine(model)
+    routes, candidates = [], []
+    for route in routes_list:
+        route_stats = engine.route(route)
+        dest_after = _dest_after(route, destinations)
+        stops = [(node, route_stats.position(node, -1)) for node in traveler.node_origin]
+        stops = [(node, position) for node, position in stops
+                 if position is not None and dest_after[position] is not None]
+        if not stops:
+            continue
+
+        pairs = list(zip(route.nodes[:-1], route.nodes[1:]))
+        lo = np.concatenate(([0], np.cumsum([store.edge_times(u, v).min() for u, v in pairs])))
+        hi = np.concatenate(([0], np.cumsum([store.edge_times(u, v).max() for u, v in pairs])))
+        starts = np.array(sorted(start_time for start_time in route.list_starttimes
+                                 if t_begin <= start_time <= t_end), dtype=float)
+        keep = np.zeros(len(starts), dtype=bool)
+        for node, position in stops:
+            keep |= ((starts + hi[position] >= traveler.t_start)
+                     & (starts + lo[position] <= traveler.t_start + horizon))
+        if not keep.any():
+            continue
+        # The next trip of the route is the first trip yet to start in simulate
+        last = np.flatnonzero(keep)[-1]
+        keep[last+1:last+2] = True
+
+        for i in range(keep.sum()):
+            for node, position in stops:
+                candidates.append((len(routes), i, node, position, dest_after[position],
+                                   route_stats))
+        routes.append((route, starts[keep]))
+    return routes, candidates
+
+
+def _batch_decisions(trip_arrivals, candidates, cand_trip, traveler, deadline):
+    """
+    Apply the decision rule of simulate in all the replications of a chunk
+    at once. trip_arrivals holds the arrival times of every trip at every
+    node of its route, replications x trips x nodes. Each round handles the
+    next arrival at a stop of every replication still waiting. Returns the
+    candidate taken in every replication, -1 if none.
+    """
+    num_reps = trip_arrivals.shape[0]
+    K = len(candidates)
+    reps = np.arange(num_reps)
+    positions = np.array([c[3] for c in candidates])
+    dests = np.array([c[4] for c in candidates])
+    cand_route = np.array([c[0] for c in candidates])
+    cand_node = np.unique([c[2] for c in candidates], return_inverse=True)[1]
+    cand_start = trip_arrivals[0, cand_trip, 0]
+    route_bounds = np.flatnonzero(np.append(True, np.diff(cand_route) != 0))
+
+    # Remaining mean and variance to the destination from every position
+    num_nodes = trip_arrivals.shape[2]
+    mean_rest = np.zeros((K, num_nodes))
+    var_rest = np.zeros((K, num_nodes))
+    for j, (_, _, _, position, dest, route_stats) in enumerate(candidates):
+        q = np.arange(dest+1)
+        mean_rest[j, :dest+1] = route_stats.cummean[dest] - route_stats.cummean[q]
+        S = route_stats.cumcov
+        var_rest[j, :dest+1] = S[dest, dest] - S[q, dest] - S[dest, q] + S[q, q]
+    mean_stop = mean_rest[np.arange(K), positions]
+
+    at_stop = trip_arrivals[:, cand_trip, positions]
+    event_times = np.where(at_stop >= traveler.t_start, at_stop, np.inf)
+    # Arrivals at the same time in the order of the event queue of simulate,
+    # by the earlier arrivals of their trips and then by trip
+    order = np.tile(np.arange(K), (num_reps, 1))
+    for d in range(positions.max(), -1, -1):
+        if d > 0:
+            keys = np.where(positions >= d, trip_arrivals[:, cand_trip, np.maximum(positions - d, 0)], -np.inf)
+        else:
+            keys = event_times
+        keys = np.take_along_axis(keys, order, axis=1)
+        order = np.take_along_axis(order, np.argsort(keys, axis=1, kind='stable'), axis=1)
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(K)[None, :], axis=1)
+    taken = np.full(num_reps, -1)
+
+    for r in range(K):
+        k = order[:, r]
+        now = event_times[reps, k]
+        deciding = (taken < 0) & np.isfinite(now)
+        if not deciding.any():
+            break
+        rows, k, now = reps[deciding], k[deciding], now[deciding]
+
+        # Options at the stop: the arriving trip, trips of the routes yet to
+        # arrive that started and the first trip yet to start of each route.
+        # Trips arriving at the same time later in the queue are yet to arrive.
+        started = cand_start[None, :] <= now[:, None]
+        next_start = np.minimum.reduceat(np.where(started, np.inf, cand_start[None, :]),
+                                         route_bounds, axis=1)
+        first_unstarted = ~started & (cand_start[None, :] == next_start[:, cand_route])
+        arriving = np.arange(K)[None, :] == k[:, None]
+        valid = ((cand_node[None, :] == cand_node[k][:, None])
+                 & (arriving | ((rank[rows] > r) & (at_stop[rows] >= now[:, None])
+                                & (started | first_unstarted))))
+
+        # Expected arrival and variance of the options from their progress at now
+        cols = np.flatnonzero(valid.any(axis=0))
+        valid = valid[:, cols]
+        pr, pc = np.nonzero(valid)
+        pj = cols[pc]
+        arrivals = trip_arrivals[rows[pr], cand_trip[pj]]
+        reached = np.where(pj == k[pr], positions[pj], (arrivals < now[pr, None]).sum(axis=1) - 1)
+        reached = np.maximum(reached, 0)
+        last = arrivals[np.arange(len(pr)), reached]
+        # A late trip reaches the stop no earlier than now, from the stop on
+        late = last + mean_rest[pj, reached] < now[pr] + mean_stop[pj]
+        start = np.where(late, positions[pj], reached)
+        t_start = np.where(late, now[pr], last)
+        expected = np.full(valid.shape, np.inf)
+        rest = np.zeros(valid.shape)
+        slack = np.zeros(valid.shape)
+        var = np.zeros(valid.shape)
+        rest[pr, pc] = mean_rest[pj, start]
+        expected[pr, pc] = t_start + rest[pr, pc]
+        slack[pr, pc] = deadline - t_start
+        var[pr, pc] = var_rest[pj, start]
+
+        let = np.where(valid, expected - now[:, None], -np.inf)
+        max_let = let.max(axis=1)
+        max_let[max_let == 0] = 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Same arithmetic as the normal method of the reliability engine
+            reli = np.where(var > 0, 0.5*(1 + erf((slack - rest)/np.sqrt(2*var))),
+                            (rest <= slack).astype(float))
+            cost = np.where(valid, traveler.alpha*(expected - now[:, None])/max_let[:, None]
+                            - (1 - traveler.alpha)*reli, np.inf)
+        board = cols[np.argmin(cost, axis=1)] == k
+        taken[rows[board]] = k[board]
+
+    return taken
+
+
+def simulate_batch(G, model, routes_list, traveler, t_begin, t_end, num_reps, seed=None,
+                   sampler='empirical', horizon=3600, chunk_size=1000):
+    """
+    Monte Carlo simulation of num_reps independent realizations of the
+    service day for the traveler. Travel times of all the trips that can
+    reach an origin stop within horizon seconds of the traveler start are
+    drawn for chunk_size replications at once, independently on every
+    edge from its samples (sampler='empirical') or jointly on the edges of
+    a route from the mean and covariance of the model (sampler='normal'). The
+    traveler takes a trip reaching the destination with the rule of
+    simulate at the origin, transfers are not considered. Returns the
+    arrival time (nan if no trip was taken), the trip taken (-1 if none)
+    and whether the arrival is within the budget, per replication.
+    """
+    rng = np.random.RandomState(seed)
+    deadline = traveler.t_start + traveler.t_budget
+    routes, candidates = _batch_candidates(G, model, routes_list, traveler, t_begin, t_end, horizon)
+
+    trip_names = ['{} {}'.format(routes[r][0].name, int(routes[r][1][i])) for r, i, *_ in candidates]
+    arrival = np.full(num_reps, np.nan)
+    trip = np.full(num_reps, -1)
+    if not candidates:
+        return BatchOutcome(arrival, trip, trip_names, np.zeros(num_reps, dtype=bool))
+
+    # Trips of all the routes in one array, padded to the longest route
+    trip_offsets = np.cumsum([0] + [len(starts) for _, starts in routes])
+    cand_trip = np.array([trip_offsets[r] + i for r, i, *_ in candidates])
+    dests = np.array([c[4] for c in candidates])
+    num_nodes = max(len(route.nodes) for route, _ in routes)
+
+    for start in range(0, num_reps, chunk_size):
+        size = min(chunk_size, num_reps - start)
+        trip_arrivals = np.full((size, trip_offsets[-1], num_nodes), np.inf)
+        for r, (route, starts) in enumerate(routes):
+            if sampler == 'normal':
+                traveltimes = sample_routetimes_normal(model, route, (size, len(starts)), rng)
+            else:
+                traveltimes = sample_routetimes(G, route, (size, len(starts)), rng, model)
+            trip_arrivals[:, trip_offsets[r]:trip_offsets[r+1], 0] = starts
+            trip_arrivals[:, trip_offsets[r]:trip_offsets[r+1], 1:len(route.nodes)] = (
+                starts[:, None] + np.cumsum(traveltimes, axis=2))
+
+        taken = _batch_decisions(trip_arrivals, candidates, cand_trip, traveler, deadline)
+        chunk = np.arange(start, start+size)
+        boarded = taken >= 0
+        trip[chunk[boarded]] = taken[boarded]
+        arrival[chunk[boarded]] = trip_arrivals[boarded, cand_trip[taken[boarded]],
+                                                dests[taken[boarded]]]
+
+    return BatchOutcome(arrival, trip, trip_names, arrival - traveler.t_start <= traveler.t_budget)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Interning of the stops of the transit graph as dense integer
+codes. Graphs, samples, models and routes are keyed by the codes and the
+node names are only resolved when reading inputs and writing outputs.
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+
+class StopIndex:
+    """
+    Dense integer codes of the nodes of the transit graph, in order of
+    first appearance. names holds the node name of every code, lat and lon
+    its coordinates. stop_nodes holds the code of every stop of the feed
+    the index was built from, stops with the same node name share a code.
+    """
+
+    def __init__(self, names, lat=None, lon=None, stop_nodes=None):
+        self.names = pd.Index(np.asarray(names, dtype=object))
+        if not self.names.is_unique:
+            raise Exception('Repeated node names in the stop index.')
+        self.lat = np.full(len(self.names), np.nan) if lat is None else np.asarray(lat, dtype=float)
+        self.lon = np.full(len(self.names), np.nan) if lon is None else np.asarray(lon, dtype=float)
+        self.stop_nodes = stop_nodes
+        self._codes = {name: code for code, name in enumerate(self.names.tolist())}
+
+    @classmethod
+    def from_feed(cls, feed, diagnostics=None):
+        """
+        Index of the nodes of the stops of a gtfs.Feed, named as
+        stop_name,last character of stop_id. Coordinates of a node come from
+        its first stop, stops repeating a node with other coordinates are
+        counted in self.repeated and recorded in diagnostics when given,
+        with a warning otherwise.
+        """
+        node_names = feed.node_names()
+        codes, names = pd.factorize(node_names)
+        first = np.unique(codes, return_index=True)[1]
+        lat = feed.stops.stop_lat.to_numpy(dtype=float)
+        lon = feed.stops.stop_lon.to_numpy(dtype=float)
+        index = cls(names, lat[first], lon[first], codes.astype(np.int32))
+        repeated = np.flatnonzero((lat != lat[first][codes]) | (lon != lon[first][codes]))
+        index.repeated = len(repeated)
+        if diagnostics is not None:
+            rows = repeated[:diagnostics.max_examples]
+            diagnostics.record('repeated_stops', len(repeated), pd.DataFrame({
+                'stop_id': feed.stop_ids[feed.stops.stop_id.to_numpy()[rows]], 'node': node_names[rows],
+                'stop_lat': lat[rows], 'stop_lon': lon[rows],
+                'node_lat': lat[first][codes[rows]], 'node_lon': lon[first][codes[rows]]}))
+        elif index.repeated:
+            warnings.warn('{} stops repeating in stops.txt with different data, '
+                          'check stops.txt file again.'.format(index.repeated))
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._codes
+
+    def code(self, name):
+        """
+        Code of a node name
+        """
+        try:
+            return self._codes[name]
+        except KeyError:
+            raise Exception('Stop {} is not in the stop index.'.format(name))
+
+    def get(self, name, default=None):
+        return self._codes.get(name, default)
+
+    def codes(self, names):
+        """
+        Codes of an array of node names, -1 for unknown names
+        """
+        return self.names.get_indexer(np.asarray(names, dtype=object)).astype(np.int32)
+
+    def intern(self, names):
+        """
+        Tuple of the codes of a series of node names
+        """
+        return tuple(self.code(name) for name in names)
+
+    def name(self, code):
+        """
+        Node name of a code
+        """
+        return self.names[code]
+
+    def resolve(self, codes):
+        """
+        List of the node names of a series of codes
+        """
+        return self.names[np.asarray(codes, dtype=np.int64)].tolist()
+
+    def intern_routes(self, routes_dict):
+        """
+        Routes of node names as routes of codes
+        """
+        return {route_name: self.intern(route_nodes) for route_name, route_nodes in routes_dict.items()}
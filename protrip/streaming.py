@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+Author: Pranay Thangeda
+Email: contact@prny.me
+Description: Streaming ingestion of schedule adherence rows from a live AVL
+feed, a tailed file or a replay of the CUMTD datasheets. Trips are assembled
+from rows arriving in any order and their stop pair samples are added to the
+graph and the travel time model as soon as a trip is complete.
+"""
+
+import csv
+import time
+import socket
+import bisect
+import warnings
+from collections import OrderedDict, namedtuple
+from samplestore import SampleStore, MISSING
+from diagnostics import Diagnostics
+import dataprocessing as dp
+
+
+# Stop pair samples of an assembled trip, partial trips have gaps in rows
+AssembledTrip = namedtuple('AssembledTrip', ['source', 'shape', 'pairs', 'partial'])
+
+# Fields of a sheet row used to build samples, in the order of dp._SHEET_COLUMNS
+SheetRow = namedtuple('SheetRow', ['type', 'stop', 'dep', 'distance', 'graphic'])
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _to_sec(value):
+    try:
+        return dp._get_sec(value)
+    except (AttributeError, ValueError):
+        return float('nan')
+
+
+def _pairs(rows):
+    """
+    Consecutive stop pair samples (node1, node2, time, distance, depart) of
+    the rows of a trip given as (seq, row) sorted by seq. Rows are paired only within
+    runs of consecutive sequence numbers.
+    """
+    pairs = []
+    previous, previous_seq = None, None
+    for seq, row in rows:
+        if previous_seq is None or seq != previous_seq + 1:
+            previous = None
+        previous_seq = seq
+        if row.type in dp._SKIP_TYPES:
+            continue
+        if row.type not in dp._NODE_TYPES:
+            previous = None
+            continue
+        current = (row.stop, _to_sec(row.dep), _to_float(row.distance)*dp.MILES_TO_METERS)
+        if previous is not None:
+            pairs.append((previous[0], current[0], current[1] - previous[1],
+                          current[2] - previous[2], previous[1]))
+        previous = current
+    return pairs
+
+
+class _SourceBuffer:
+    """
+    Rows of a single source waiting for their trip to complete. Headers of
+    emitted trips are kept as the end of a trip before them arriving late.
+    """
+
+    def __init__(self):
+        self.rows = dict()
+        self.headers = []
+        self.emitted = set()
+
+
+class TripAssembler:
+    """
+    Assemble trips from sheet rows of several sources (vehicles or files)
+    identified by their sequence number within the source. A trip spans the
+    rows from its trip header to the next header of the source and is
+    emitted once all of them arrived, whatever their order. Memory is
+    bounded by max_rows buffered rows and trip headers per source and
+    max_sources sources, the oldest rows and the least recently seen sources
+    are evicted first. With partial=True evicted and flushed trips are
+    emitted with the rows available, otherwise their rows are dropped.
+    """
+
+    def __init__(self, max_rows=5000, max_sources=256, partial=False):
+        self.max_rows = max_rows
+        self.max_sources = max_sources
+        self.partial = partial
+        self.sources = OrderedDict()
+        self.dropped_rows = 0
+
+    def push(self, source, seq, row):
+        """
+        Add a row, returns the list of trips completed by it
+        """
+        buffer = self.sources.get(source)
+        if buffer is None:
+            buffer = self.sources[source] = _SourceBuffer()
+        else:
+            self.sources.move_to_end(source)
+
+        buffer.rows[seq] = row
+        trips = []
+        if row.type in dp._TRIP_TYPES:
+            position = bisect.bisect_left(buffer.headers, seq)
+            if position == len(buffer.headers) or buffer.headers[position] != seq:
+                buffer.headers.insert(position, seq)
+            # The new header can close the trip before it and the one after it
+            if position > 0:
+                trips.extend(self._complete(source, buffer, position-1))
+            if position + 1 < len(buffer.headers):
+                trips.extend(self._complete(source, buffer, position))
+        else:
+            position = bisect.bisect_right(buffer.headers, seq)
+            if 0 < position < len(buffer.headers):
+                trips.extend(self._complete(source, buffer, position-1))
+
+        while len(buffer.rows) > self.max_rows:
+            trips.extend(self._evict(source, buffer))
+        while len(buffer.headers) > self.max_rows:
+            buffer.emitted.discard(buffer.headers.pop(0))
+        while len(self.sources) > self.max_sources:
+            old_source, old_buffer = next(iter(self.sources.items()))
+            trips.extend(self._flush_buffer(old_source, old_buffer))
+            del self.sources[old_source]
+        return trips
+
+    def flush(self):
+        """
+        Empty the buffers of all the sources, returns the trips emitted
+        """
+        trips = []
+        for source, buffer in self.sources.items():
+            trips.extend(self._flush_buffer(source, buffer))
+        self.sources.clear()
+        return trips
+
+    def _complete(self, source, buffer, position):
+        """
+        Emit the trip starting at buffer.headers[position] if all its rows arrived
+        """
+        start, end = buffer.headers[position], buffer.headers[position+1]
+        if start in buffer.emitted or any(seq not in buffer.rows for seq in range(start, end)):
+            return []
+        rows = [(seq, buffer.rows.pop(seq)) for seq in range(start, end)]
+        buffer.emitted.add(start)
+        return [AssembledTrip(source, rows[0][1].graphic[9:], _pairs(rows), False)]
+
+    def _evict(self, source, buffer):
+        """
+        Evict the oldest rows of a source, the rows of the trip holding the
+        oldest row or the rows before the first trip header
+        """
+        lowest = min(buffer.rows)
+        position = bisect.bisect_right(buffer.headers, lowest) - 1
+        start = buffer.headers[position] if position >= 0 else lowest
+        end = (buffer.headers[position+1] if position + 1 < len(buffer.headers)
+               else float('inf'))
+        seqs = sorted(seq for seq in buffer.rows if start <= seq < end)
+        rows = [(seq, buffer.rows.pop(seq)) for seq in seqs]
+        if position >= 0 and start not in buffer.emitted:
+            buffer.emitted.add(start)
+            if self.partial:
+                return [AssembledTrip(source, rows[0][1].graphic[9:], _pairs(rows), True)]
+        self.dropped_rows += len(rows)
+        return []
+
+    def _flush_buffer(self, source, buffer):
+        trips = []
+        while buffer.rows:
+            trips.extend(self._evict(source, buffer))
+        return trips
+
+
+class ObservedTrip:
+    """
+    Travel times and departure times observed by a trip on the node pairs
+    it traversed, in the form read by Model.updatemodel
+    """
+
+    def __init__(self, trip_id, shape, day=MISSING):
+        self.id = trip_id
+        self.shape = shape
+        self.day = day
+        self.history = dict()
+        self.departs = dict()
+
+
+class FeedIngestor:
+    """
+    Push the stop pair samples of assembled trips into the SampleStore of G
+    and into a Model. Samples are checked as in dp.extract_data: both stops
+    must be nodes of G, time and distance positive and bounded, and the
+    length within 50 m of the first sample of the edge. An edge is added to
+    G once it has more than min_samples samples, edges of G missing in the
+    model are not updated in it. Stops of the rows are given as their codes
+    when G has a StopIndex in G.graph['stops']. Rejected samples are
+    recorded in self.diagnostics.
+    """
+
+    def __init__(self, G, model=None, min_samples=10, max_rows=5000, max_sources=256,
+                 partial=False):
+        self.G = G
+        self.model = model
+        self.min_samples = min_samples
+        self.assembler = TripAssembler(max_rows, max_sources, partial)
+        if 'samples' not in G.graph:
+            G.graph['samples'] = SampleStore([], [0], [], [], [], [])
+        self.store = G.graph['samples']
+        self.stops = G.graph.get('stops')
+
+        store = self.store
+        self.lengths = [None]*len(store)
+        for u, v, data in G.edges(data=True):
+            if 'eid' in data:
+                self.lengths[data['eid']] = data['length']
+        self.counts = store.counts().tolist()
+        self.last_trip = [0]*len(store)
+        self.count_trips = int(store.trips.max()) if len(store.trips) else 0
+        self.count_rows = 0
+        self.list_tripshapes = set()
+        self.diagnostics = Diagnostics()
+
+    def push(self, source, seq, row):
+        """
+        Ingest a single row, returns the number of trips completed
+        """
+        self.count_rows += 1
+        trips = self.assembler.push(source, seq, row)
+        for trip in trips:
+            self._add_trip(trip)
+        return len(trips)
+
+    def run(self, rows):
+        """
+        Ingest all the (source, seq, row) tuples of an iterable of rows
+        """
+        for source, seq, row in rows:
+            self.push(source, seq, row)
+        return self.count_trips
+
+    def flush(self):
+        """
+        Ingest the trips still in the assembler buffers, only with partial trips
+        """
+        for trip in self.assembler.flush():
+            self._add_trip(trip)
+
+    def _add_trip(self, trip):
+        G, store = self.G, self.store
+        self.count_trips += 1
+        trip_id = self.count_trips
+        self.list_tripshapes.add(trip.shape)
+        shape = store.shape_id(trip.shape)
+        day = dp._sheet_day(trip.source)
+        observed = ObservedTrip(trip_id, trip.shape, day)
+
+        for pair in trip.pairs:
+            node1, node2, time, distance, depart = pair
+            if self.stops is not None:
+                node1, node2 = self.stops.get(node1), self.stops.get(node2)
+            if not (G.has_node(node1) and G.has_node(node2)):
+                self._reject('missing_stops', trip, pair)
+                continue
+            if not time >= 0:
+                self._reject('negative_time' if time == time else 'missing_time', trip, pair)
+                continue
+            if not (distance >= 0 and distance < 2000):
+                self._reject('out_of_bounds', trip, pair)
+                continue
+
+            eid = store.index.get((node1, node2))
+            if eid is None:
+                eid = store.add_edge(node1, node2)
+                self.lengths.append(distance)
+                self.counts.append(0)
+                self.last_trip.append(0)
+            elif self.lengths[eid] is None:
+                self.lengths[eid] = distance
+            elif abs(self.lengths[eid] - distance) > 50:
+                self._reject('length_mismatch', trip, pair)
+                continue
+
+            store.append(eid, trip_id, time, shape, depart, day)
+            observed.history[(node1, node2)] = time
+            observed.departs[(node1, node2)] = depart
+            if self.last_trip[eid] != trip_id:
+                self.last_trip[eid] = trip_id
+                self.counts[eid] += 1
+                if self.counts[eid] == self.min_samples + 1:
+                    u, v = store.edges[eid]
+                    G.add_edge(u, v, eid=eid, length=self.lengths[eid])
+
+        if self.model is not None and observed.history:
+            self.model.updatemodel(observed)
+
+    def _reject(self, condition, trip, pair):
+        node1, node2, time, distance, _ = pair
+        self.diagnostics.record(condition, 1, [{'source': str(trip.source), 'stop1': node1,
+                                                'stop2': node2, 'time': time, 'distance': distance}])
+
+
+def _columns(header):
+    """
+    Positions of the sequence number and the used columns in a sheet header
+    """
+    try:
+        return [0] + [header.index(column) for column in dp._SHEET_COLUMNS]
+    except ValueError:
+        raise Exception('Sheet header is missing columns {}'.format(dp._SHEET_COLUMNS))
+
+
+def _sheetrow(fields, columns):
+    seq = int(fields[columns[0]])
+    return seq, SheetRow(*(fields[i] for i in columns[1:]))
+
+
+def replay(file_paths, rate=None):
+    """
+    Rows of schedule adherence sheets as (source, seq, row), the source of a
+    row is its file. With a rate the rows are paced at rate rows per second.
+    """
+    start = time.perf_counter()
+    count = 0
+    for file_path in file_paths:
+        with open(file_path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            columns = _columns(next(reader))
+            for fields in reader:
+                if not any(fields):
+                    continue
+                seq, row = _sheetrow(fields, columns)
+                if rate:
+                    count += 1
+                    delay = count/rate - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                yield file_path, seq, row
+
+
+def tail(file_path, poll=1.0):
+    """
+    Follow a sheet being written, yields (source, seq, row) of the rows as
+    they are appended to the file
+    """
+    with open(file_path, newline='') as f:
+        columns = None
+        count_lines = 0
+        pending = ''
+        while True:
+            line = f.readline()
+            if not line:
+                time.sleep(poll)
+                continue
+            pending += line
+            if not pending.endswith('\n'):
+                continue
+            fields = next(csv.reader([pending]), [])
+            pending = ''
+            count_lines += 1
+            if count_lines == 2:
+                columns = _columns(fields)
+            elif columns is not None and any(fields):
+                seq, row = _sheetrow(fields, columns)
+                yield file_path, seq, row
+
+
+def socket_rows(host, port, diagnostics=None):
+    """
+    Rows received over a TCP connection as CSV lines, a line holds the
+    source followed by the fields of a sheet row. The first line is the
+    sheet header, without a source. Malformed lines are skipped and
+    recorded in diagnostics when given, with a warning otherwise.
+    """
+    with socket.create_connection((host, port)) as conn:
+        lines = (line.decode('utf-8') for line in conn.makefile('rb'))
+        reader = csv.reader(lines)
+        columns = [i + 1 for i in _columns(next(reader))]
+        for fields in reader:
+            if not any(fields[1:]):
+                continue
+            try:
+                seq, row = _sheetrow(fields, columns)
+            except (ValueError, IndexError):
+                if diagnostics is not None:
+                    diagnostics.record('malformed_rows', 1, [{'fields': fields}])
+                else:
+                    warnings.warn('Malformed row from feed: {}'.format(fields))
+                continue
+            yield fields[0], seq, row
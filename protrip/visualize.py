@@ -85,7 +85,7 @@ def visualize_routes(G):
     lat_data = nx.get_node_attributes(G, 'stop_lat')
     lon_data = nx.get_node_attributes(G, 'stop_lon')
     for node in G.nodes.data():
-        name = str(node[0])
+        name = str(node[1].get('name', node[0]))
         point = [float(node[1]['stop_lat']), float(node[1]['stop_lon'])]
         stops_all[name] = point
 
@@ -100,9 +100,10 @@ def visualize_routes(G):
     edges_list = []
     max_samples = 0
     min_samples = 1e20
+    store = G.graph['samples']
     for n1, n2, data in list(G.edges(data=True)):
         points = [(lat_data[n1], lon_data[n1]),(lat_data[n2], lon_data[n2])]
-        num_samples = len(data['time_data'])
+        num_samples = store.numsamples(n1, n2)
         if num_samples > max_samples:
             max_samples = num_samples
         if num_samples < min_samples:
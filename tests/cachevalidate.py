@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Checks of the ingestion cache of dp.extract_data on sheets of
+the same contents dated on different days of the week. A second cached run
+parses no sheet, editing a sheet parses only that sheet again, and another
+datasheet folder sharing the cache_dir keeps the entries of the first. The
+samples of every cached run, days of the week included, must be those of an
+uncached run.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+from ingestionbenchmark import make_dataset, timed, same_store
+
+
+NUM_FILES = 14
+TRIPS_PER_FILE = 20
+parsed = []
+
+
+def _counting(read_datasheets):
+    """
+    dp._read_datasheets recording the number of sheets parsed in every call
+    """
+    def read(file_paths, nodes):
+        file_paths = list(file_paths)
+        parsed.append(len(file_paths))
+        return read_datasheets(file_paths, nodes)
+    return read
+
+
+def make_dated(root):
+    """
+    Sheets of the same contents named with the dates of two weeks
+    """
+    make_dataset(root, NUM_FILES, TRIPS_PER_FILE)
+    csv_path = os.path.join(root, 'cumtd_datasheets')
+    for i in range(NUM_FILES):
+        os.rename(os.path.join(csv_path, 'Sheet_{}.csv'.format(i)),
+                  os.path.join(csv_path, 'Sheet_1-{}-2019.csv'.format(14 + i)))
+
+
+def edit_sheet(file_path):
+    """
+    Change the departure time of one stop of a sheet
+    """
+    with open(file_path) as f:
+        text = f.read()
+    with open(file_path, 'w') as f:
+        f.write(text.replace(',7:29:42,', ',7:29:52,', 1))
+
+
+def cached_run(root, cache_dir, folder='cumtd_datasheets'):
+    """
+    Graph of a cached run and the number of sheets it parsed
+    """
+    del parsed[:]
+    (G, _), _ = timed(dp.extract_data, root, 'cumtd_gtfs', folder, None, cache_dir)
+    return G, sum(parsed)
+
+
+def same_samples(G1, G2):
+    """
+    Check two graphs hold the same samples, with their departures and days
+    """
+    store1, store2 = G1.graph['samples'], G2.graph['samples']
+    return (same_store(G1, G2) and np.array_equal(store1.days, store2.days)
+            and np.array_equal(store1.departs, store2.departs))
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    dp._read_datasheets = _counting(dp._read_datasheets)
+    root = tempfile.mkdtemp()
+    try:
+        make_dated(root)
+        cache_dir = os.path.join(root, 'cache')
+        csv_path = os.path.join(root, 'cumtd_datasheets')
+        (G_uncached, _), _ = timed(dp.extract_data, root, 'cumtd_gtfs')
+        G_first, parsed_first = cached_run(root, cache_dir)
+        G_second, parsed_second = cached_run(root, cache_dir)
+
+        # Another folder with some of the sheets, one of them edited
+        other_path = os.path.join(root, 'other_datasheets')
+        os.makedirs(other_path)
+        for filename in sorted(os.listdir(csv_path))[:3]:
+            shutil.copy(os.path.join(csv_path, filename), other_path)
+        edit_sheet(os.path.join(other_path, sorted(os.listdir(other_path))[0]))
+        _, parsed_other = cached_run(root, cache_dir, 'other_datasheets')
+        G_shared, parsed_shared = cached_run(root, cache_dir)
+
+        # An edited sheet of the first folder
+        edit_sheet(os.path.join(csv_path, sorted(os.listdir(csv_path))[5]))
+        (G_edited_uncached, _), _ = timed(dp.extract_data, root, 'cumtd_gtfs')
+        G_edited, parsed_edited = cached_run(root, cache_dir)
+    finally:
+        shutil.rmtree(root)
+
+    days = G_uncached.graph['samples'].days
+    same_first, same_second = same_samples(G_uncached, G_first), same_samples(G_uncached, G_second)
+    same_shared = same_samples(G_uncached, G_shared)
+    same_edited = same_samples(G_edited_uncached, G_edited) and not same_samples(G_uncached, G_edited)
+    print("Sheets: {}, samples per day of the week: {}".format(
+        NUM_FILES, dict(zip(*(a.tolist() for a in np.unique(days, return_counts=True))))))
+    print("Sheets parsed: first run {}, second run {}".format(parsed_first, parsed_second))
+    print("Sheets parsed: other folder {}, first folder again {}".format(parsed_other, parsed_shared))
+    print("Sheets parsed after editing one: {}".format(parsed_edited))
+    print("Identical to the uncached run: first {}, second {}, after the other folder {}, "
+          "after editing {}".format(same_first, same_second, same_shared, same_edited))
+    assert (parsed_first, parsed_second, parsed_other, parsed_shared, parsed_edited) == (NUM_FILES, 0, 3, 0, 1)
+    assert same_first and same_second and same_shared and same_edited
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of gtfs.ServiceCalendar on the CUMTD calendar, resolving
+the services and trips running on every day of the feed, against filtering
+the calendar and calendar_dates tables with pandas for every date. A weekly
+calendar with removed dates is added to exercise both tables. Services,
+trips and service windows are checked to match.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import shutil
+import datetime
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+import gtfs
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STOPS_PER_TRIP = 20
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def make_feed(root, seed=0):
+    """
+    CUMTD tables with weekly services added to the calendar, returning the
+    calendar tables as strings. The feed has no stop_times.txt, trips get
+    STOPS_PER_TRIP random stop times.
+    """
+    gtfs_path = os.path.join(root, 'gtfs')
+    shutil.copytree(os.path.join(ROOT_PATH, 'cumtd_gtfs'), gtfs_path)
+    calendar = pd.read_csv(os.path.join(gtfs_path, 'calendar.txt'), dtype=str)
+    dates = pd.read_csv(os.path.join(gtfs_path, 'calendar_dates.txt'), dtype=str)
+    weekly = calendar.head(3).copy()
+    weekly[DAYS] = [['1']*5 + ['0']*2, ['0']*5 + ['1']*2, ['1']*7]
+    weekly['service_id'] = ['WEEKDAY EXTRA', 'WEEKEND EXTRA', 'DAILY EXTRA']
+    removed = pd.DataFrame({'service_id': ['WEEKDAY EXTRA', 'DAILY EXTRA', 'DAILY EXTRA'],
+                            'date': ['20190121', '20190121', '20190317'],
+                            'exception_type': ['2', '2', '2']})
+    calendar, dates = pd.concat([calendar, weekly]), pd.concat([dates, removed])
+    trips = pd.read_csv(os.path.join(gtfs_path, 'trips.txt'), dtype=str)
+    extra = trips.head(30).copy()
+    extra['service_id'] = np.repeat(weekly.service_id.values, 10)
+    extra['trip_id'] = extra.trip_id + ' extra'
+    trips = pd.concat([trips, extra])
+    trips.to_csv(os.path.join(gtfs_path, 'trips.txt'), index=False)
+    calendar.to_csv(os.path.join(gtfs_path, 'calendar.txt'), index=False)
+    dates.to_csv(os.path.join(gtfs_path, 'calendar_dates.txt'), index=False)
+
+    rng = np.random.RandomState(seed)
+    stop_ids = pd.read_csv(os.path.join(gtfs_path, 'stops.txt'), dtype=str).stop_id.values
+    starts = rng.randint(5*3600, 26*3600, len(trips))
+    secs = (starts[:, None] + np.cumsum(rng.randint(30, 120, (len(trips), STOPS_PER_TRIP)), axis=1)).ravel()
+    times = ['{}:{:02d}:{:02d}'.format(s//3600, s//60 % 60, s % 60) for s in secs]
+    pd.DataFrame({'trip_id': np.repeat(trips.trip_id.values, STOPS_PER_TRIP),
+                  'arrival_time': times, 'departure_time': times,
+                  'stop_id': stop_ids[rng.randint(len(stop_ids), size=len(times))],
+                  'stop_sequence': np.tile(np.arange(1, STOPS_PER_TRIP + 1), len(trips))}).to_csv(
+        os.path.join(gtfs_path, 'stop_times.txt'), index=False)
+    return calendar, dates, trips, secs
+
+
+def services_naive(calendar, dates, date):
+    """
+    Services running on date from pandas filters of the string tables
+    """
+    key = date.strftime('%Y%m%d')
+    runs = ((calendar.start_date <= key) & (calendar.end_date >= key)
+            & (calendar[DAYS[date.weekday()]] == '1'))
+    services = set(calendar.service_id[runs])
+    today = dates[dates.date == key]
+    services.update(today.service_id[today.exception_type == '1'])
+    services.difference_update(today.service_id[today.exception_type == '2'])
+    return services
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        calendar, dates, df_trips, secs = make_feed(root)
+        feed = gtfs.load_feed(root, 'gtfs', tables=['trips', 'calendar', 'calendar_dates', 'stop_times'])
+        window = dp.service_times(root, 'gtfs', date=20190114)
+    finally:
+        shutil.rmtree(root)
+    first = datetime.date(2018, 12, 20)
+    days = [first + datetime.timedelta(days=i) for i in range(150)]
+
+    t = time.perf_counter()
+    naive = [services_naive(calendar, dates, day) for day in days]
+    t_naive = time.perf_counter() - t
+
+    t = time.perf_counter()
+    service_calendar = gtfs.ServiceCalendar(feed)
+    t_build = time.perf_counter() - t
+
+    t = time.perf_counter()
+    resolved = [set(service_calendar.service_ids(day)) for day in days]
+    t_resolve = time.perf_counter() - t
+
+    t = time.perf_counter()
+    matrix = service_calendar.active_matrix(days)
+    t_matrix = time.perf_counter() - t
+
+    trips = [service_calendar.trips(day) for day in days]
+    naive_trips = [set(df_trips.trip_id[df_trips.service_id.isin(services)]) for services in naive]
+    trips_match = all(set(feed.trip_ids[codes]) == names for codes, names in zip(trips, naive_trips))
+    departures = secs.reshape(len(df_trips), -1)[df_trips.trip_id.isin(naive_trips[25]).values]
+    matrix_match = all(set(feed.service_ids[row]) == services for row, services in zip(matrix, naive))
+    window_match = window == (departures.min(), departures.max())
+
+    print("Services: {}, trips: {}, days covered: {}".format(
+        len(feed.service_ids), len(feed.trip_ids), service_calendar.num_days))
+    print("Pandas filters, {} dates: {:.1f} ms".format(len(days), 1000*t_naive))
+    print("Bitsets built in {:.1f} ms, {} bytes".format(1000*t_build, service_calendar.bits.nbytes))
+    print("Services of every date: {:.1f} ms ({:.0f}x), all dates at once: {:.2f} ms".format(
+        1000*t_resolve, t_naive/t_resolve, 1000*t_matrix))
+    print("Services match: {}, matrix matches: {}".format(resolved == naive, matrix_match))
+    print("Trips per day: min {}, mean {:.0f}, max {}, trips match: {}".format(
+        min(map(len, trips)), np.mean(list(map(len, trips))), max(map(len, trips)), trips_match))
+    print("Service window on {}: {}, matches: {}, of all trips: {}".format(
+        days[25], window, window_match, dp.service_times(None, None, feed)))
+    assert resolved == naive and matrix_match and trips_match and window_match
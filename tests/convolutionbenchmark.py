@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the route travel time distributions of
+reliability.RouteReliability, convolving the edge histograms of the model
+with one batched FFT per end position, against direct convolution of the same
+histograms and against Monte Carlo estimates drawing the edge times from
+the model for every query. On-time probabilities and percentiles are
+checked against both.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import reliability as rl
+import simulation as sim
+from timebinsbenchmark import make_network
+
+
+NUM_QUERIES = 2000
+NUM_DRAWS = 20000
+
+
+def suffix_direct(route_stats, end):
+    """
+    Distributions to end of every start position with direct convolutions
+    """
+    cdfs = [None]*(end+1)
+    lo, pmf = 0, np.ones(1)
+    cdfs[end] = (lo, np.cumsum(pmf))
+    for position in range(end-1, -1, -1):
+        edge_lo, edge_pmf = route_stats.pmfs[position]
+        lo, pmf = lo + edge_lo, np.convolve(edge_pmf, pmf)
+        cdfs[position] = (lo, np.cumsum(pmf))
+    return cdfs
+
+
+def cdf_at(lo, cdf, t):
+    index = int(np.floor(t)) - lo
+    return 0.0 if index < 0 else 1.0 if index >= len(cdf) else cdf[index]
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network()
+    model = dm.Model(G, routes_dict)
+    routes = [sim.Route(name, nodes, []) for name, nodes in routes_dict.items()]
+    engine = rl.ReliabilityEngine(model, method='convolution')
+
+    t = time.perf_counter()
+    stats = [engine.route(route) for route in routes]
+    t_histograms = time.perf_counter() - t
+    t = time.perf_counter()
+    for route, route_stats in zip(routes, stats):
+        route_stats._suffix_cdfs(len(route.nodes) - 1)
+    t_fft = time.perf_counter() - t
+    t = time.perf_counter()
+    direct = {route.name: suffix_direct(engine.route(route), len(route.nodes) - 1) for route in routes}
+    t_direct = time.perf_counter() - t
+
+    # Queries to the last stop of random routes from random stops
+    rng = np.random.RandomState(0)
+    queries = []
+    for _ in range(NUM_QUERIES):
+        route = routes[rng.randint(len(routes))]
+        end = len(route.nodes) - 1
+        start = rng.randint(end)
+        queries.append((route, start, end, engine.route(route).mean(start, end)*rng.uniform(0.9, 1.1)))
+    t = time.perf_counter()
+    on_time = [engine.probability(*query) for query in queries]
+    t_query = (time.perf_counter() - t)/NUM_QUERIES
+    t = time.perf_counter()
+    p95 = [engine.percentile(route, start, end, 0.95) for route, start, end, _ in queries]
+    t_percentile = (time.perf_counter() - t)/NUM_QUERIES
+    error_direct = max(abs(p - cdf_at(*direct[route.name][start], slack))
+                       for p, (route, start, end, slack) in zip(on_time, queries))
+
+    # Monte Carlo estimates for the first queries
+    t = time.perf_counter()
+    errors, percentile_errors = [], []
+    for (route, start, end, slack), p, q in list(zip(queries, on_time, p95))[:20]:
+        times = sim.sample_routetimes(G, route, NUM_DRAWS, rng, model)[:, start:end].sum(axis=1)
+        errors.append(abs((times <= slack).mean() - p))
+        percentile_errors.append(abs(np.quantile(times, 0.95, method='inverted_cdf') - q))
+    t_mc = (time.perf_counter() - t)/20
+
+    print("Routes: {}, edges per route: {}, histogram bins per edge: {:.0f}".format(
+        len(routes), len(routes[0].nodes) - 1, np.mean(model.dist.widths)))
+    print("Edge histograms of all routes: {:.0f} ms".format(1000*t_histograms))
+    print("Suffix distributions of all routes: FFT {:.1f} ms, direct {:.1f} ms".format(
+        1000*t_fft, 1000*t_direct))
+    print("On-time probability: {:.2f} us, 95th percentile: {:.2f} us, Monte Carlo with {} draws: "
+          "{:.1f} ms".format(1e6*t_query, 1e6*t_percentile, NUM_DRAWS, 1000*t_mc))
+    print("Max difference to direct convolution: {:.1e}".format(error_direct))
+    print("Max difference to Monte Carlo: on-time {:.3f} (standard error {:.3f}), "
+          "95th percentile {:.0f} s".format(max(errors), 0.5/np.sqrt(NUM_DRAWS), max(percentile_errors)))
+    assert error_direct < 1e-9 and max(errors) < 4*0.5/np.sqrt(NUM_DRAWS)
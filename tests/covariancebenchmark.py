@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the covariance of datamodeling.Model
+against the original loop over all pairs of route edges, on a synthetic
+network of routes sharing a downtown corridor. Values are checked to match.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+from samplestore import SampleStore
+
+
+NUM_ROUTES = 12
+EDGES_PER_ROUTE = 25
+SHARED_EDGES = 8
+TRIPS_PER_ROUTE = 200
+MISSING_RATE = 0.1
+
+
+def make_network(seed=0, num_routes=NUM_ROUTES, trips_per_route=TRIPS_PER_ROUTE):
+    """
+    Routes through a shared corridor with trips whose edge times share a
+    trip level delay, and a fraction of samples missing
+    """
+    rng = np.random.RandomState(seed)
+    corridor = ['corridor {}'.format(i) for i in range(SHARED_EDGES+1)]
+    routes_dict = dict()
+    for r in range(num_routes):
+        head = ['route {} stop {}'.format(r, i) for i in range(EDGES_PER_ROUTE-SHARED_EDGES)]
+        routes_dict['route {}'.format(r)] = tuple(head + corridor)
+
+    samples = dict()
+    trip = 0
+    for route_nodes in routes_dict.values():
+        for _ in range(trips_per_route):
+            trip += 1
+            delay = rng.normal(0, 10)
+            for pair in zip(route_nodes[:-1], route_nodes[1:]):
+                if rng.rand() > MISSING_RATE:
+                    samples.setdefault(pair, []).append((trip, int(60 + delay + rng.normal(0, 5))))
+
+    G = nx.Graph()
+    edges = list(samples)
+    offsets = np.cumsum([0] + [len(samples[pair]) for pair in edges])
+    trips = [t for pair in edges for t, _ in samples[pair]]
+    times = [x for pair in edges for _, x in samples[pair]]
+    G.add_edges_from((u, v, {'eid': eid}) for eid, (u, v) in enumerate(edges))
+    G.graph['samples'] = SampleStore(edges, offsets, trips, times, np.zeros(len(trips)), ['shape'])
+    return G, routes_dict
+
+
+def _calccov_loop(G, routes_dict):
+    """
+    Original covariance loop over all pairs of route edges
+    """
+    store = G.graph['samples']
+    timedata = {(u, v): store.timedata(u, v) for u, v in G.edges}
+    timedata.update({(v, u): data for (u, v), data in list(timedata.items())})
+    cov = dict()
+    for route_name1, route_nodes1 in routes_dict.items():
+        for pair1 in zip(route_nodes1[:-1], route_nodes1[1:]):
+            for route_name2, route_nodes2 in routes_dict.items():
+                for pair2 in zip(route_nodes2[:-1], route_nodes2[1:]):
+                    dict_edge1 = timedata[pair1]
+                    dict_edge2 = timedata[pair2]
+                    common_trips = dict_edge1.keys() & dict_edge2.keys()
+                    if len(common_trips) in [0, 1]:
+                        cov[(pair1, pair2)] = 0
+                    else:
+                        timedata_edge1 = [dict_edge1.get(key) for key in common_trips]
+                        timedata_edge2 = [dict_edge2.get(key) for key in common_trips]
+                        cov[(pair1, pair2)] = np.cov(timedata_edge1,timedata_edge2)[0][1]
+    return cov
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network()
+
+    t = time.perf_counter()
+    cov_ref = _calccov_loop(G, routes_dict)
+    t_ref = time.perf_counter() - t
+
+    t = time.perf_counter()
+    cov_new = dm.Model(G, routes_dict).cov
+    t_new = time.perf_counter() - t
+
+    error = max(abs(cov_new[key] - value) for key, value in cov_ref.items())
+    print("Routes: {}, route edges: {}, edge pairs: {}".format(
+        NUM_ROUTES, NUM_ROUTES*EDGES_PER_ROUTE, len(cov_ref)))
+    print("Pair loop: {:.2f} s".format(t_ref))
+    print("Sparse:    {:.3f} s ({} stored pairs)".format(t_new, len(cov_new)))
+    print("Speedup:   {:.0f}x".format(t_ref/t_new))
+    print("Max abs difference: {:.2e}".format(error))
+    assert error < 1e-9
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the ingestion diagnostics on noisy schedule
+adherence sheets, with unknown stops, departure times out of order and
+distances off by 160 m. The original row-by-row loop printing and warning
+for every offending row is timed with its output written and silenced,
+against dp.extract_data recording the same conditions in a Diagnostics.
+The counts of the diagnostics are checked against the warnings.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import csv
+import time
+import shutil
+import builtins
+import tempfile
+import warnings
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+from ingestionbenchmark import make_dataset, timed, _extract_rowwise
+
+
+NUM_FILES = 40
+TRIPS_PER_FILE = 40
+NOISE_RATE = 0.02
+
+
+def add_noise(root, seed=0):
+    """
+    Corrupt the stop, departure time or distance of a fraction of the stop
+    rows of every sheet
+    """
+    rng = np.random.RandomState(seed)
+    csv_path = os.path.join(root, 'cumtd_datasheets')
+    for filename in os.listdir(csv_path):
+        file_path = os.path.join(csv_path, filename)
+        with open(file_path, newline='') as f:
+            rows = list(csv.reader(f))
+        for row in rows[2:]:
+            if row[1] not in ('Stop', 'Drive through'):
+                continue
+            draw = rng.rand()
+            if draw < NOISE_RATE:
+                row[2] = 'Unknown stop {},1'.format(rng.randint(100))
+            elif draw < 2*NOISE_RATE:
+                row[4] = '5:{:02d}:00'.format(rng.randint(60))
+            elif draw < 3*NOISE_RATE and row[10]:
+                row[10] = str(float(row[10]) + 0.1)
+        with open(file_path, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+
+def rowwise_with_output(root):
+    """
+    Row-by-row loop with its prints written to os.devnull, returns the
+    number of warnings of every message
+    """
+    counts = dict()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        _extract_rowwise(root, 'cumtd_gtfs')
+    for warning in caught:
+        message = str(warning.message)
+        counts[message] = counts.get(message, 0) + 1
+    return counts
+
+
+def rowwise_silent(root):
+    """
+    Row-by-row loop with print and warnings.warn replaced by no-ops
+    """
+    builtin_print, warn = builtins.print, warnings.warn
+    builtins.print = warnings.warn = lambda *args, **kwargs: None
+    try:
+        return _extract_rowwise(root, 'cumtd_gtfs')
+    finally:
+        builtins.print, warnings.warn = builtin_print, warn
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        make_dataset(root, NUM_FILES, TRIPS_PER_FILE)
+        add_noise(root)
+        t = time.perf_counter()
+        counts = rowwise_with_output(root)
+        t_output = time.perf_counter() - t
+        t = time.perf_counter()
+        rowwise_silent(root)
+        t_silent = time.perf_counter() - t
+        (G, _), t_columnar = timed(dp.extract_data, root, 'cumtd_gtfs')
+    finally:
+        shutil.rmtree(root)
+
+    diagnostics = G.graph['diagnostics']
+    num_warnings = sum(counts.values())
+    print("Files: {}, trips per file: {}, noisy rows: {:.0%}".format(NUM_FILES, TRIPS_PER_FILE, 3*NOISE_RATE))
+    print("Row-by-row with a print and warning per row: {:.2f} s, {} warnings".format(t_output, num_warnings))
+    print("Row-by-row without output: {:.2f} s, output is {:.0%} of the runtime".format(
+        t_silent, 1 - t_silent/t_output))
+    print("Columnar with diagnostics: {:.2f} s ({:.0f}x)".format(t_columnar, t_output/t_columnar))
+    print("Diagnostics:\n{}".format(diagnostics))
+    counts_match = (counts.get('Stops from data do not exist in graph', 0) == diagnostics['missing_stops']
+                    and counts.get('Time and distance should be positive and bounded', 0)
+                    == diagnostics['negative_time'] + diagnostics['out_of_bounds']
+                    and counts.get('Distances over multiple samples not matching', 0)
+                    == diagnostics['length_mismatch'])
+    print("Counts match the warnings: {}".format(counts_match))
+    print("Report size: {} conditions, {} examples".format(
+        len(diagnostics.counts), sum(map(len, diagnostics.examples.values()))))
+    assert counts_match
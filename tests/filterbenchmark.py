@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the robust sample filters of the ingestion,
+dataprocessing.MADFilter and dataprocessing.IQRFilter, on a table of stop
+pair samples with injected outliers, against computing the fences with a
+loop over the edges. The masks are checked to match, and the edges built by
+_add_samples with and without filtering are compared with the outliers
+caught. Every condition of the diagnostics must have a description.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+from diagnostics import CONDITIONS
+
+
+NUM_EDGES = 5000
+NUM_TRIPS = 40000
+SAMPLES_PER_TRIP = 50
+OUTLIER_RATE = 0.02
+
+
+def make_samples(seed=0):
+    """
+    Samples of trips over random edges with lognormal times, a fraction of
+    them replaced by GPS glitches and layovers
+    """
+    rng = np.random.RandomState(seed)
+    num_samples = NUM_TRIPS*SAMPLES_PER_TRIP
+    popularity = 1/(np.arange(NUM_EDGES) + 20.0)
+    edge = rng.choice(NUM_EDGES, num_samples, p=popularity/popularity.sum())
+    scale = rng.uniform(30, 200, NUM_EDGES)
+    times = (scale[edge]*rng.lognormal(0, 0.2, num_samples)).astype(np.int32)
+    outlier = rng.rand(num_samples) < OUTLIER_RATE
+    times[outlier] = np.where(rng.rand(outlier.sum()) < 0.5, rng.randint(0, 5, outlier.sum()),
+                              times[outlier] + rng.randint(300, 1800, outlier.sum()))
+    samples = pd.DataFrame({'trip': np.repeat(np.arange(1, NUM_TRIPS + 1), SAMPLES_PER_TRIP).astype(np.int32),
+                            'node1': edge, 'node2': edge + NUM_EDGES, 'time': times,
+                            'distance': 100.0, 'depart': np.int32(8*3600), 'day': np.int8(0)})
+    return samples, ['shape {}'.format(i % 7) for i in range(NUM_TRIPS)], outlier
+
+
+def filter_loop(codes, times, fences):
+    """
+    Mask of the samples within the fences of their edge, one edge at a time
+    """
+    keep = np.zeros(len(times), dtype=bool)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    for index in np.split(order, bounds):
+        lo, hi = fences(times[index].astype(float))
+        keep[index] = (times[index] >= lo) & (times[index] <= hi)
+    return keep
+
+
+def mad_fences(values, k=3.5, min_scale=1.0):
+    median = np.median(values)
+    scale = max(1.4826*np.median(np.abs(values - median)), min_scale)
+    return median - k*scale, median + k*scale
+
+
+def iqr_fences(values, k=1.5):
+    q1, q3 = np.percentile(values, [25, 75])
+    return q1 - k*(q3 - q1), q3 + k*(q3 - q1)
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    samples, trip_shapes, outlier = make_samples()
+    codes = samples.node1.to_numpy()
+    times = samples.time.to_numpy()
+    results = []
+    for sample_filter, fences in ((dp.MADFilter(), mad_fences), (dp.IQRFilter(), iqr_fences)):
+        t = time.perf_counter()
+        keep = sample_filter(codes, times)
+        t_filter = time.perf_counter() - t
+        t = time.perf_counter()
+        keep_loop = filter_loop(codes, times, fences)
+        t_loop = time.perf_counter() - t
+        results.append((sample_filter.name, t_filter, t_loop, np.array_equal(keep, keep_loop),
+                        (~keep & outlier).sum()/outlier.sum(), (~keep & ~outlier).sum()/(~outlier).sum()))
+
+    t = time.perf_counter()
+    G = nx.Graph()
+    rejected = dp._add_samples(G, samples, trip_shapes)
+    t_plain = time.perf_counter() - t
+    t = time.perf_counter()
+    G_mad = nx.Graph()
+    rejected_mad = dp._add_samples(G_mad, samples, trip_shapes, filters=[dp.MADFilter()])
+    t_mad = time.perf_counter() - t
+
+    print("Samples: {}, edges: {}, outliers: {:.0%}".format(len(samples), NUM_EDGES, OUTLIER_RATE))
+    for name, t_filter, t_loop, same, caught, false_rate in results:
+        print("{}: vectorized {:.0f} ms, loop over the edges {:.0f} ms ({:.1f}x), "
+              "masks match: {}".format(name, 1000*t_filter, 1000*t_loop, t_loop/t_filter, same))
+        print("    outliers rejected {:.1%}, other samples rejected {:.2%}".format(caught, false_rate))
+    print("_add_samples: {:.0f} ms without filters, {:.0f} ms with MADFilter".format(1000*t_plain, 1000*t_mad))
+    print("Rejected without filters: {}".format(rejected.counts))
+    print("Rejected with MADFilter:  {}".format(rejected_mad.counts))
+    print("Edges: {} without filters, {} with MADFilter".format(G.number_of_edges(), G_mad.number_of_edges()))
+    described = (all(entry['description'] for entry in rejected_mad.report().values())
+                 and all(name in CONDITIONS for name, *_ in results))
+    print("Conditions described in the report: {}".format(described))
+    assert all(same for _, _, _, same, _, _ in results) and described
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of gtfs.load_feed on a feed made of the CUMTD tables
+with trips replicated to millions of stop_times rows, times past midnight
+and stops without times, against reading stop_times.txt with default types
+and converting the times row by row as the original service_times did. Times
+are checked to match, and the cached snapshot to reproduce the tables.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+import gtfs
+from ingestionbenchmark import timed
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+NUM_TRIPS = 40000
+STOPS_PER_TRIP = 50
+UNTIMED_RATE = 0.3
+
+
+def make_feed(root, seed=0):
+    """
+    CUMTD tables with trips replicated to NUM_TRIPS and their stop times
+    """
+    rng = np.random.RandomState(seed)
+    gtfs_path = os.path.join(root, 'gtfs')
+    shutil.copytree(os.path.join(ROOT_PATH, 'cumtd_gtfs'), gtfs_path)
+
+    df_trips = pd.read_csv(os.path.join(gtfs_path, 'trips.txt'), dtype=str)
+    df_trips = df_trips.iloc[np.arange(NUM_TRIPS) % len(df_trips)].copy()
+    df_trips['trip_id'] = ['{}__{}'.format(trip_id, i) for i, trip_id in enumerate(df_trips.trip_id)]
+    df_trips.to_csv(os.path.join(gtfs_path, 'trips.txt'), index=False)
+
+    stop_ids = pd.read_csv(os.path.join(gtfs_path, 'stops.txt'), dtype=str).stop_id.values
+    starts = rng.randint(5*3600, 26*3600, NUM_TRIPS)
+    secs = (starts[:, None] + np.cumsum(rng.randint(30, 120, (NUM_TRIPS, STOPS_PER_TRIP)), axis=1)).ravel()
+    times = np.array(['{}:{:02d}:{:02d}'.format(s//3600, s//60 % 60, s % 60) for s in secs], dtype=object)
+    untimed = (rng.rand(len(times)) < UNTIMED_RATE) & (np.arange(len(times)) % STOPS_PER_TRIP > 0)
+    untimed &= np.arange(len(times)) % STOPS_PER_TRIP < STOPS_PER_TRIP - 1
+    arrivals = times.copy()
+    arrivals[untimed] = ''
+    df_times = pd.DataFrame({'trip_id': np.repeat(df_trips.trip_id.values, STOPS_PER_TRIP),
+                             'arrival_time': arrivals, 'departure_time': times,
+                             'stop_id': stop_ids[rng.randint(len(stop_ids), size=len(times))],
+                             'stop_sequence': np.tile(np.arange(1, STOPS_PER_TRIP + 1), NUM_TRIPS)})
+    df_times.to_csv(os.path.join(gtfs_path, 'stop_times.txt'), index=False)
+    return secs
+
+
+def service_times_rowwise(gtfs_path):
+    """
+    Original service_times
+    """
+    df_stoptimes = pd.read_csv(os.path.join(gtfs_path, 'stop_times.txt'))
+    depart_times = df_stoptimes['departure_time'].str.split(':').apply(
+        lambda x: int(x[0])*3600 + int(x[1])*60 + int(x[2]))
+    return (min(depart_times), max(depart_times)), depart_times.values
+
+
+def same_feed(feed1, feed2):
+    return (all(feed1.tables[name].equals(feed2.tables[name]) for name in feed1.tables)
+            and all(feed1.ids[kind].equals(feed2.ids[kind]) for kind in feed1.ids))
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        secs = make_feed(root)
+        cache_dir = os.path.join(root, 'cache')
+        (window, rowwise), t_rowwise = timed(service_times_rowwise, os.path.join(root, 'gtfs'))
+        feed, t_load = timed(gtfs.load_feed, root, 'gtfs')
+        _, t_first = timed(gtfs.load_feed, root, 'gtfs', None, cache_dir)
+        cached, t_cached = timed(gtfs.load_feed, root, 'gtfs', None, cache_dir)
+        service_window = dp.service_times(root, 'gtfs', feed)
+        memory = sum(table.memory_usage(deep=True).sum() for table in feed.tables.values())
+    finally:
+        shutil.rmtree(root)
+
+    stop_times = feed.stop_times
+    print("stop_times rows: {}, trips: {}, services: {}".format(
+        len(stop_times), len(feed.trip_ids), len(feed.service_ids)))
+    print("Default types with row by row times, stop_times only: {:.2f} s".format(t_rowwise))
+    print("load_feed, all tables: {:.2f} s ({:.1f}x)".format(t_load, t_rowwise/t_load))
+    print("load_feed, first run with cache: {:.2f} s, cached: {:.2f} s".format(t_first, t_cached))
+    print("Memory of the loaded tables: {:.0f} MB".format(memory/1e6))
+    same_departures = (np.array_equal(stop_times.departure_time.values, secs)
+                       and np.array_equal(stop_times.departure_time.values, rowwise))
+    same_cached = same_feed(feed, cached)
+    print("Departures match: {}, missing arrivals: {}, service window matches: {}".format(
+        same_departures, (stop_times.arrival_time.values == gtfs.MISSING_TIME).sum(), service_window == window))
+    print("Cached snapshot identical: {}".format(same_cached))
+    assert same_departures and service_window == window and same_cached
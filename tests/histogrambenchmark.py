@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the CDF table of datamodeling.EdgeDistributions,
+drawing the travel times of all the edges of the model with one
+searchsorted, against sorting the samples of every edge and drawing by rank
+as sample_routetimes does without a model. Draws of both are checked to be
+identical for the same random numbers, quantiles against numpy and the
+histograms against the sample frequencies.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import simulation as sim
+from timebinsbenchmark import make_network
+
+
+NUM_DRAWS = 20000
+NUM_CALLS = 20
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network()
+    store = G.graph['samples']
+    model = dm.Model(G, routes_dict)
+    t = time.perf_counter()
+    dist = dm.EdgeDistributions(store, model.eids)
+    t_build = time.perf_counter() - t
+    positions = np.arange(len(model.eids))
+    rng = np.random.RandomState(0)
+
+    # Draws of every edge from the table and from the sorted samples
+    t = time.perf_counter()
+    draws = dist.sample(positions, NUM_DRAWS, rng)
+    t_table = time.perf_counter() - t
+
+    # Draws of the routes in small batches, as simulate and simulate_batch do
+    routes = [sim.Route(name, nodes, []) for name, nodes in routes_dict.items()]
+    t = time.perf_counter()
+    for _ in range(NUM_CALLS):
+        for route in routes:
+            sim.sample_routetimes(G, route, (10, 20), rng)
+    t_sorted = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(NUM_CALLS):
+        for route in routes:
+            sim.sample_routetimes(G, route, (10, 20), rng, model)
+    t_model = time.perf_counter() - t
+    num_small = NUM_CALLS*sum(200*(len(route.nodes) - 1) for route in routes)
+
+    route = routes[3]
+    same_draws = np.array_equal(sim.sample_routetimes(G, route, (100, 20), np.random.RandomState(5)),
+                                sim.sample_routetimes(G, route, (100, 20), np.random.RandomState(5), model))
+
+    # Quantiles and histograms against the samples
+    pair = next(iter(model.index))
+    samples = store.edge_times(*pair)
+    q = np.linspace(0, 0.999, 200)
+    same_quantiles = np.array_equal(model.edge_quantile(pair, q),
+                                    np.quantile(samples, q, method='inverted_cdf'))
+    t = time.perf_counter()
+    for _ in range(10000):
+        model.edge_quantile(pair, 0.95)
+    t_quantile = (time.perf_counter() - t)/10000
+    values, frequencies = np.unique(samples, return_counts=True)
+    pmf = model.edge_distribution(pair)
+    same_pmf = (np.array_equal([x for x, _ in pmf], values)
+                and np.allclose([p for _, p in pmf], frequencies/len(samples)))
+    error = max(abs(dist.cdf(p, 60) - (store.edge_times(*store.edges[eid]) <= 60).mean())
+                for p, eid in enumerate(model.eids))
+
+    print("Edges: {}, samples: {}, table: {} bins built in {:.0f} ms".format(
+        len(model.eids), len(store.times), len(dist.table), 1000*t_build))
+    print("Table draws of all the edges at once: {:.1f}M edge times/s".format(draws.size/t_table/1e6))
+    print("Routes in batches of 200 trips: {:.1f}M edge times/s sorting the samples, "
+          "{:.1f}M edge times/s from the table ({:.0f}x)".format(
+              num_small/t_sorted/1e6, num_small/t_model/1e6, t_sorted/t_model))
+    print("Quantile lookup: {:.1f} us".format(1e6*t_quantile))
+    print("Draws identical to the sorted samples: {}, quantiles match numpy: {}".format(
+        same_draws, same_quantiles))
+    print("Histogram matches the sample frequencies: {}, max CDF error: {:.1e}".format(same_pmf, error))
+    assert same_draws and same_quantiles and same_pmf
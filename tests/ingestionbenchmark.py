@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the columnar ingestion in dataprocessing.extract_data
+against the original row-by-row loop on the CUMTD sample sheet replicated to
+hundreds of files, in a single process and with a pool of workers. All the
+graphs are checked to be identical.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import io
+import time
+import shutil
+import tempfile
+import warnings
+import contextlib
+import pandas as pd
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+NUM_FILES = 200
+TRIPS_PER_FILE = 40
+WORKERS = os.cpu_count()
+
+
+def _add_timedata(G, node1, node2, count_trips, time, distance, trip_shape):
+    """
+    Original per-sample edge update with dicts and sets on the edges
+    """
+    if G.has_edge(node1, node2):
+        if abs(G[node1][node2]['length'] - distance) > 50:
+            print(abs(G[node1][node2]['length'] - distance))
+            warnings.warn('Distances over multiple samples not matching')
+        else:
+            G[node1][node2]['time_data'][count_trips] = time
+            G[node1][node2]['trip_shapes'].add(trip_shape)
+    else:
+        G.add_edge(node1, node2, time_data = {count_trips:time}, length = distance,
+                   trip_shapes = set([trip_shape]))
+
+
+def _extract_rowwise(ROOT_PATH, gtfs_foldername):
+    """
+    Original row-by-row loop of extract_data kept as the reference
+    """
+    gtfs_path = os.path.join(ROOT_PATH, gtfs_foldername)
+    G = nx.Graph()
+    df_stops = pd.read_csv(os.path.join(gtfs_path, 'stops.txt'))
+    for stop_id, stop_name, stop_lat, stop_lon in zip(df_stops.stop_id, df_stops.stop_name,
+                                                      df_stops.stop_lat, df_stops.stop_lon):
+        node_name = stop_name+',' + stop_id[-1]
+        if node_name not in G.nodes:
+            G.add_node(node_name, stop_lat = stop_lat, stop_lon = stop_lon)
+
+    count_trips = 0
+    list_tripshapes = set()
+    csv_path = os.path.join(ROOT_PATH, 'cumtd_datasheets')
+    for filename in sorted(os.listdir(csv_path)):
+        df = pd.read_csv(os.path.join(csv_path, filename), header=1)
+        index_toremove = df.loc[df.Type.isin(['Stop without doors','Stop with doors','Dead run out', ])].index
+        df = df.drop(index_toremove).reset_index(drop=True)
+        index_trips = df.loc[df.Type.isin(['Additional trip','Trip'])].index
+
+        for index_start, index_end in zip(index_trips[0:-1], index_trips[1:]):
+            trip_shape = df.Graphic[index_start][9:]
+            list_tripshapes.add(trip_shape)
+            count_trips += 1
+            stop_pairs = zip(df.index[index_start+1:index_end-1],
+                             df.index[index_start+2:index_end])
+            for index_1, index_2 in stop_pairs:
+                types_ofnodes = ['Stop', 'Drive through']
+                if str(df['Type'][index_1]) not in types_ofnodes or str(df['Type'][index_2]) not in types_ofnodes:
+                    continue
+                node1 = str(df['Stop'][index_1])
+                node2 = str(df['Stop'][index_2])
+                if G.has_node(node1) and G.has_node(node2):
+                    time_node1 = dp._get_sec(df['Actual dep'][index_1])
+                    time_node2 = dp._get_sec(df['Actual dep'][index_2])
+                    dist_node1 = df['Sched. total distance'][index_1]*1609.34
+                    dist_node2 = df['Sched. total distance'][index_2]*1609.34
+                    time = time_node2 - time_node1
+                    distance = dist_node2 - dist_node1
+                    if time < 0 or distance < 0 or distance >= 2000:
+                        print(node1); print(node2)
+                        print("Time: {} and Distance:  {}".format(time, distance))
+                        warnings.warn('Time and distance should be positive and bounded')
+                    else:
+                        _add_timedata(G, node1, node2, count_trips, time, distance, trip_shape)
+                else:
+                    print(node1); print(node2)
+                    warnings.warn('Stops from data do not exist in graph')
+
+    remove_list = [(u, v) for u, v, data in G.edges(data=True) if len(data['time_data']) <= 10]
+    G.remove_edges_from(remove_list)
+    return G, list_tripshapes
+
+
+def make_dataset(root, num_files, trips_per_file):
+    """
+    Replicate the trips of the sample sheet into num_files daily sheets,
+    rows are numbered in order as in the exported sheets
+    """
+    with open(os.path.join(REPO_PATH, 'cumtd_datasheets', 'SampleFile_1-14-2019.csv')) as f:
+        lines = f.read().splitlines()
+    header, block, last_trip = lines[0], lines[1:27], lines[27]
+
+    os.makedirs(os.path.join(root, 'cumtd_gtfs'))
+    os.makedirs(os.path.join(root, 'cumtd_datasheets'))
+    shutil.copy(os.path.join(REPO_PATH, 'cumtd_gtfs', 'stops.txt'),
+                os.path.join(root, 'cumtd_gtfs', 'stops.txt'))
+    for i in range(num_files):
+        rows = block*trips_per_file + [last_trip]
+        rows = [str(seq) + row[row.index(','):] for seq, row in enumerate(rows, 1)]
+        with open(os.path.join(root, 'cumtd_datasheets', 'Sheet_{}.csv'.format(i)), 'w') as f:
+            f.write('Schedule adherence\n' + header + '\n' + '\n'.join(rows) + '\n')
+
+
+def same_graph(G_ref, G):
+    """
+    Check nodes, edges and edge data of a graph from the reference loop
+    against a graph with a sample store, nodes of the reference are named
+    """
+    store = G.graph['samples']
+    G_ref = nx.relabel_nodes(G_ref, G.graph['stops'].code)
+    if set(G_ref.nodes) != set(G.nodes) or G_ref.number_of_edges() != G.number_of_edges():
+        return False
+    for u, v, data in G_ref.edges(data=True):
+        if (not G.has_edge(u, v) or G[u][v]['length'] != data['length']
+                or store.timedata(u, v) != data['time_data']
+                or store.edge_shapes(u, v) != data['trip_shapes']):
+            return False
+    return True
+
+
+def same_store(G1, G2):
+    """
+    Check two graphs with sample stores hold the same samples
+    """
+    store1, store2 = G1.graph['samples'], G2.graph['samples']
+    return (set(G1.nodes) == set(G2.nodes) and set(G1.edges) == set(G2.edges)
+            and all(store1.timedata(u, v) == store2.timedata(u, v) for u, v in G1.edges))
+
+
+def timed(func, *args):
+    """
+    Run func with its output and warnings suppressed, return result and runtime
+    """
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(io.StringIO()):
+        warnings.simplefilter('ignore')
+        t = time.perf_counter()
+        out = func(*args)
+        return out, time.perf_counter() - t
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        make_dataset(root, NUM_FILES, TRIPS_PER_FILE)
+        (G_ref, shapes_ref), t_ref = timed(_extract_rowwise, root, 'cumtd_gtfs')
+        (G_new, shapes_new), t_new = timed(dp.extract_data, root, 'cumtd_gtfs')
+        (G_par, shapes_par), t_par = timed(dp.extract_data, root, 'cumtd_gtfs',
+                                           'cumtd_datasheets', WORKERS)
+    finally:
+        shutil.rmtree(root)
+
+    print("Files: {}, trips per file: {}".format(NUM_FILES, TRIPS_PER_FILE))
+    print("Row-by-row: {:.2f} s".format(t_ref))
+    print("Columnar:   {:.2f} s".format(t_new))
+    print("Speedup:    {:.1f}x".format(t_ref/t_new))
+    print("Columnar with {} workers: {:.2f} s ({:.1f}x over one process)".format(WORKERS, t_par, t_new/t_par))
+    print("Sample store: {:.1f} bytes per sample".format(
+        G_new.graph['samples'].nbytes/len(G_new.graph['samples'].times)))
+    identical = (same_graph(G_ref, G_new) and shapes_ref == shapes_new
+                 and same_store(G_new, G_par) and shapes_new == shapes_par)
+    print("Identical graph: {}".format(identical))
+    assert identical
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the transit graph keyed by the integer codes of a
+stopindex.StopIndex against the same graph keyed by node names of the
+length found in stops.txt. Building the model, updating it with observed
+trips and the event-driven simulation are timed on both, with the memory
+held by the model and sample store indexes. Results are checked to match.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import simulation as sim
+from samplestore import SampleStore
+from stopindex import StopIndex
+from covariancebenchmark import make_network
+from simulationbenchmark import make_routes, T_BEGIN, T_END
+
+
+NUM_ROUTES = 120
+NUM_UPDATES = 3000
+
+
+class _Observed:
+    def __init__(self, history):
+        self.history = history
+
+
+def named_network(G, routes_dict):
+    """
+    Network with the nodes renamed as CUMTD nodes, street corners and the
+    last character of the stop id
+    """
+    names = {node: 'Street {0} & Avenue {0} (Northeast Corner),{1}'.format(node, i % 10)
+             for i, node in enumerate(G.nodes)}
+    return relabel(G, routes_dict, names.get)
+
+
+def relabel(G, routes_dict, mapping):
+    """
+    Network with its nodes, sample store and routes relabeled by mapping
+    """
+    store = G.graph['samples']
+    G_new = nx.relabel_nodes(G, mapping)
+    G_new.graph['samples'] = SampleStore([(mapping(u), mapping(v)) for u, v in store.edges],
+                                         store.offsets, store.trips, store.times, store.shapes,
+                                         store.shape_names)
+    return G_new, {name: tuple(map(mapping, nodes)) for name, nodes in routes_dict.items()}
+
+
+def run(G, routes_dict, histories):
+    """
+    Model building, model updates and simulation on a network, returns the
+    results, runtimes and memory of the model and store indexes
+    """
+    tracemalloc.start()
+    t = time.perf_counter()
+    model = dm.Model(G, routes_dict)
+    t_model = time.perf_counter() - t
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    t = time.perf_counter()
+    for history in histories:
+        model.updatemodel(_Observed(history))
+    t_update = time.perf_counter() - t
+
+    routes_list = make_routes(routes_dict)
+    traveler = sim.Trav(routes_dict['route 0'][-9:-8], routes_dict['route 0'][-1:], 600, 0.4, 8*3600)
+    t = time.perf_counter()
+    records, _ = sim.simulate(G, model, routes_list, traveler, T_BEGIN, T_END, seed=0)
+    t_sim = time.perf_counter() - t
+    return model, records, (t_model, t_update, t_sim), memory
+
+
+def index_bytes(model, store):
+    """
+    Size of the dicts indexing the edges and of their keys, objects shared
+    by several keys are counted once
+    """
+    objects = dict()
+    for index in (model.index, store.index):
+        objects[id(index)] = index
+        for key in index:
+            objects[id(key)] = key
+            objects.update((id(node), node) for node in key)
+    return sum(sys.getsizeof(obj) for obj in objects.values())
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    G_named, routes_named = named_network(G, routes_dict)
+    stops = StopIndex(sorted(G_named.nodes))
+    G_codes, routes_codes = relabel(G_named, routes_named, stops.code)
+
+    rng = np.random.RandomState(1)
+    route_names = list(routes_dict)
+    trips = [routes_named[route_names[i]] for i in rng.randint(len(route_names), size=NUM_UPDATES)]
+    histories_named = [{pair: int(rng.normal(60, 10)) for pair in zip(nodes[:-1], nodes[1:])}
+                       for nodes in trips]
+    histories_codes = [{(stops.code(u), stops.code(v)): x for (u, v), x in history.items()}
+                       for history in histories_named]
+
+    model_named, records_named, t_named, memory_named = run(G_named, routes_named, histories_named)
+    model_codes, records_codes, t_codes, memory_codes = run(G_codes, routes_codes, histories_codes)
+
+    same = (np.array_equal(model_named.mean.values, model_codes.mean.values)
+            and (model_named.cov.matrix != model_codes.cov.matrix).nnz == 0
+            and [(stops.code(u), stops.code(v), x, name) for u, v, x, name in records_named] == records_codes)
+    print("Routes: {}, nodes: {}, edges: {}, model updates: {}".format(
+        NUM_ROUTES, G.number_of_nodes(), G.number_of_edges(), NUM_UPDATES))
+    for label, (t_model, t_update, t_sim) in (('Node names', t_named), ('Stop codes', t_codes)):
+        print("{}: model {:.0f} ms, updates {:.0f} ms, simulation {:.2f} s".format(
+            label, 1000*t_model, 1000*t_update, t_sim))
+    print("Model building memory: {:.1f} MB with names, {:.1f} MB with codes".format(
+        memory_named/1e6, memory_codes/1e6))
+    print("Edge index dicts: {:.0f} kB with names, {:.0f} kB with codes".format(
+        index_bytes(model_named, G_named.graph['samples'])/1e3,
+        index_bytes(model_codes, G_codes.graph['samples'])/1e3))
+    print("Identical models and simulation: {}".format(same))
+    assert same
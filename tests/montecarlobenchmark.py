@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of simulation.simulate_batch estimating the on-time
+probability of a traveler from 10k replications of the service day, against
+repeated runs of the event-driven simulation.simulate. The estimates of both
+are checked to agree within their sampling error, and the decisions of the
+batch on the travel times of every run to board the trip of the run.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import simulation as sim
+from covariancebenchmark import make_network
+from simulationbenchmark import make_routes, T_BEGIN, T_END
+
+
+NUM_ROUTES = 40
+NUM_REPS = 10000
+NUM_RUNS = 200
+
+
+def make_traveler():
+    return sim.Trav(['corridor 0'], ['corridor 8'], 660, 0.4, 8*3600 + 123)
+
+
+def replay_decision(G, model, routes_list, trips):
+    """
+    Name of the trip taken by the decisions of simulate_batch on the travel
+    times of the trips of a run of simulate, None if none
+    """
+    traveler = make_traveler()
+    routes, candidates = sim._batch_candidates(G, model, routes_list, traveler, T_BEGIN, T_END, 3600)
+    by_name = {trip.name: trip for route_trips in trips.values() for trip in route_trips}
+    trip_offsets = np.cumsum([0] + [len(starts) for _, starts in routes])
+    trip_arrivals = np.full((1, trip_offsets[-1], max(len(route.nodes) for route, _ in routes)), np.inf)
+    for r, (route, starts) in enumerate(routes):
+        for i, start in enumerate(starts):
+            history = by_name['{} {}'.format(route.name, int(start))].history
+            times = [history[pair] for pair in zip(route.nodes[:-1], route.nodes[1:])]
+            trip_arrivals[0, trip_offsets[r] + i, :len(route.nodes)] = np.cumsum([start] + times)
+    cand_trip = np.array([trip_offsets[r] + i for r, i, *_ in candidates])
+    taken = sim._batch_decisions(trip_arrivals, candidates, cand_trip, traveler,
+                                 traveler.t_start + traveler.t_budget)[0]
+    if taken < 0:
+        return None
+    r, i = candidates[taken][:2]
+    return '{} {}'.format(routes[r][0].name, int(routes[r][1][i]))
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    model = dm.Model(G, routes_dict)
+    routes_list = make_routes(routes_dict)
+
+    t = time.perf_counter()
+    outcome = sim.simulate_batch(G, model, routes_list, make_traveler(), T_BEGIN, T_END,
+                                 NUM_REPS, seed=0)
+    t_batch = time.perf_counter() - t
+
+    t = time.perf_counter()
+    outcome_normal = sim.simulate_batch(G, model, routes_list, make_traveler(), T_BEGIN, T_END,
+                                        NUM_REPS, seed=0, sampler='normal')
+    t_normal = time.perf_counter() - t
+
+    t = time.perf_counter()
+    traveltimes, runs = [], []
+    for seed in range(NUM_RUNS):
+        traveler = make_traveler()
+        _, trips = sim.simulate(G, model, routes_list, traveler, T_BEGIN, T_END, seed=seed)
+        traveltimes.append(traveler.t_arrival - traveler.t_start)
+        runs.append((traveler.route[0][3] if traveler.route else None, trips))
+    t_runs = time.perf_counter() - t
+    same_trips = sum(name == replay_decision(G, model, routes_list, trips) for name, trips in runs)
+    traveltimes = np.array(traveltimes)
+    budget = make_traveler().t_budget
+
+    p_batch = outcome.on_time.mean()
+    p_runs = (traveltimes <= budget).mean()
+    error = 3*np.sqrt(p_batch*(1 - p_batch)/NUM_RUNS)
+    mean_batch = np.nanmean(outcome.arrival - make_traveler().t_start)
+    mean_error = 3*traveltimes.std()/np.sqrt(NUM_RUNS)
+
+    print("Routes: {}, candidate trips at the origin: {}".format(NUM_ROUTES, len(outcome.trip_names)))
+    print("simulate, {} runs: {:.2f} s ({:.1f} ms per replication)".format(
+        NUM_RUNS, t_runs, 1000*t_runs/NUM_RUNS))
+    print("simulate_batch, {} replications: {:.2f} s ({:.2f} ms per replication)".format(
+        NUM_REPS, t_batch, 1000*t_batch/NUM_REPS))
+    print("simulate_batch with normal sampler: {:.2f} s".format(t_normal))
+    print("Speedup per replication: {:.0f}x".format((t_runs/NUM_RUNS)/(t_batch/NUM_REPS)))
+    print("On-time probability: batch {:.3f}, runs {:.3f}, normal sampler {:.3f}".format(
+        p_batch, p_runs, outcome_normal.on_time.mean()))
+    print("Mean travel time: batch {:.1f} s, runs {:.1f} s".format(mean_batch, traveltimes.mean()))
+    agree = abs(p_batch - p_runs) <= error and abs(mean_batch - traveltimes.mean()) <= mean_error
+    print("Estimates agree: {}".format(agree))
+    print("Same trip taken by the batch decisions on the travel times of a run: {}/{}".format(
+        same_trips, NUM_RUNS))
+    assert agree and same_trips == NUM_RUNS
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of saving and loading the graph and the travel time
+model with persistence against rebuilding them, on the replicated CUMTD
+sample sheet and on a synthetic network of many routes. Loaded objects are
+checked to match the originals, including in worker processes sharing the
+memory-mapped arrays.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+import datamodeling as dm
+import persistence as ps
+from streaming import ObservedTrip
+from ingestionbenchmark import make_dataset, same_store, timed
+from covariancebenchmark import make_network
+import timebinsbenchmark
+
+
+NUM_FILES = 200
+TRIPS_PER_FILE = 40
+NUM_ROUTES = 120
+WORKERS = 4
+
+
+def same_model(model1, model2):
+    """
+    Check two models hold the same statistics
+    """
+    return (model1.index == model2.index and model1.numsamples == model2.numsamples
+            and all(np.array_equal(model1.routes[name], model2.routes[name]) for name in model1.routes)
+            and np.array_equal(model1.mean.values, model2.mean.values)
+            and np.array_equal(model1.cov.keys, model2.cov.keys)
+            and np.array_equal(model1.cov.comoment, model2.cov.comoment)
+            and (model1.cov.matrix != model2.cov.matrix).nnz == 0)
+
+
+def same_bins(model1, model2, routes_dict):
+    """
+    Check two models with time bins hold the same bin statistics and give
+    the same route statistics at every hour of a weekday and a sunday
+    """
+    bins1, bins2 = model1.time_bins, model2.time_bins
+    return (np.array_equal(bins1.starts, bins2.starts) and bins1.weekend == bins2.weekend
+            and model1.min_bin_samples == model2.min_bin_samples
+            and all(np.array_equal(getattr(model1, name), getattr(model2, name), equal_nan=True)
+                    for name in ('bin_counts', 'bin_mean', 'bin_cov', 'bin_covcounts'))
+            and all(np.array_equal(model1.route_meanvector(name, t, day), model2.route_meanvector(name, t, day))
+                    and np.array_equal(model1.route_covmatrix(name, t, day),
+                                       model2.route_covmatrix(name, t, day))
+                    for name in routes_dict for t in range(0, 86400, 3600) for day in (1, 6)))
+
+
+def load_in_worker(path):
+    """
+    Load a model in a worker process, return the load time and a checksum
+    """
+    t = time.perf_counter()
+    model = ps.load_model(path)
+    t = time.perf_counter() - t
+    return t, float(model.mean.values.sum() + model.cov.comoment.sum())
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        # Graph of the replicated sample sheets
+        make_dataset(root, NUM_FILES, TRIPS_PER_FILE)
+        (G, shapes), t_extract = timed(dp.extract_data, root, 'cumtd_gtfs')
+        graph_path = os.path.join(root, 'graph')
+        _, t_save_graph = timed(ps.save_graph, G, graph_path)
+        (G_loaded, shapes_loaded), t_load_graph = timed(ps.load_graph, graph_path)
+        same_graph = (same_store(G, G_loaded) and shapes == shapes_loaded
+                      and all(G[u][v] == G_loaded[u][v] for u, v in G.edges))
+
+        # Model of a synthetic network of many routes
+        G_net, routes_dict = make_network(num_routes=NUM_ROUTES)
+        model, t_model = timed(dm.Model, G_net, routes_dict)
+        model_path = os.path.join(root, 'model')
+        _, t_save_model = timed(ps.save_model, model, model_path)
+        model_loaded, t_load_model = timed(ps.load_model, model_path)
+        identical_model = same_model(model, model_loaded)
+        checksum = float(model.mean.values.sum() + model.cov.comoment.sum())
+        with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+            workers = list(executor.map(load_in_worker, [model_path]*WORKERS))
+
+        # Updates on a private copy of the arrays leave the saved model unchanged
+        model_copy = ps.load_model(model_path, mmap_mode='c')
+        route_nodes = routes_dict['route 0']
+        trip = ObservedTrip(0, 'shape')
+        trip.history = {pair: 60 for pair in zip(route_nodes[:-1], route_nodes[1:])}
+        model.updatemodel(trip)
+        model_copy.updatemodel(trip)
+        same_update = same_model(model, model_copy) and same_model(ps.load_model(model_path),
+                                                                   model_loaded)
+        size = sum(os.path.getsize(os.path.join(model_path, name)) for name in os.listdir(model_path))
+
+        # Model with time bins
+        G_bins, routes_bins = timebinsbenchmark.make_network()
+        model_bins = dm.Model(G_bins, routes_bins, time_bins=dm.TimeBins(weekend=True))
+        bins_path = os.path.join(root, 'model_bins')
+        ps.save_model(model_bins, bins_path)
+        same_binned = same_bins(model_bins, ps.load_model(bins_path), routes_bins)
+    finally:
+        shutil.rmtree(root)
+
+    print("Graph: {} files, {} samples".format(NUM_FILES, len(G.graph['samples'].times)))
+    print("extract_data: {:.2f} s, save: {:.3f} s, load: {:.1f} ms".format(
+        t_extract, t_save_graph, 1000*t_load_graph))
+    print("Model: {} routes, {} unique edges, {} stored pairs, {:.1f} MB".format(
+        NUM_ROUTES, len(model.eids), len(model.cov), size/1e6))
+    print("Model: {:.2f} s, save: {:.3f} s, load: {:.1f} ms".format(
+        t_model, t_save_model, 1000*t_load_model))
+    print("Load in {} workers: {}".format(WORKERS, ', '.join(
+        '{:.1f} ms'.format(1000*t) for t, _ in workers)))
+    print("Identical graph: {}".format(same_graph))
+    identical_model = identical_model and all(c == checksum for _, c in workers)
+    print("Identical model: {}".format(identical_model))
+    print("Identical model after updates on a private copy: {}".format(same_update))
+    print("Identical model with time bins: {}".format(same_binned))
+    assert same_graph and identical_model and same_update and same_binned
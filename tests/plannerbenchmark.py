@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Load test of planner.Planner on a synthetic network of routes
+sharing a downtown corridor and routes running back from it, answering
+random traveler queries in a loop, on a thread pool, on a PlannerPool of
+worker processes loading the saved graph and model, and through the local
+HTTP server. Plans are checked to reach the destination with connected legs
+and the pooled and HTTP answers to match the direct ones.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+import networkx as nx
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import persistence as ps
+import planner as pl
+from covariancebenchmark import make_network
+from simulationbenchmark import make_routes
+
+
+NUM_ROUTES = 40
+NUM_BACK = 10
+NUM_QUERIES = 5000
+NUM_REQUESTS = 500
+PROCESSES = 4
+
+
+def make_queries(routes_dict, num_queries, seed=0):
+    """
+    Queries from a stop of a route to the corridor or to a stop of a route
+    running back from it
+    """
+    rng = np.random.RandomState(seed)
+    queries = []
+    for q in range(num_queries):
+        origin = routes_dict['route {}'.format(rng.randint(NUM_ROUTES))][rng.randint(10)]
+        if rng.rand() < 0.5:
+            destination = 'corridor {}'.format(rng.randint(4, 9))
+        else:
+            destination = routes_dict['back {}'.format(rng.randint(NUM_BACK))][-1 - rng.randint(10)]
+        queries.append(([origin], [destination], rng.randint(7*3600, 20*3600),
+                        rng.randint(1200, 2400), rng.choice([0.2, 0.4, 0.8])))
+    return queries
+
+
+def connected(plan, query):
+    origin, destination = query[0], query[1]
+    legs = plan.legs
+    return (legs[0].board in origin and legs[-1].alight in destination
+            and all(leg1.alight == leg2.board and leg1.alight_time <= leg2.board_time
+                    for leg1, leg2 in zip(legs[:-1], legs[1:])))
+
+
+def request(url, query):
+    origin, destination, depart, budget, alpha = query
+    params = urlencode({'origin': origin, 'destination': destination, 'depart': depart,
+                        'budget': budget, 'alpha': alpha}, doseq=True)
+    with urlopen('{}/plan?{}'.format(url, params)) as response:
+        return json.loads(response.read().decode())
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    nx.set_edge_attributes(G, 100.0, 'length')
+    for r in range(NUM_BACK):
+        routes_dict['back {}'.format(r)] = routes_dict['route {}'.format(r)][::-1]
+    model = dm.Model(G, routes_dict)
+    routes_list = make_routes(routes_dict)
+
+    t = time.perf_counter()
+    planner = pl.Planner(G, model, routes_list)
+    t_build = time.perf_counter() - t
+    queries = make_queries(routes_dict, NUM_QUERIES)
+
+    t = time.perf_counter()
+    plans = [planner.plan(*query) for query in queries]
+    t_loop = time.perf_counter() - t
+
+    t = time.perf_counter()
+    pooled = planner.plan_many(queries, max_workers=4)
+    t_pool = time.perf_counter() - t
+
+    path = tempfile.mkdtemp()
+    try:
+        ps.save_graph(G, os.path.join(path, 'graph'))
+        ps.save_model(model, os.path.join(path, 'model'))
+        with pl.PlannerPool(os.path.join(path, 'graph'), os.path.join(path, 'model'), routes_list,
+                            processes=PROCESSES) as planner_pool:
+            planner_pool.plan_many(queries[:PROCESSES])
+            t = time.perf_counter()
+            processed = planner_pool.plan_many(queries)
+            t_processes = time.perf_counter() - t
+    finally:
+        shutil.rmtree(path)
+
+    server = pl.make_server(planner, port=0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        t = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(lambda query: request(url, query), queries[:NUM_REQUESTS]))
+        t_http = time.perf_counter() - t
+    finally:
+        server.shutdown()
+
+    found = [(plan, query) for plan, query in zip(plans, queries) if plan is not None]
+    transfers = sum(len(plan.legs) == 2 for plan, _ in found)
+    print("Routes: {}, queries: {}, planner built in {:.1f} ms".format(
+        len(routes_list), NUM_QUERIES, 1000*t_build))
+    print("Loop:        {:.0f} queries/s ({:.0f} us per query)".format(
+        NUM_QUERIES/t_loop, 1e6*t_loop/NUM_QUERIES))
+    print("Thread pool: {:.0f} queries/s".format(NUM_QUERIES/t_pool))
+    print("Processes:   {:.0f} queries/s on {} workers, {} CPUs".format(
+        NUM_QUERIES/t_processes, PROCESSES, os.cpu_count()))
+    print("HTTP:        {:.0f} requests/s".format(NUM_REQUESTS/t_http))
+    print("Plans found: {}, with a transfer: {}, mean on-time probability {:.3f}".format(
+        len(found), transfers, np.mean([plan.on_time for plan, _ in found])))
+    legs_connected = all(connected(plan, query) for plan, query in found)
+    same_http = answers == [json.loads(json.dumps(pl.plan_json(plan))) for plan in plans[:NUM_REQUESTS]]
+    print("Legs connected: {}, pool matches loop: {}, processes match loop: {}, HTTP matches loop: {}".format(
+        legs_connected, pooled == plans, processed == plans, same_http))
+    assert legs_connected and pooled == plans and processed == plans and same_http
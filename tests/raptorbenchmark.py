@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the Pareto search raptor.Timetable.search on a
+synthetic city of bus lines along the rows and columns of a grid of stops,
+running both ways over the service day. The earliest expected arrival of
+every front is checked against a connection scan over all the trips, and
+the legs of the journeys against the timetable. The search is also run on
+the timetable of the corridor network of simulationbenchmark, with its
+stops named and interned as the integer codes of a StopIndex, given as
+ints and as numpy integers, and a direct trip is checked to stay on the
+front next to a faster journey with a transfer.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import raptor
+from covariancebenchmark import make_network
+from simulationbenchmark import make_routes
+from internbenchmark import relabel
+from stopindex import StopIndex
+
+
+GRID_SIZE = 30
+HEADWAY = 1200
+T_BEGIN = 6*3600
+T_END = 24*3600
+NUM_QUERIES = 200
+
+
+def make_city(seed=0):
+    """
+    Patterns of lines along every row and column of a grid of stops, both
+    ways, with hop times and variances varying by line
+    """
+    rng = np.random.RandomState(seed)
+    patterns = []
+    for axis in ('row', 'col'):
+        for line in range(GRID_SIZE):
+            stops = ['{} {}'.format(*((line, i) if axis == 'row' else (i, line)))
+                     for i in range(GRID_SIZE)]
+            for direction, line_stops in (('east', stops), ('west', stops[::-1])):
+                hops = rng.uniform(50, 90, GRID_SIZE-1)
+                offsets = np.concatenate(([0], np.cumsum(hops)))
+                variances = np.concatenate(([0], np.cumsum((0.2*hops)**2)))
+                starts = np.arange(T_BEGIN + rng.randint(HEADWAY), T_END, HEADWAY)
+                name = '{} {} {}'.format(axis, line, direction)
+                times = starts[:, None] + offsets[None, :]
+                patterns.append((name, line_stops, ['{} {}'.format(name, s) for s in starts],
+                                 times, times, variances))
+    return raptor.Timetable(patterns)
+
+
+def make_transfer_pair():
+    """
+    A direct trip from O to D and a faster journey through X with a transfer
+    """
+    return raptor.Timetable([
+        ('direct', ['O', 'M', 'D'], ['direct 0'], [[0, 100, 200]], [[0, 100, 200]], [0, 0, 0]),
+        ('fast 1', ['O', 'X'], ['fast 1 0'], [[0, 30]], [[0, 30]], [0, 0]),
+        ('fast 2', ['X', 'D'], ['fast 2 40'], [[40, 100]], [[40, 100]], [0, 0])])
+
+
+def earliest_arrival(timetable, origin, depart_time, max_trips):
+    """
+    Earliest expected arrival at every stop riding at most max_trips trips,
+    from a scan of the trip connections by departure for every number of trips
+    """
+    connections = []
+    for p in range(len(timetable.pattern_names)):
+        n = timetable.trip_offsets[p+1] - timetable.trip_offsets[p]
+        stops = timetable.pattern_stops[timetable.pattern_offsets[p]:timetable.pattern_offsets[p+1]]
+        times = timetable.dep[timetable.time_offsets[p]:timetable.time_offsets[p+1]].reshape(-1, n)
+        for t in range(n):
+            for i in range(len(stops) - 1):
+                connections.append((times[i, t], times[i+1, t], stops[i], stops[i+1], (p, t)))
+    connections.sort(key=lambda connection: connection[0])
+
+    best = np.full(len(timetable.stop_names), np.inf)
+    best[timetable.stop_index[origin]] = depart_time
+    for _ in range(max_trips):
+        reached = best.copy()
+        boarded = set()
+        for dep, arr, u, v, trip in connections:
+            if trip in boarded or best[u] <= dep:
+                boarded.add(trip)
+                if arr < reached[v]:
+                    reached[v] = arr
+        best = reached
+    return best
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    t = time.perf_counter()
+    city = make_city()
+    t_build = time.perf_counter() - t
+    rng = np.random.RandomState(1)
+    stops = city.stop_names
+    queries = [(stops[rng.randint(len(stops))], stops[rng.randint(len(stops))],
+                rng.randint(7*3600, 20*3600), 3600) for _ in range(NUM_QUERIES)]
+
+    city.search(*queries[0])
+    t = time.perf_counter()
+    two_rounds = [city.search(*query, max_rounds=2) for query in queries]
+    t_two = (time.perf_counter() - t)/NUM_QUERIES
+    t = time.perf_counter()
+    fronts = [city.search(*query, max_rounds=3) for query in queries]
+    t_search = (time.perf_counter() - t)/NUM_QUERIES
+
+    # Earliest arrival of the fronts against the connection scan
+    checked, matching = 0, 0
+    for (origin, destination, depart_time, budget), front in list(zip(queries, fronts))[:5]:
+        best = earliest_arrival(city, origin, depart_time, 3)[city.stop_index[destination]]
+        checked += 1
+        matching += bool(front) and abs(front[0].expected_arrival - best) < 1e-6
+    legs_valid = all(leg1.alight == leg2.board and leg1.alight_time <= leg2.board_time
+                     for front in fronts for journey in front
+                     for leg1, leg2 in zip(journey.legs[:-1], journey.legs[1:]))
+    sizes = [len(front) for front in fronts]
+
+    # Corridor network with the transfer stops of the routes
+    G, routes_dict = make_network(num_routes=40)
+    for r in range(10):
+        routes_dict['back {}'.format(r)] = routes_dict['route {}'.format(r)][::-1]
+    model = dm.Model(G, routes_dict)
+    corridor = raptor.Timetable.from_routes(make_routes(routes_dict), model)
+    t = time.perf_counter()
+    front = corridor.search(routes_dict['route 3'][2], routes_dict['back 5'][-3], 8*3600, 2400)
+    t_corridor = time.perf_counter() - t
+
+    # Same corridor with single stops given as their codes
+    stop_index = StopIndex(sorted(G.nodes))
+    G_codes, routes_codes = relabel(G, routes_dict, stop_index.code)
+    corridor_codes = raptor.Timetable.from_routes(make_routes(routes_codes), dm.Model(G_codes, routes_codes))
+    front_codes = corridor_codes.search(stop_index.code(routes_dict['route 3'][2]),
+                                        stop_index.code(routes_dict['back 5'][-3]), 8*3600, 2400)
+    origin, destination = stop_index.codes([routes_dict['route 3'][2], routes_dict['back 5'][-3]])
+    front_numpy = corridor_codes.search(origin, destination, 8*3600, 2400)
+    same_codes = ([(j.expected_arrival, j.on_time) for j in front]
+                  == [(j.expected_arrival, j.on_time) for j in front_codes]
+                  == [(j.expected_arrival, j.on_time) for j in front_numpy])
+
+    # A direct trip is not dominated by a faster journey with more transfers
+    front_pair = make_transfer_pair().search('O', 'D', 0, 1000)
+    direct_kept = [(j.expected_arrival, j.transfers) for j in front_pair] == [(100, 1), (200, 0)]
+
+    print("City: {} stops, {} patterns, {} trips, {} stop times, built in {:.2f} s".format(
+        len(stops), len(city.pattern_names), len(city.trip_names), len(city.dep), t_build))
+    print("Search per query: {:.1f} ms with 2 rounds, {:.1f} ms with 3 rounds".format(
+        1000*t_two, 1000*t_search))
+    print("Journeys per front: mean {:.1f}, max {}".format(np.mean(sizes), max(sizes)))
+    print("Earliest arrival matches the connection scan: {}/{}".format(matching, checked))
+    print("Legs connected: {}".format(legs_valid))
+    print("Corridor network: {:.1f} ms, same front with stop codes: {}, front:".format(
+        1000*t_corridor, same_codes))
+    for journey in front:
+        print("  arrival {:.0f}, on-time {:.3f}, transfers {}, trips {}".format(
+            journey.expected_arrival, journey.on_time, journey.transfers,
+            [leg.trip_name for leg in journey.legs]))
+    print("Direct trip kept next to a faster journey with a transfer: {}".format(direct_kept))
+    assert matching == checked and legs_valid and same_codes and direct_kept
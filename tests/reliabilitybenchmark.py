@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the on-time probabilities of reliability.
+ReliabilityEngine for the traveler decisions, against summing the mean
+vector and the covariance submatrix of the route or convolving the edge
+histograms at every query, and of the remaining time queries of Route. Probabilities are checked against the fraction
+of sampled route travel times within the slack.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import math
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import reliability as rl
+import simulation as sim
+from covariancebenchmark import make_network
+from simulationbenchmark import make_routes
+
+
+NUM_ROUTES = 40
+NUM_QUERIES = 20000
+NUM_DRAWS = 20000
+
+
+def walk_normal(model, route, start, end, slack):
+    """
+    Normal on-time probability summing the route statistics at every query
+    """
+    mean = model.route_meanvector(route.name)[start:end].sum()
+    var = model.route_covmatrix(route.name)[start:end, start:end].sum()
+    if var > 0:
+        return 0.5*(1 + math.erf((slack - mean)/math.sqrt(2*var)))
+    return float(mean <= slack)
+
+
+def walk_convolution(store, route, start, end, slack):
+    """
+    On-time probability convolving the edge histograms at every query
+    """
+    lo, pmf = 0, np.ones(1)
+    for u, v in zip(route.nodes[start:end], route.nodes[start+1:end+1]):
+        times = store.edge_times(u, v).astype(np.int64)
+        lo, pmf = lo + times.min(), np.convolve(pmf, np.bincount(times - times.min())/len(times))
+    return pmf[:max(int(math.floor(slack)) - lo + 1, 0)].sum()
+
+
+def timed_queries(function, queries):
+    t = time.perf_counter()
+    values = [function(route, start, end, slack) for route, start, end, slack in queries]
+    return np.array(values), (time.perf_counter() - t)/len(queries)
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    model = dm.Model(G, routes_dict)
+    routes_list = make_routes(routes_dict)
+    store = G.graph['samples']
+    rng = np.random.RandomState(0)
+
+    queries = []
+    for q in range(NUM_QUERIES):
+        route = routes_list[rng.randint(len(routes_list))]
+        end = len(route.nodes) - 1 - rng.randint(3)
+        start = rng.randint(end)
+        mean = model.route_meanvector(route.name)[start:end].sum()
+        queries.append((route, start, end, mean*rng.uniform(0.8, 1.3)))
+
+    normal = rl.ReliabilityEngine(model)
+    convolution = rl.ReliabilityEngine(model, G, method='convolution')
+    t = time.perf_counter()
+    for route in routes_list:
+        normal.route(route)
+    t_normal_build = time.perf_counter() - t
+    t = time.perf_counter()
+    for route in routes_list:
+        convolution.route(route)._suffix_cdfs(len(route.nodes) - 1)
+    t_conv_build = time.perf_counter() - t
+
+    p_normal, t_normal = timed_queries(normal.probability, queries)
+    p_walk, t_walk = timed_queries(lambda *query: walk_normal(model, *query), queries)
+    p_conv, t_conv = timed_queries(convolution.probability, queries)
+    p_walkconv, t_walkconv = timed_queries(lambda *query: walk_convolution(store, *query),
+                                           queries[:NUM_QUERIES//20])
+
+    # Remaining time queries on the routes against summing the path means
+    route_mean, t_route = timed_queries(
+        lambda route, start, end, slack: route.remaining_mean(start, end), queries)
+    path_mean, t_path = timed_queries(
+        lambda route, start, end, slack: model.calc_pathmean(route.nodes[start:end+1]).sum(),
+        queries)
+
+    # Whole route of the first route against sampled travel times
+    route = routes_list[0]
+    end = len(route.nodes) - 1
+    joint = model.sample_route(route.name, NUM_DRAWS, rng).sum(axis=1)
+    independent = sim.sample_routetimes(G, route, NUM_DRAWS, rng).sum(axis=1)
+    slacks = np.percentile(independent, [10, 50, 90])
+    error_normal = max(abs(normal.probability(route, 0, end, s) - (joint <= s).mean()) for s in slacks)
+    error_conv = max(abs(convolution.probability(route, 0, end, s) - (independent <= s).mean())
+                     for s in slacks)
+
+    # Decision of a traveler among the trips of all the routes at a stop
+    options = [(i, slack, p) for i, ((_, _, _, slack), p) in enumerate(zip(queries, p_normal))]
+    t = time.perf_counter()
+    for start in range(0, NUM_QUERIES - NUM_ROUTES, NUM_ROUTES):
+        sim.optimal_choice(options[start:start+NUM_ROUTES], 0, 0.4)
+    t_choice = (time.perf_counter() - t)/(NUM_QUERIES//NUM_ROUTES)
+
+    print("Routes: {}, queries: {}".format(NUM_ROUTES, NUM_QUERIES))
+    print("Precomputation: normal {:.1f} ms, convolution {:.1f} ms".format(
+        1000*t_normal_build, 1000*t_conv_build))
+    print("Remaining mean per query: route {:.2f} us, summing the path {:.1f} us ({:.0f}x)".format(
+        1e6*t_route, 1e6*t_path, t_path/t_route))
+    print("Normal per query:      engine {:.2f} us, summing the route {:.1f} us ({:.0f}x)".format(
+        1e6*t_normal, 1e6*t_walk, t_walk/t_normal))
+    print("Convolution per query: engine {:.2f} us, convolving the edges {:.1f} us ({:.0f}x)".format(
+        1e6*t_conv, 1e6*t_walkconv, t_walkconv/t_conv))
+    print("Decision among {} candidates: {:.1f} us".format(
+        NUM_ROUTES, 1e6*(t_choice + NUM_ROUTES*t_normal)))
+    differences = (abs(route_mean - path_mean).max(), abs(p_normal - p_walk).max(),
+                   abs(p_conv[:len(p_walkconv)] - p_walkconv).max())
+    print("Max difference to the per query results: mean {:.1e}, normal {:.1e}, "
+          "convolution {:.1e}".format(*differences))
+    print("Max error against sampled route times: normal {:.3f}, convolution {:.3f}".format(
+        error_normal, error_conv))
+    assert max(differences) < 1e-9 and error_normal < 0.02 and error_conv < 0.02
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the correlated route sampler Model.sample_route,
+drawing with a cached Cholesky factor, against numpy multivariate_normal
+factorizing the route covariance at every call. Draws are checked to
+reproduce the repaired route covariance and the spread of route travel
+times against sampling every edge independently.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import simulation as sim
+from covariancebenchmark import make_network
+
+
+NUM_ROUTES = 40
+NUM_QUERIES = 2000
+NUM_DRAWS = 100000
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    model = dm.Model(G, routes_dict)
+    route_names = list(routes_dict)
+    rng = np.random.RandomState(0)
+
+    # Single draws of routes over many queries
+    t = time.perf_counter()
+    for q in range(NUM_QUERIES):
+        name = route_names[q % len(route_names)]
+        rng.multivariate_normal(model.route_meanvector(name), model.route_covmatrix(name),
+                                check_valid='ignore')
+    t_mvn = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for q in range(NUM_QUERIES):
+        model.sample_route(route_names[q % len(route_names)], rng=rng)
+    t_cached = time.perf_counter() - t
+
+    # Batched draws of one route
+    name = route_names[0]
+    t = time.perf_counter()
+    draws = model.sample_route(name, NUM_DRAWS, rng)
+    t_batch = time.perf_counter() - t
+
+    cov = model.route_covmatrix(name)
+    repaired = dm.nearest_psd(cov)
+    factor = model.route_factor(name)
+    independent = sim.sample_routetimes(G, sim.Route(name, routes_dict[name], []), NUM_DRAWS, rng)
+    error = np.abs(np.cov(draws.T) - factor @ factor.T).max()/np.abs(repaired).max()
+
+    print("Routes: {}, edges per route: {}".format(NUM_ROUTES, len(routes_dict[name]) - 1))
+    print("Smallest eigenvalue of route 0 covariance: {:.3f}".format(np.linalg.eigvalsh(cov).min()))
+    print("multivariate_normal per draw: {:.1f} us".format(1e6*t_mvn/NUM_QUERIES))
+    print("Cached Cholesky per draw:     {:.1f} us ({:.0f}x)".format(
+        1e6*t_cached/NUM_QUERIES, t_mvn/t_cached))
+    print("Batched, {} draws: {:.3f} s ({:.2f} us per draw)".format(
+        NUM_DRAWS, t_batch, 1e6*t_batch/NUM_DRAWS))
+    print("Relative error of the draw covariance: {:.3f}".format(error))
+    print("Route time sd: model {:.1f} s, correlated draws {:.1f} s, independent edges {:.1f} s".format(
+        np.sqrt(repaired.sum()), draws.sum(axis=1).std(), independent.sum(axis=1).std()))
+    assert error < 0.05
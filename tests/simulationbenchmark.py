@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the event-driven simulation.simulate over a full
+service day of a synthetic network of routes sharing a downtown corridor,
+against a loop advancing the trips one second at a time as the original
+simulate did. The route records of the traveler are checked against the
+trips they rode.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+import modelingtools as mt
+import simulation as sim
+from covariancebenchmark import make_network
+
+
+NUM_ROUTES = 40
+HEADWAY = 600
+T_BEGIN = 5*3600
+T_END = 25*3600
+
+
+def make_routes(routes_dict, headway=HEADWAY):
+    """
+    Route objects with trips starting every headway seconds over the day
+    """
+    routes_list = []
+    transfers = mt.TransferIndex(routes_dict)
+    for route_name, route_nodes in routes_dict.items():
+        route = sim.Route(route_name, route_nodes, list(range(T_BEGIN, T_END, headway)))
+        route.load_transferstops(routes_dict, transfers)
+        routes_list.append(route)
+    return routes_list
+
+
+def _simulate_ticks(G, routes_list, t_begin, t_end, seed=None):
+    """
+    Trips advanced with a one second step, every active trip checked at
+    every step as in the original simulate
+    """
+    rng = np.random.RandomState(seed)
+    pending = sorted((sim.Trip(start_time, route) for route in routes_list
+                      for start_time in route.list_starttimes if t_begin <= start_time <= t_end),
+                     key=lambda trip: trip.start_time)
+    active, arrival = [], dict()
+    t = t_begin
+    while pending or active:
+        while pending and pending[0].start_time == t:
+            trip = pending.pop(0)
+            arrival[trip] = t + sample_edgetime(G, trip, rng)
+            active.append(trip)
+        for trip in list(active):
+            if arrival[trip] == t:
+                trip.position += 1
+                trip.lastnode = trip.route.nodes[trip.position]
+                if trip.position + 1 < len(trip.route.nodes):
+                    arrival[trip] = t + sample_edgetime(G, trip, rng)
+                else:
+                    active.remove(trip)
+        t += 1
+    return t - t_begin
+
+
+def sample_edgetime(G, trip, rng):
+    return sim.sample_edgetime(G, trip, rng)[0]
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network(num_routes=NUM_ROUTES)
+    model = dm.Model(G, routes_dict)
+    routes_list = make_routes(routes_dict)
+
+    traveler = sim.Trav(['corridor 0'], ['corridor 8'], 600, 0.4, 8*3600)
+    t = time.perf_counter()
+    records, trips = sim.simulate(G, model, routes_list, traveler, T_BEGIN, T_END, seed=0)
+    t_event = time.perf_counter() - t
+
+    t = time.perf_counter()
+    ticks = _simulate_ticks(G, make_routes(routes_dict), T_BEGIN, T_END, seed=0)
+    t_tick = time.perf_counter() - t
+
+    num_trips = sum(len(route_trips) for route_trips in trips.values())
+    finished = all(trip.position == len(trip.route.nodes) - 1
+                   for route_trips in trips.values() for trip in route_trips)
+    ridden = {trip.name: trip for route_trips in trips.values() for trip in route_trips}
+    consistent = all(ridden[name].history[(u, v)] == traveltime for u, v, traveltime, name in records)
+
+    print("Routes: {}, trips: {}, events: {}".format(
+        NUM_ROUTES, num_trips, sum(len(trip.history) + 1 for trip in ridden.values())))
+    print("One second steps: {:.2f} s ({} steps)".format(t_tick, ticks))
+    print("Event-driven:     {:.2f} s".format(t_event))
+    print("Speedup:          {:.0f}x".format(t_tick/t_event))
+    print("Traveler: {} edges on {}, arrived after {} s with a budget of {} s".format(
+        len(records), sorted(set(name for _, _, _, name in records)),
+        traveler.t_arrival - traveler.t_start, traveler.t_budget))
+    print("All trips finished: {}, records match the trips: {}".format(finished, consistent))
+    assert finished and consistent
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Replay of the CUMTD sample sheet replicated to many files
+through streaming.FeedIngestor, in order and with rows shuffled within
+windows to mimic a feed delivering rows out of order. Throughput is reported
+and the graphs are checked against dataprocessing.extract_data. A model
+built on the first half of the files is then updated from the second half.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import dataprocessing as dp
+import datamodeling as dm
+import streaming as st
+from ingestionbenchmark import make_dataset, same_store, timed
+
+
+NUM_FILES = 100
+TRIPS_PER_FILE = 40
+SHUFFLE_WINDOW = 200
+
+
+def stream(G_nodes, rows, model=None, **kwargs):
+    """
+    Ingest rows into a graph with the nodes of G_nodes, return the graph,
+    the ingestor and the runtime
+    """
+    G = nx.Graph()
+    G.add_nodes_from(G_nodes.nodes(data=True))
+    G.graph['stops'] = G_nodes.graph['stops']
+    ingestor = st.FeedIngestor(G, model, **kwargs)
+    t = time.perf_counter()
+    ingestor.run(rows)
+    ingestor.flush()
+    return G, ingestor, time.perf_counter() - t
+
+
+def trip_route(G, file_path):
+    """
+    Longest run of consecutive edges of G traversed by the first trip of a sheet
+    """
+    assembler = st.TripAssembler()
+    trip = next(trip for source, seq, row in st.replay([file_path])
+                for trip in assembler.push(source, seq, row))
+    stops = G.graph['stops']
+    best, run = [], []
+    for node1, node2, _, _, _ in trip.pairs:
+        node1, node2 = stops.get(node1), stops.get(node2)
+        run = run + [node2] if G.has_edge(node1, node2) and run and run[-1] == node1 else (
+            [node1, node2] if G.has_edge(node1, node2) else [])
+        best = max(best, run, key=len)
+    return tuple(best)
+
+
+def shuffled(rows, window, seed=0):
+    rng = random.Random(seed)
+    rows = list(rows)
+    for start in range(0, len(rows), window):
+        block = rows[start:start+window]
+        rng.shuffle(block)
+        rows[start:start+window] = block
+    return rows
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    root = tempfile.mkdtemp()
+    try:
+        make_dataset(root, NUM_FILES, TRIPS_PER_FILE)
+        csv_path = os.path.join(root, 'cumtd_datasheets')
+        file_paths = [os.path.join(csv_path, name) for name in sorted(os.listdir(csv_path))]
+        (G_batch, shapes_batch), t_batch = timed(dp.extract_data, root, 'cumtd_gtfs')
+        rows = list(st.replay(file_paths))
+
+        G_ord, ing_ord, t_ord = stream(G_batch, rows)
+        G_shuf, ing_shuf, t_shuf = stream(G_batch, shuffled(rows, SHUFFLE_WINDOW))
+        G_part, ing_part, t_part = stream(G_batch, shuffled(rows, SHUFFLE_WINDOW),
+                                          max_rows=60, max_sources=2, partial=True)
+
+        # Model of the first half of the files updated with the second half
+        half = len(file_paths)//2
+        os.makedirs(os.path.join(root, 'first_half'))
+        for file_path in file_paths[:half]:
+            shutil.copy(file_path, os.path.join(root, 'first_half'))
+        (G_half, _), _ = timed(dp.extract_data, root, 'cumtd_gtfs', 'first_half')
+        routes_dict = {'sample': trip_route(G_half, file_paths[0])}
+        model = dm.Model(G_half, routes_dict)
+        numsamples = model.numsamples['sample']
+        t = time.perf_counter()
+        ingestor = st.FeedIngestor(G_half, model)
+        ingestor.run(st.replay(file_paths[half:]))
+        t_model = time.perf_counter() - t
+        model_batch = dm.Model(G_batch, routes_dict)
+        error = abs(model.mean.values - model_batch.mean.values).max()
+    finally:
+        shutil.rmtree(root)
+
+    print("Files: {}, rows: {}, trips: {}".format(NUM_FILES, len(rows), ing_ord.count_trips))
+    print("Batch extract_data: {:.2f} s".format(t_batch))
+    print("Streaming in order: {:.2f} s ({:.0f} rows/s)".format(t_ord, len(rows)/t_ord))
+    print("Streaming shuffled: {:.2f} s ({:.0f} rows/s)".format(t_shuf, len(rows)/t_shuf))
+    print("Bounded buffers with partial trips: {:.2f} s, {} trips, {} rows dropped".format(
+        t_part, ing_part.count_trips, ing_part.assembler.dropped_rows))
+    print("Streaming with model updates: {:.0f} rows/s, route samples {} -> {}, "
+          "max mean difference to batch model {:.2e}".format(
+              ingestor.count_rows/t_model, numsamples, model.numsamples['sample'], error))
+    identical = same_store(G_batch, G_ord) and ing_ord.list_tripshapes == shapes_batch
+    identical_shuffled = (set(map(frozenset, G_batch.edges)) == set(map(frozenset, G_shuf.edges))
+                          and all(sorted(G_batch.graph['samples'].edge_times(u, v)) ==
+                                  sorted(G_shuf.graph['samples'].edge_times(u, v)) for u, v in G_batch.edges))
+    print("Identical graph: {}".format(identical))
+    print("Identical graph from shuffled rows: {}".format(identical_shuffled))
+    assert identical and identical_shuffled and error < 1e-9
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the time of day statistics of datamodeling.Model
+on a synthetic network whose travel times peak in the morning and evening
+of weekdays. Lookups of the mean and covariance of an edge at any time
+are timed against filtering the samples of the edge by departure time for
+every query. Binned means are checked against a pandas groupby, and the
+error to the true travel time profile is compared to the whole day mean.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+from samplestore import SampleStore
+
+
+NUM_ROUTES = 20
+EDGES_PER_ROUTE = 25
+SHARED_EDGES = 8
+TRIPS_PER_ROUTE = 2000
+NUM_QUERIES = 20000
+
+
+def profile(t, day):
+    """
+    True mean travel time on an edge departing at t on day, with peaks at
+    8:00 and 17:30 on weekdays
+    """
+    peaks = 25*np.exp(-((t - 8*3600)/3600.)**2) + 30*np.exp(-((t - 17.5*3600)/3600.)**2)
+    return 60 + np.where(np.asarray(day) >= 5, 0.3, 1.0)*peaks
+
+
+def make_network(seed=0):
+    """
+    Routes through a shared corridor with trips over the service day of
+    every day of the week, edge times follow the profile with a trip delay
+    """
+    rng = np.random.RandomState(seed)
+    corridor = ['corridor {}'.format(i) for i in range(SHARED_EDGES+1)]
+    routes_dict = dict()
+    for r in range(NUM_ROUTES):
+        head = ['route {} stop {}'.format(r, i) for i in range(EDGES_PER_ROUTE-SHARED_EDGES)]
+        routes_dict['route {}'.format(r)] = tuple(head + corridor)
+
+    samples = dict()
+    trip = 0
+    for route_nodes in routes_dict.values():
+        for _ in range(TRIPS_PER_ROUTE):
+            trip += 1
+            depart, day = rng.randint(5*3600, 25*3600), rng.randint(7)
+            delay = rng.normal(0, 5)
+            for pair in zip(route_nodes[:-1], route_nodes[1:]):
+                time = max(int(profile(depart % 86400, day) + delay + rng.normal(0, 5)), 0)
+                samples.setdefault(pair, []).append((trip, time, depart, day))
+                depart += time
+
+    G = nx.Graph()
+    edges = list(samples)
+    offsets = np.cumsum([0] + [len(samples[pair]) for pair in edges])
+    trips, times, departs, days = np.array([sample for pair in edges for sample in samples[pair]]).T
+    G.add_edges_from((u, v, {'eid': eid}) for eid, (u, v) in enumerate(edges))
+    G.graph['samples'] = SampleStore(edges, offsets, trips, times, np.zeros(len(trips)), ['shape'],
+                                     departs=departs, days=days)
+    return G, routes_dict
+
+
+def mean_filtered(store, pair, t, day, half_width=1800):
+    """
+    Mean of the samples of an edge departing within half_width of t on the
+    same kind of day
+    """
+    s = store._slice(*pair)
+    departs, days = store.departs[s] % 86400, store.days[s]
+    keep = (np.abs(departs - t) <= half_width) & ((days >= 5) == (day >= 5))
+    return store.times[s][keep].mean()
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    G, routes_dict = make_network()
+    store = G.graph['samples']
+
+    t = time.perf_counter()
+    model_day = dm.Model(G, routes_dict)
+    t_day = time.perf_counter() - t
+    bins = dm.TimeBins(np.arange(0, 86400, 1800), weekend=True)
+    t = time.perf_counter()
+    model = dm.Model(G, routes_dict, time_bins=bins)
+    t_binned = time.perf_counter() - t
+
+    rng = np.random.RandomState(1)
+    pairs = list(model.index)
+    queries = [(pairs[i], int(rng.randint(6*3600, 23*3600)), int(rng.randint(7)))
+               for i in rng.randint(len(pairs), size=NUM_QUERIES)]
+
+    t = time.perf_counter()
+    means = [model.edge_mean(pair, t_query, day) for pair, t_query, day in queries]
+    t_lookup = (time.perf_counter() - t)/NUM_QUERIES
+    t = time.perf_counter()
+    covs = [model.edge_cov(pair, pair, t_query, day) for pair, t_query, day in queries]
+    t_covlookup = (time.perf_counter() - t)/NUM_QUERIES
+    t = time.perf_counter()
+    filtered = [mean_filtered(store, pair, t_query, day) for pair, t_query, day in queries[:2000]]
+    t_filter = (time.perf_counter() - t)/2000
+
+    # Binned means against a groupby of the samples of the model edges
+    positions = np.array([model.index[(u, v)] for u, v in store.edges])
+    df = pd.DataFrame({'position': np.repeat(positions, store.counts()), 'time': store.times,
+                       'bin': bins.bins(store.departs, store.days)})
+    grouped = df.groupby(['bin', 'position']).time.mean()
+    matching = np.allclose(model.bin_mean[grouped.index.get_level_values(0),
+                                          grouped.index.get_level_values(1)], grouped.values)
+
+    truth = np.array([profile(t_query, day) for _, t_query, day in queries])
+    error_binned = np.abs(np.array(means) - truth).mean()
+    error_day = np.abs(np.array([model_day.edge_mean(pair) for pair, _, _ in queries]) - truth).mean()
+    peak = model.route_meanvector('route 0', 17.5*3600, 1).sum()
+    night = model.route_meanvector('route 0', 22*3600, 1).sum()
+
+    print("Edges: {}, samples: {}, bins: {}".format(len(model.eids), len(store.times), bins.size))
+    print("Model: {:.2f} s whole day, {:.2f} s with time bins".format(t_day, t_binned))
+    print("Mean lookup: {:.2f} us, covariance lookup: {:.2f} us, filtering samples: {:.0f} us".format(
+        1e6*t_lookup, 1e6*t_covlookup, 1e6*t_filter))
+    print("Binned means match the groupby: {}".format(matching))
+    print("Mean absolute error to the true profile: {:.2f} s binned, {:.2f} s whole day".format(
+        error_binned, error_day))
+    print("Route 0 on a tuesday: {:.0f} s at 17:30, {:.0f} s at 22:00, {:.0f} s whole day".format(
+        peak, night, model_day.route_meanvector('route 0').sum()))
+    print("Variance of the edges, mean: {:.1f} binned, {:.1f} whole day".format(
+        np.mean(covs), np.mean([model_day.edge_cov(pair, pair) for pair, _, _ in queries])))
+    assert matching and error_binned < error_day
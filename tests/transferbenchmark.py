@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmark of the transfer stops of all the routes from
+modelingtools.TransferIndex, built in one pass over the routes, against the
+original Route.load_transferstops intersecting every route with every other
+route. Routes are random walks over a grid of streets, so that they share
+runs of stops and some revisit stops. Transfer stops are checked to match.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import modelingtools as mt
+import simulation as sim
+
+
+NUM_ROUTES = 150
+ROUTE_LENGTH = 60
+GRID_SIZE = 25
+
+
+def make_routes(seed=0):
+    """
+    Routes walking the streets of a grid, keeping their direction most of the time
+    """
+    rng = np.random.RandomState(seed)
+    moves = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    routes_dict = dict()
+    for r in range(NUM_ROUTES):
+        x, y = rng.randint(GRID_SIZE, size=2)
+        move = moves[rng.randint(4)]
+        nodes = []
+        while len(nodes) < ROUTE_LENGTH:
+            if rng.rand() < 0.2 or not (0 <= x + move[0] < GRID_SIZE and 0 <= y + move[1] < GRID_SIZE):
+                move = moves[rng.randint(4)]
+                continue
+            x, y = x + move[0], y + move[1]
+            nodes.append('{} & {}'.format(x, y))
+        routes_dict['route {}'.format(r)] = tuple(nodes)
+    return routes_dict
+
+
+def transferstops_pairwise(route, routes_dict):
+    """
+    Original Route.load_transferstops
+    """
+    transferstops = set()
+    nodelist1 = route.nodes
+    for routename, nodelist2 in routes_dict.items():
+        if routename != route.name:
+            commonnodes = set(nodelist1).intersection(nodelist2)
+            indices_common = sorted([nodelist1.index(x) for x in commonnodes])
+            indices_transferstops = []
+            if len(indices_common) != 0:
+                indices_transferstops = [x  for x, y in zip(indices_common[:-1], indices_common[1:]) if x + 1 < y]
+                indices_transferstops.append(indices_common[-1])
+                transferstops.update([nodelist1[x] for x in indices_transferstops])
+    return tuple(transferstops)
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    routes_dict = make_routes()
+    routes_list = [sim.Route(name, nodes, []) for name, nodes in routes_dict.items()]
+
+    t = time.perf_counter()
+    pairwise = {route.name: transferstops_pairwise(route, routes_dict) for route in routes_list}
+    t_pairwise = time.perf_counter() - t
+
+    t = time.perf_counter()
+    index = mt.extract_transferpoints(routes_list)
+    t_index = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for route in routes_list[:10]:
+        route.load_transferstops(routes_dict)
+    t_single = (time.perf_counter() - t)/10
+
+    matching = all(set(route.transferstops) == set(pairwise[route.name]) for route in routes_list)
+    pair_stops = [len(index.transfers(name1, name2)) for name1 in routes_dict for name2 in routes_dict]
+    revisits = sum(len(set(nodes)) < len(nodes) for nodes in routes_dict.values())
+
+    print("Routes: {}, stops per route: {}, routes revisiting stops: {}".format(
+        NUM_ROUTES, ROUTE_LENGTH, revisits))
+    print("Pairwise scans for all routes: {:.1f} ms".format(1000*t_pairwise))
+    print("Transfer index for all routes: {:.1f} ms ({:.0f}x)".format(
+        1000*t_index, t_pairwise/t_index))
+    print("load_transferstops of one route without an index: {:.2f} ms".format(1000*t_single))
+    print("Mean transfer stops per route: {:.1f}, route pairs with a transfer: {}".format(
+        np.mean([len(route.transferstops) for route in routes_list]),
+        sum(count > 0 for count in pair_stops)))
+    print("Transfer stops match the pairwise scans: {}".format(matching))
+    assert matching
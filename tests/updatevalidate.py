@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Checks of Model.updatemodel against the batch model. A model
+built from the first trips of a network and updated with the others must
+have the means and covariances of a model built from all the trips, and
+with forgetting < 1 the exponentially weighted means and covariances of
+all the trips. Two edges of a route are observed together by a single one
+of the first trips, and two others by none, so that the moments of their
+pair come from the pairs first observed in an update.
+
+Author: Pranay Thangeda
+Email: contact@prny.me
+"""
+
+import os
+import sys
+import numpy as np
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protrip'))
+import datamodeling as dm
+from samplestore import SampleStore
+
+
+NUM_ROUTES = 4
+EDGES_PER_ROUTE = 8
+SHARED_EDGES = 3
+TRIPS_PER_ROUTE = 150
+SPLIT = 0.6
+FORGETTING = 0.97
+TOLERANCE = 1e-9
+
+
+class _Observed:
+    def __init__(self, history):
+        self.history = history
+
+
+def make_trips(seed=0):
+    """
+    Routes through a shared corridor and the travel times of their trips
+    in order, with a trip level delay and missing samples. The first four
+    edges of route 0 are observed by alternate trips of the first part,
+    the first two together by a single one of them.
+    """
+    rng = np.random.RandomState(seed)
+    corridor = ['corridor {}'.format(i) for i in range(SHARED_EDGES+1)]
+    routes_dict = dict()
+    for r in range(NUM_ROUTES):
+        head = ['route {} stop {}'.format(r, i) for i in range(EDGES_PER_ROUTE-SHARED_EDGES)]
+        routes_dict['route {}'.format(r)] = tuple(head + corridor)
+
+    trips = []
+    first_part = int(SPLIT*TRIPS_PER_ROUTE)
+    for k in range(TRIPS_PER_ROUTE):
+        for r, route_nodes in enumerate(routes_dict.values()):
+            delay = rng.normal(0, 10)
+            history = dict()
+            for position, pair in enumerate(zip(route_nodes[:-1], route_nodes[1:])):
+                if (r == 0 and position < 4 and k < first_part and k % 2 != position % 2
+                        and not (position < 2 and k == 7)):
+                    continue
+                if rng.rand() > 0.1:
+                    history[pair] = int(60 + delay + rng.normal(0, 5))
+            trips.append(history)
+    return routes_dict, trips, first_part*NUM_ROUTES
+
+
+def make_network(trips):
+    """
+    Network with a sample store holding the samples of trips, numbered from 1
+    """
+    samples = dict()
+    for trip, history in enumerate(trips, 1):
+        for pair, time in history.items():
+            samples.setdefault(pair, []).append((trip, time))
+    G = nx.Graph()
+    edges = list(samples)
+    offsets = np.cumsum([0] + [len(samples[pair]) for pair in edges])
+    trip_ids = [t for pair in edges for t, _ in samples[pair]]
+    times = [x for pair in edges for _, x in samples[pair]]
+    G.add_edges_from((u, v, {'eid': eid}) for eid, (u, v) in enumerate(edges))
+    G.graph['samples'] = SampleStore(edges, offsets, trip_ids, times, np.zeros(len(trip_ids)), ['shape'])
+    return G
+
+
+def weighted_reference(model, trips, num_batch, forgetting):
+    """
+    Means and covariances of the edges of model over trips. The samples of
+    an edge, or the common samples of a pair of edges, are weighted by
+    forgetting to the power of the number of later updates observing it,
+    the first num_batch trips counting as a single batch.
+    """
+    pairs = {position: pair for pair, position in model.index.items()}
+    size = len(pairs)
+    mean, cov = np.zeros(size), np.zeros((size, size))
+    for i in range(size):
+        for j in range(size):
+            common = [(t, history[pairs[i]], history[pairs[j]]) for t, history in enumerate(trips)
+                      if pairs[i] in history and pairs[j] in history]
+            # Number of updates observing the samples up to each of them
+            later = np.cumsum([t >= num_batch for t, _, _ in common])
+            num_updates = later[-1] if len(common) else 0
+            weights = np.array([forgetting**num_updates if t < num_batch
+                                else forgetting**(num_updates - later[k])
+                                for k, (t, _, _) in enumerate(common)])
+            x = np.array([x for _, x, _ in common], dtype=float)
+            y = np.array([y for _, _, y in common], dtype=float)
+            if i == j:
+                mean[i] = (weights*x).sum()/weights.sum()
+            total = weights.sum()
+            if len(common) >= 2 and total >= 2:
+                mx, my = (weights*x).sum()/total, (weights*y).sum()/total
+                cov[i, j] = (weights*(x - mx)*(y - my)).sum()/(total - 1)
+    return mean, cov
+
+
+# ==========================================================================
+if __name__ == "__main__":
+
+    routes_dict, trips, num_batch = make_trips()
+    G_all = make_network(trips)
+    G_batch = make_network(trips[:num_batch])
+    batch = dm.Model(G_all, routes_dict)
+
+    results = []
+    for forgetting in (1.0, FORGETTING):
+        model = dm.Model(G_batch, routes_dict, forgetting=forgetting)
+        for history in trips[num_batch:]:
+            model.updatemodel(_Observed(history))
+        if forgetting == 1.0:
+            mean, cov = batch.mean.values, batch.cov.matrix.toarray()
+        else:
+            mean, cov = weighted_reference(model, trips, num_batch, forgetting)
+        same_counts = np.array_equal(model.counts, batch.counts)
+        results.append((forgetting, len(model.cov.extra), np.abs(model.mean.values - mean).max(),
+                        np.abs(model.cov.matrix.toarray() - cov).max(), same_counts))
+
+    print("Routes: {}, edges: {}, trips: {} in the batch and {} updates".format(
+        NUM_ROUTES, len(batch.eids), num_batch, len(trips) - num_batch))
+    for forgetting, num_extra, error_mean, error_cov, same_counts in results:
+        print("Forgetting {}: {} pairs first observed in updates, max difference of the means {:.1e}, "
+              "of the covariances {:.1e}, counts match: {}".format(
+                  forgetting, num_extra, error_mean, error_cov, same_counts))
+    assert all(num_extra > 0 and error_mean < TOLERANCE and error_cov < TOLERANCE and same_counts
+               for _, num_extra, error_mean, error_cov, same_counts in results)